@@ -0,0 +1,167 @@
+"""
+asyncio serving mode (ASGI).
+
+    python -m uvicorn asgi_server:app --host 0.0.0.0 --port 5000 --workers 4
+
+Sign-up, login, forgot-password and access-file are served on the event loop
+by routes/async_handlers.py: Supabase calls use the async clients, independent
+ones overlap, and key derivation is awaited on the KDF pool. Every other
+route (pages, records, file streaming, metrics, ...) is the Flask app,
+mounted behind it and run on a thread pool of ASYNC_WSGI_THREADS threads.
+"""
+from a2wsgi import WSGIMiddleware
+from simple_server import app as flask_app
+from database.supabase_client import clients
+from database.resilience import budget
+from jobs.job_queue import job_queue
+from routes import async_handlers
+from security_logic.kdf_executor import kdf_executor
+from security_logic.rate_limiter import rate_limiter
+from security_logic.token_verifier import token_verifier, TokenError
+from observability.metrics import HTTP_REQUEST_SECONDS, METRICS_ENABLED
+from observability.log import get_logger, new_request_id, bind_request_id, unbind_request_id
+from lifecycle import shutdown_process
+import asyncio
+import json
+import os
+import time
+
+# Threads running the Flask routes that have no async handler
+ASYNC_WSGI_THREADS = int(os.getenv("ASYNC_WSGI_THREADS", "16"))
+# The async endpoints take small JSON bodies; larger ones are refused unread
+MAX_JSON_BODY_BYTES = 64 * 1024
+
+log = get_logger(__name__)
+
+
+async def _signup(request):
+    return await async_handlers.signup(request["json"])
+
+async def _login(request):
+    return await async_handlers.login(request["json"], request["client"])
+
+async def _forgot_password(request):
+    return await async_handlers.forgot_password(request["json"])
+
+async def _access_file(request):
+    return await async_handlers.access_file(request["user_id"], request["json"])
+
+# path -> (handler, needs a verified access token)
+ROUTES = {
+    "/api/signup": (_signup, False),
+    "/api/login": (_login, False),
+    "/api/forgot-password": (_forgot_password, False),
+    "/api/access-file": (_access_file, True),
+}
+
+_wsgi = WSGIMiddleware(flask_app, workers=ASYNC_WSGI_THREADS)
+
+
+async def _read_body(receive, limit):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if len(body) > limit:
+            return None
+        if not message.get("more_body"):
+            return bytes(body)
+
+async def _send_json(send, payload, status, headers=None):
+    body = json.dumps(payload).encode()
+    raw_headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        # Same CORS answer as the Flask app (flask_cors with defaults)
+        (b"access-control-allow-origin", b"*"),
+    ]
+    raw_headers += [(name.lower().encode(), str(value).encode()) for name, value in (headers or {}).items()]
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
+
+async def _authenticate(headers):
+    """(user_id, None) for a valid bearer token, else (None, error response) like @require_auth."""
+    auth_header = headers.get(b"authorization", b"").decode("latin-1")
+    if not auth_header.startswith("Bearer "):
+        return None, ({'error': 'Missing or invalid authorization token'}, 401, {})
+    try:
+        # Usually a local signature check, but it may have to ask the auth server
+        verified = await asyncio.to_thread(token_verifier.verify, auth_header.split('Bearer ')[1])
+    except TokenError as e:
+        log.info("token_rejected", reason=str(e))
+        return None, ({'error': 'Invalid or expired token'}, 401, {})
+    except Exception:
+        log.exception("token_verification_error")
+        return None, ({'error': 'Authentication service unavailable'}, 503, {})
+    return verified.user_id, None
+
+async def _handle(scope, receive, send, handler, needs_auth):
+    path = scope["path"]
+    client = scope["client"][0] if scope.get("client") else None
+
+    allowed, retry_after, limited_scope = rate_limiter.check(path, client)
+    if not allowed:
+        log.info("rate_limited", ip=client, scope=limited_scope, path=path, retry_after=retry_after)
+        return {
+            'error': 'rate_limited',
+            'message': f'Too many requests. Please try again in {retry_after} seconds.',
+            'retry_after_seconds': retry_after
+        }, 429, {'Retry-After': str(retry_after)}
+
+    headers = dict(scope["headers"])
+    user_id = None
+    if needs_auth:
+        user_id, rejected = await _authenticate(headers)
+        if rejected:
+            return rejected
+
+    body = await _read_body(receive, MAX_JSON_BODY_BYTES)
+    if body is None:
+        return {'error': 'Request body is too large'}, 413, {}
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    return await handler({"json": data, "client": client, "user_id": user_id})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            job_queue.start()
+            await asyncio.to_thread(kdf_executor.warm_up)
+            log.info("worker_ready", pid=os.getpid(), mode="asgi")
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await clients.aclose_async()
+            await asyncio.to_thread(shutdown_process)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+
+    route = ROUTES.get(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+    if route is None:
+        return await _wsgi(scope, receive, send)
+
+    started = time.perf_counter()
+    request_id = new_request_id(dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1"))
+    token = bind_request_id(request_id)
+    try:
+        # All Supabase calls for this request share one deadline (database/resilience.py)
+        with budget():
+            payload, status, headers = await _handle(scope, receive, send, *route)
+        await _send_json(send, payload, status, {**headers, "X-Request-ID": request_id})
+    finally:
+        unbind_request_id(token)
+    if METRICS_ENABLED:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                     method="POST", route=scope["path"], status=status)
@@ -0,0 +1,438 @@
+"""
+In-memory stand-in for the Supabase auth and PostgREST endpoints the backend uses.
+
+It implements just enough of both APIs for the app's own queries: table
+select/insert/upsert/update/delete with eq/neq/gt/gte/lt/lte/in/is filters,
+order, limit, exact counts, the lockout RPCs, and the auth signup, password
+grant and user endpoints. Every request can be delayed by a configurable
+latency so benchmarks can model a remote project.
+
+It is a benchmarking tool, not a test double: there is no RLS, no type
+system and no transaction isolation beyond one global lock.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+from datetime import datetime, timedelta, timezone
+import json
+import random
+import threading
+import time
+import uuid
+import jwt
+
+# Primary key of each table; serial keys are generated on insert
+_PRIMARY_KEYS = {
+    "profiles": ("user_id",),
+    "login_attempts": ("attempt_id",),
+    "account_locks": ("lock_id",),
+    "user_data": ("data_id",),
+    "user_data_chunks": ("data_id", "seq"),
+    "login_attempt_daily": ("day", "user_id"),
+    "user_keys": ("user_id",),
+}
+_SERIALS = {"login_attempts": "attempt_id", "account_locks": "lock_id", "user_data": "data_id"}
+_DEFAULTS = {"user_data": {"storage_format": "fernet", "encrypted": True}, "profiles": {"is_locked": False}}
+_RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _coerce(row_value, literal):
+    """Converts a filter literal to something comparable with the stored value."""
+    if isinstance(row_value, bool):
+        return literal == "true"
+    if isinstance(row_value, int):
+        return int(literal)
+    if isinstance(row_value, float):
+        return float(literal)
+    return literal
+
+
+def _comparable(value):
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _split_in_list(literal):
+    items = []
+    for part in literal.strip("()").split(","):
+        items.append(part[1:-1] if len(part) >= 2 and part[0] == part[-1] == '"' else part)
+    return items
+
+
+def _matches(row, column, expression):
+    op, _, literal = expression.partition(".")
+    value = row.get(column)
+    if op == "is":
+        return value is None if literal == "null" else value == (literal == "true")
+    if value is None:
+        return False
+    if op == "in":
+        return any(value == _coerce(value, v) for v in _split_in_list(literal))
+    other = _coerce(value, literal)
+    if op == "eq":
+        return value == other
+    if op == "neq":
+        return value != other
+    left, right = _comparable(value), _comparable(other)
+    if type(left) is not type(right):
+        left, right = str(value), str(other)
+    return {"gt": left > right, "gte": left >= right, "lt": left < right, "lte": left <= right}.get(op, False)
+
+
+class FakeSupabase:
+    """State plus the auth and PostgREST semantics, independent of HTTP."""
+
+    def __init__(self, jwt_secret, latency_ms=0.0, jitter_ms=0.0):
+        self.jwt_secret = jwt_secret
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tables = {name: [] for name in _PRIMARY_KEYS}
+        self.users = {}  # email -> {"id", "password", "created_at"}
+        self._serial = {name: 0 for name in _SERIALS}
+        self._lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+        self.calls = {}  # endpoint -> [count, total_seconds]
+
+    # --- bookkeeping ---
+    def delay(self):
+        if self.latency_ms or self.jitter_ms:
+            time.sleep(max(self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms), 0.0) / 1000)
+
+    def record_call(self, endpoint, seconds):
+        with self._stats_lock:
+            entry = self.calls.setdefault(endpoint, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def call_stats(self):
+        with self._stats_lock:
+            return {
+                endpoint: {"count": count, "avg_ms": round(total / count * 1000, 3)}
+                for endpoint, (count, total) in sorted(self.calls.items())
+            }
+
+    # --- auth ---
+    def _user_json(self, user):
+        return {
+            "id": user["id"],
+            "aud": "authenticated",
+            "role": "authenticated",
+            "email": user["email"],
+            "app_metadata": {"provider": "email"},
+            "user_metadata": {},
+            "created_at": user["created_at"],
+            "email_confirmed_at": user["created_at"],
+        }
+
+    def _session_json(self, user):
+        now = int(time.time())
+        token = jwt.encode({
+            "sub": user["id"],
+            "aud": "authenticated",
+            "role": "authenticated",
+            "email": user["email"],
+            "iat": now,
+            "exp": now + 3600,
+        }, self.jwt_secret, algorithm="HS256")
+        return {
+            "access_token": token,
+            "token_type": "bearer",
+            "expires_in": 3600,
+            "expires_at": now + 3600,
+            "refresh_token": uuid.uuid4().hex,
+            "user": self._user_json(user),
+        }
+
+    def create_user(self, email, password):
+        """Creates an auth user and, like the on_auth_user_created trigger, an empty profile."""
+        with self._lock:
+            if email in self.users:
+                return None
+            user = {"id": str(uuid.uuid4()), "email": email, "password": password, "created_at": _now().isoformat()}
+            self.users[email] = user
+            self.tables["profiles"].append({"user_id": user["id"], "is_locked": False})
+            return user
+
+    def seed_user(self, email, password, username=None):
+        """Creates a confirmed user with a filled-in profile (benchmark setup)."""
+        user = self.create_user(email, password) or self.users[email]
+        with self._lock:
+            for profile in self.tables["profiles"]:
+                if profile["user_id"] == user["id"]:
+                    profile.update({"email": email, "username": username or email.split("@")[0]})
+        return user
+
+    def auth_signup(self, body):
+        user = self.create_user(body.get("email"), body.get("password"))
+        if user is None:
+            return 422, {"code": "user_already_exists", "error_code": "user_already_exists",
+                         "msg": "User already registered"}
+        return 200, self._session_json(user)
+
+    def auth_password_grant(self, body):
+        user = self.users.get(body.get("email"))
+        if user is None or user["password"] != body.get("password"):
+            return 400, {"code": "invalid_credentials", "error_code": "invalid_credentials",
+                         "msg": "Invalid login credentials"}
+        return 200, self._session_json(user)
+
+    def auth_user(self, token):
+        try:
+            claims = jwt.decode(token, self.jwt_secret, algorithms=["HS256"], audience="authenticated")
+        except jwt.InvalidTokenError as e:
+            return 401, {"code": "bad_jwt", "error_code": "bad_jwt", "msg": str(e)}
+        for user in self.users.values():
+            if user["id"] == claims["sub"]:
+                return 200, self._user_json(user)
+        return 404, {"code": "user_not_found", "error_code": "user_not_found", "msg": "User not found"}
+
+    # --- PostgREST ---
+    def _filtered(self, table, filters):
+        return [row for row in self.tables[table] if all(_matches(row, c, e) for c, e in filters)]
+
+    @staticmethod
+    def _project(rows, select):
+        if not select or select.strip() == "*":
+            return [dict(row) for row in rows]
+        columns = [c.strip() for c in select.split(",") if c.strip()]
+        return [{c: row.get(c) for c in columns} for row in rows]
+
+    def select(self, table, params, filters):
+        with self._lock:
+            rows = self._filtered(table, filters)
+            total = len(rows)
+            for clause in reversed(params.get("order", "").split(",") if params.get("order") else []):
+                column, _, direction = clause.partition(".")
+                rows.sort(key=lambda r: (r.get(column) is None, _comparable(r.get(column))),
+                          reverse=direction.startswith("desc"))
+            offset = int(params.get("offset", 0))
+            rows = rows[offset:]
+            if "limit" in params:
+                rows = rows[:int(params["limit"])]
+            return self._project(rows, params.get("select")), total
+
+    def insert(self, table, rows, upsert=False, on_conflict=None, ignore_duplicates=False):
+        key = tuple(on_conflict.split(",")) if on_conflict else _PRIMARY_KEYS[table]
+        written = []
+        with self._lock:
+            for row in rows:
+                row = {**_DEFAULTS.get(table, {}), **row}
+                serial = _SERIALS.get(table)
+                if serial and row.get(serial) is None:
+                    self._serial[table] += 1
+                    row[serial] = self._serial[table]
+                if table == "login_attempts":
+                    row.setdefault("timestamp", _now().isoformat())
+                if table == "account_locks":
+                    row.setdefault("locked_at", _now().isoformat())
+                if table == "user_keys":
+                    row.setdefault("wrapped_at", _now().isoformat())
+                existing = None
+                if all(k in row for k in key):
+                    existing = next((r for r in self.tables[table] if all(r.get(k) == row[k] for k in key)), None)
+                if existing is not None:
+                    if ignore_duplicates:
+                        continue
+                    if not upsert:
+                        return 409, {"code": "23505", "message": f"duplicate key value violates unique constraint on {table}"}
+                    existing.update(row)
+                    written.append(dict(existing))
+                else:
+                    self.tables[table].append(row)
+                    written.append(dict(row))
+        return 201, written
+
+    def update(self, table, filters, values):
+        with self._lock:
+            rows = self._filtered(table, filters)
+            for row in rows:
+                row.update(values)
+            return [dict(row) for row in rows]
+
+    def delete(self, table, filters):
+        with self._lock:
+            rows = self._filtered(table, filters)
+            doomed = {id(row) for row in rows}
+            self.tables[table] = [row for row in self.tables[table] if id(row) not in doomed]
+            if table == "user_data":
+                data_ids = {row["data_id"] for row in rows}
+                self.tables["user_data_chunks"] = [c for c in self.tables["user_data_chunks"]
+                                                   if c["data_id"] not in data_ids]
+            return [dict(row) for row in rows]
+
+    # --- RPC (mirrors docs/database_schema.sql sections 7 and 8) ---
+    def _latest_lock(self, user_id):
+        locks = [l for l in self.tables["account_locks"] if l["user_id"] == user_id]
+        return max(locks, key=lambda l: _comparable(l["locked_at"]), default=None), len(locks)
+
+    def rpc(self, name, params):
+        handler = getattr(self, f"_rpc_{name}", None)
+        if handler is None:
+            return 404, {"code": "PGRST202", "message": f"Could not find the function public.{name}"}
+        with self._lock:
+            return 200, handler(**params)
+
+    def _rpc_login_security_check(self, p_email):
+        profile = next((p for p in self.tables["profiles"] if p.get("email") == p_email), None)
+        if profile is None:
+            return []
+        lock, _ = self._latest_lock(profile["user_id"])
+        now = _now()
+        unlock_at = _comparable(lock["unlock_at"]) if lock else None
+        remaining = max(int((unlock_at - now).total_seconds()), 0) if unlock_at else 0
+        return [{
+            "user_id": profile["user_id"],
+            "is_locked": bool(unlock_at and unlock_at > now),
+            "unlock_at": lock["unlock_at"] if lock else None,
+            "remaining_seconds": remaining,
+        }]
+
+    def _rpc_record_login_failure(self, p_user_id, p_email, p_ip, p_reason, p_log_attempt,
+                                  p_max_attempts, p_window_seconds, p_base_lock_seconds):
+        now = _now()
+        if p_log_attempt:
+            self.insert("login_attempts", [{
+                "user_id": p_user_id, "username_attempted": p_email, "success": False,
+                "failure_reason": p_reason, "ip_address": p_ip, "timestamp": now.isoformat(),
+            }])
+        window_start = now - timedelta(seconds=p_window_seconds)
+        failures = sum(1 for a in self.tables["login_attempts"]
+                       if a.get("user_id") == p_user_id and a.get("success") is False
+                       and _comparable(a["timestamp"]) >= window_start)
+        if failures < p_max_attempts:
+            return [{"locked": False, "lock_seconds": 0, "failed_count": failures, "lock_created": False}]
+
+        latest, previous_locks = self._latest_lock(p_user_id)
+        recent = latest is not None and _comparable(latest["locked_at"]) >= now - timedelta(minutes=1)
+        lock_seconds = p_base_lock_seconds * (previous_locks + 1)
+        if not recent:
+            self.insert("account_locks", [{
+                "user_id": p_user_id, "locked_at": now.isoformat(),
+                "unlock_at": (now + timedelta(seconds=lock_seconds)).isoformat(),
+                "failed_attempts_count": failures,
+            }])
+            self.update("profiles", [("user_id", f"eq.{p_user_id}")], {"is_locked": True})
+        return [{"locked": True, "lock_seconds": lock_seconds, "failed_count": failures, "lock_created": not recent}]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, delayed ACKs add ~40 ms per call
+    disable_nagle_algorithm = True
+    fake = None  # set on the per-server subclass
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        # Always consume the body, even on GET (postgrest-py sends "{}"), to keep the connection usable
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        return json.loads(raw) if raw.strip() else None
+
+    def _send(self, status, payload=None, headers=None):
+        body = b"" if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self):
+        started = time.perf_counter()
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query, keep_blank_values=True))
+        filters = [(k, v) for k, v in parse_qsl(url.query, keep_blank_values=True) if k not in _RESERVED_PARAMS]
+        body = self._body()
+        fake = self.fake
+        fake.delay()
+
+        path = url.path
+        endpoint = f"{self.command} {path}"
+        if path.startswith("/auth/v1/"):
+            route = path[len("/auth/v1/"):]
+            if route == "signup" and self.command == "POST":
+                status, payload = fake.auth_signup(body or {})
+            elif route == "token" and params.get("grant_type") == "password":
+                endpoint = f"POST {path}?grant_type=password"
+                status, payload = fake.auth_password_grant(body or {})
+            elif route == "user" and self.command == "GET":
+                status, payload = fake.auth_user(self.headers.get("Authorization", "").removeprefix("Bearer "))
+            elif route == "recover":
+                status, payload = 200, {}
+            else:
+                status, payload = 404, {"code": "not_found", "error_code": "not_found", "msg": f"No route {path}"}
+            self._send(status, payload)
+        elif path.startswith("/rest/v1/rpc/"):
+            status, payload = fake.rpc(path[len("/rest/v1/rpc/"):], body or {})
+            self._send(status, payload)
+        elif path.startswith("/rest/v1/"):
+            table = path[len("/rest/v1/"):]
+            if table not in fake.tables:
+                self._send(404, {"code": "42P01", "message": f'relation "public.{table}" does not exist'})
+            else:
+                self._rest(table, params, filters, body)
+        else:
+            self._send(404, {"message": f"No route {path}"})
+        fake.record_call(endpoint, time.perf_counter() - started)
+
+    def _rest(self, table, params, filters, body):
+        fake = self.fake
+        prefer = self.headers.get("Prefer", "")
+        minimal = "return=minimal" in prefer
+        if self.command in ("GET", "HEAD"):
+            rows, total = fake.select(table, params, filters)
+            headers = {}
+            if "count=" in prefer:
+                headers["Content-Range"] = f"0-{max(len(rows) - 1, 0)}/{total}" if rows else f"*/{total}"
+            self._send(200, rows, headers)
+        elif self.command == "POST":
+            rows = body if isinstance(body, list) else [body]
+            status, written = fake.insert(table, rows, upsert="resolution=merge-duplicates" in prefer,
+                                          on_conflict=params.get("on_conflict"),
+                                          ignore_duplicates="resolution=ignore-duplicates" in prefer)
+            self._send(status, None if minimal and status < 300 else written)
+        elif self.command == "PATCH":
+            updated = fake.update(table, filters, body or {})
+            self._send(200, None if minimal else updated)
+        elif self.command == "DELETE":
+            deleted = fake.delete(table, filters)
+            self._send(200, None if minimal else deleted)
+        else:
+            self._send(405, {"message": "method not allowed"})
+
+    do_GET = do_POST = do_PATCH = do_DELETE = do_PUT = do_HEAD = _dispatch
+
+
+class FakeSupabaseServer:
+    """Serves a FakeSupabase over HTTP on a background thread."""
+
+    def __init__(self, fake, host="127.0.0.1", port=0):
+        self.fake = fake
+        handler = type("FakeSupabaseHandler", (_Handler,), {"fake": fake})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-supabase", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
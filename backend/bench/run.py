@@ -0,0 +1,447 @@
+"""
+End-to-end load benchmark for the Flask app against a local Supabase stand-in.
+
+Starts bench/fake_supabase.py on a free port, points the app at it, serves
+simple_server.app on another port and drives a weighted mix of requests
+from concurrent clients. Reports p50/p95/p99 latency, requests/sec and a
+per-stage breakdown (time spent in each upstream call and in key
+derivation) for every scenario, and writes everything to a JSON file so
+runs can be compared.
+
+Usage (from the backend/ directory):
+    python -m bench.run --duration 30 --concurrency 16 --latency-ms 20
+    python -m bench.run --mix login_ok=60,login_bruteforce=20,access_file=20 --output after.json \\
+                        --baseline before.json --fail-on-regression 10
+    python -m bench.run --server asgi --output asgi.json --baseline wsgi.json
+
+Servers (--server):
+    wsgi              simple_server.app on threaded werkzeug (default)
+    asgi              asgi_server.app on uvicorn
+The per-stage breakdown covers the synchronous code paths only (not the
+endpoints in routes/async_handlers.py).
+
+Scenarios:
+    login_ok          correct password for one of --users seeded accounts
+    login_bruteforce  wrong password for one of --victims accounts (trips the lockout)
+    access_file       /api/access-file with a token obtained during setup
+    signup            a brand-new account
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+import jwt
+
+from bench.fake_supabase import FakeSupabase, FakeSupabaseServer
+
+DEFAULT_MIX = "login_ok=50,login_bruteforce=20,access_file=25,signup=5"
+# Statuses that are the expected outcome of each scenario (503 = shed by the KDF queue, counted apart)
+EXPECTED_STATUS = {
+    "login_ok": {200},
+    "login_bruteforce": {401, 429},
+    "access_file": {200},
+    "signup": {201},
+}
+
+
+# --- per-stage timing inside the app process ---
+class _StageRecorder:
+    """Collects (stage -> calls, seconds) for the request running on the current thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def begin(self):
+        self._local.stages = {}
+
+    def add(self, stage, seconds):
+        stages = getattr(self._local, "stages", None)
+        if stages is not None:
+            entry = stages.setdefault(stage, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def end(self):
+        stages = getattr(self._local, "stages", None) or {}
+        self._local.stages = None
+        return stages
+
+
+def _stage_name(request):
+    path = request.url.path
+    if path.startswith("/rest/v1/rpc/"):
+        return "rpc." + path[len("/rest/v1/rpc/"):]
+    if path.startswith("/rest/v1/"):
+        return f"rest.{request.method} {path[len('/rest/v1/'):]}"
+    if path.startswith("/auth/v1/"):
+        return "auth." + path[len("/auth/v1/"):]
+    return f"http.{request.method} {path}"
+
+
+class _TimedTransport(httpx.BaseTransport):
+    """Times every upstream request; installed in place of the app's shared transport."""
+
+    def __init__(self, transport, recorder):
+        self._transport = transport
+        self._recorder = recorder
+
+    def handle_request(self, request):
+        started = time.perf_counter()
+        try:
+            response = self._transport.handle_request(request)
+            # Read the body here so the stage covers the whole round trip, not just the headers
+            response.read()
+            return response
+        finally:
+            self._recorder.add(_stage_name(request), time.perf_counter() - started)
+
+    def close(self):
+        pass
+
+
+def _instrument_app(app, recorder):
+    """Reports the request's stage timings to the client in an X-Bench-Stages header."""
+    from database.supabase_client import clients
+    from security_logic.kdf_executor import kdf_executor
+
+    clients._transport = _TimedTransport(clients.transport(), recorder)
+
+    run = kdf_executor.run
+    def timed_run(fn, *args):
+        started = time.perf_counter()
+        try:
+            return run(fn, *args)
+        finally:
+            recorder.add("kdf", time.perf_counter() - started)
+    kdf_executor.run = timed_run
+
+    wsgi_app = app.wsgi_app
+    def middleware(environ, start_response):
+        recorder.begin()
+        def record_start_response(status, headers, exc_info=None):
+            stages = {name: [calls, round(seconds, 6)] for name, (calls, seconds) in recorder.end().items()}
+            return start_response(status, headers + [("X-Bench-Stages", json.dumps(stages))], exc_info)
+        return wsgi_app(environ, record_start_response)
+    app.wsgi_app = middleware
+
+
+class _AsgiServer:
+    """asgi_server.app on uvicorn in a background thread, with make_server()'s interface."""
+
+    def __init__(self):
+        import socket
+        import uvicorn
+        from asgi_server import app
+
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        self.server_port = sock.getsockname()[1]
+        self._server = uvicorn.Server(uvicorn.Config(app, log_level="warning", access_log=False))
+        self._thread = threading.Thread(target=self._server.run, kwargs={"sockets": [sock]},
+                                        name="bench-app", daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+
+    def shutdown(self):
+        self._server.should_exit = True
+        self._thread.join()
+
+
+# --- load generation ---
+class _Workload:
+    def __init__(self, base_url, users, victims, run_id):
+        self.base_url = base_url
+        self.users = users          # [(email, password)]
+        self.victims = victims      # [email]
+        self.tokens = {}            # email -> access token
+        self.run_id = run_id
+        self._signup_ids = itertools.count()
+
+    def setup(self, client):
+        """Logs every benchmark user in once and creates their data file (not measured)."""
+        for email, password in self.users:
+            res = client.post("/api/login", json={"email": email, "password": password})
+            if res.status_code != 200:
+                raise RuntimeError(f"setup login failed for {email}: {res.status_code} {res.text}")
+            token = res.json()["access_token"]
+            self.tokens[email] = token
+            res = client.post("/api/access-file", json={"password": password},
+                              headers={"Authorization": f"Bearer {token}"})
+            if res.status_code != 200:
+                raise RuntimeError(f"setup access-file failed for {email}: {res.status_code} {res.text}")
+
+    def request(self, client, scenario):
+        if scenario == "login_ok":
+            email, password = random.choice(self.users)
+            return client.post("/api/login", json={"email": email, "password": password})
+        if scenario == "login_bruteforce":
+            return client.post("/api/login", json={"email": random.choice(self.victims), "password": "wrong-password"})
+        if scenario == "access_file":
+            email, password = random.choice(self.users)
+            return client.post("/api/access-file", json={"password": password},
+                               headers={"Authorization": f"Bearer {self.tokens[email]}"})
+        if scenario == "signup":
+            n = next(self._signup_ids)
+            return client.post("/api/signup", json={
+                "username": f"bench-{self.run_id}-{n}",
+                "email": f"bench-{self.run_id}-{n}@example.com",
+                "password": "Bench-Password-1",
+            })
+        raise ValueError(f"unknown scenario {scenario}")
+
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in EXPECTED_STATUS:
+            raise SystemExit(f"unknown scenario {name!r}, choose from {', '.join(EXPECTED_STATUS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def _drive(workload, base_url, mix, concurrency, duration, max_requests):
+    samples = []
+    samples_lock = threading.Lock()
+    names, weights = list(mix), list(mix.values())
+    deadline = time.perf_counter() + duration
+    budget = itertools.count()
+
+    def worker():
+        local = []
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            while time.perf_counter() < deadline:
+                if max_requests and next(budget) >= max_requests:
+                    break
+                scenario = random.choices(names, weights)[0]
+                started = time.perf_counter()
+                try:
+                    res = workload.request(client, scenario)
+                    status = res.status_code
+                    stages = json.loads(res.headers.get("X-Bench-Stages", "{}"))
+                except httpx.HTTPError as e:
+                    status, stages = f"error:{type(e).__name__}", {}
+                local.append((scenario, status, time.perf_counter() - started, stages))
+        with samples_lock:
+            samples.extend(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, name=f"bench-client-{i}") for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, time.perf_counter() - started
+
+
+def _summarize(samples, elapsed):
+    scenarios = {}
+    for scenario in sorted({s[0] for s in samples}):
+        rows = [s for s in samples if s[0] == scenario]
+        latencies = sorted(s[2] * 1000 for s in rows)
+        status_counts = {}
+        stage_totals = {}
+        for _, status, _, stages in rows:
+            status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+            for stage, (calls, seconds) in stages.items():
+                total = stage_totals.setdefault(stage, [0, 0.0])
+                total[0] += calls
+                total[1] += seconds
+        n = len(rows)
+        stages_ms = {
+            stage: {"calls_per_request": round(calls / n, 3), "mean_ms": round(seconds / n * 1000, 3)}
+            for stage, (calls, seconds) in sorted(stage_totals.items(), key=lambda kv: -kv[1][1])
+        }
+        mean = sum(latencies) / n
+        scenarios[scenario] = {
+            "requests": n,
+            "rps": round(n / elapsed, 2),
+            "unexpected": sum(c for st, c in status_counts.items()
+                              if st != "503" and not (st.isdigit() and int(st) in EXPECTED_STATUS[scenario])),
+            "shed_503": status_counts.get("503", 0),
+            "status_counts": status_counts,
+            "latency_ms": {
+                "mean": round(mean, 3),
+                "p50": round(_percentile(latencies, 50), 3),
+                "p95": round(_percentile(latencies, 95), 3),
+                "p99": round(_percentile(latencies, 99), 3),
+                "max": round(latencies[-1], 3),
+            },
+            "stages_ms": stages_ms,
+            # Time inside the app not spent waiting on Supabase or the KDF (routing, JSON, crypto, queueing)
+            "unaccounted_ms": round(max(mean - sum(s["mean_ms"] for s in stages_ms.values()), 0.0), 3),
+        }
+    return {
+        "requests": len(samples),
+        "duration_s": round(elapsed, 3),
+        "rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "scenarios": scenarios,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_report(results):
+    print(f"\n{results['totals']['requests']} requests in {results['totals']['duration_s']}s "
+          f"({results['totals']['rps']} req/s)")
+    print(f"{'scenario':<18}{'reqs':>7}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'unexp':>7}{'503':>6}")
+    for name, s in results["totals"]["scenarios"].items():
+        lat = s["latency_ms"]
+        print(f"{name:<18}{s['requests']:>7}{s['rps']:>9}{lat['p50']:>9}{lat['p95']:>9}{lat['p99']:>9}"
+              f"{s['unexpected']:>7}{s['shed_503']:>6}")
+        for stage, st in s["stages_ms"].items():
+            print(f"    {stage:<40}{st['calls_per_request']:>6} calls {st['mean_ms']:>10} ms")
+        print(f"    {'(app, unaccounted)':<40}{'':>12}{s['unaccounted_ms']:>10} ms")
+
+
+def _compare(results, baseline_path, threshold):
+    """Prints p95 and throughput changes against an earlier run. Returns False on a regression beyond threshold."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    ok = True
+    print(f"\nCompared with {baseline_path} ({baseline.get('meta', {}).get('git_commit')}):")
+    for name, s in results["totals"]["scenarios"].items():
+        before = baseline.get("totals", {}).get("scenarios", {}).get(name)
+        if not before:
+            continue
+        p95_change = (s["latency_ms"]["p95"] / before["latency_ms"]["p95"] - 1) * 100 if before["latency_ms"]["p95"] else 0.0
+        rps_change = (s["rps"] / before["rps"] - 1) * 100 if before["rps"] else 0.0
+        flag = ""
+        if threshold is not None and (p95_change > threshold or rps_change < -threshold):
+            flag, ok = "  REGRESSION", False
+        print(f"  {name:<18} p95 {before['latency_ms']['p95']:>9} -> {s['latency_ms']['p95']:>9} ms ({p95_change:+.1f}%)"
+              f"   req/s {before['rps']:>8} -> {s['rps']:>8} ({rps_change:+.1f}%){flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the app against a local Supabase stand-in.")
+    parser.add_argument("--server", choices=("wsgi", "asgi"), default="wsgi",
+                        help="How the app is served (default: wsgi)")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of measured load (default: 20)")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests (default: no limit)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients (default: 8)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Scenario weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--users", type=int, default=20, help="Accounts used by login_ok/access_file (default: 20)")
+    parser.add_argument("--victims", type=int, default=5, help="Accounts hit by login_bruteforce (default: 5)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latency added to every Supabase call")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Random +/- jitter on that latency")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for a repeatable request sequence")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--fail-on-regression", type=float, default=None, metavar="PCT",
+                        help="Exit 1 if any scenario's p95 grows or req/s drops by more than PCT percent")
+    args = parser.parse_args()
+    mix = _parse_mix(args.mix)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    # 1. Fake Supabase, and the app configured to talk to it (before any app module is imported)
+    jwt_secret = uuid.uuid4().hex
+    fake = FakeSupabase(jwt_secret, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+    fake_server = FakeSupabaseServer(fake).start()
+    os.environ.update({
+        "SUPABASE_URL": fake_server.url,
+        # supabase-py only accepts JWT-shaped API keys
+        "SUPABASE_ANON_KEY": jwt.encode({"role": "anon"}, jwt_secret, algorithm="HS256"),
+        "SUPABASE_SERVICE_KEY": jwt.encode({"role": "service_role"}, jwt_secret, algorithm="HS256"),
+        "SUPABASE_JWT_SECRET": jwt_secret,
+        "SUPABASE_HTTP2": "false",
+        # Every simulated client comes from 127.0.0.1
+        "RATE_LIMIT_ENABLED": "false",
+        # Never mix benchmark rows into the real spill file
+        "AUDIT_SPILL_PATH": os.path.join(tempfile.gettempdir(), f"bench_audit_spill_{os.getpid()}.jsonl"),
+        "JOB_QUEUE_PATH": os.path.join(tempfile.gettempdir(), f"bench_jobs_{os.getpid()}.sqlite3"),
+    })
+
+    from werkzeug.serving import make_server
+    from simple_server import app
+    from security_logic.kdf_executor import kdf_executor
+    from security_logic.audit_logger import audit_logger
+
+    recorder = _StageRecorder()
+    _instrument_app(app, recorder)
+    if args.server == "asgi":
+        app_server = _AsgiServer()
+    else:
+        app_server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=app_server.serve_forever, name="bench-app", daemon=True).start()
+    base_url = f"http://127.0.0.1:{app_server.server_port}"
+
+    # 2. Seed accounts and warm up
+    run_id = uuid.uuid4().hex[:8]
+    users = [(f"bench-user-{i}@example.com", f"Bench-Password-{i}") for i in range(args.users)]
+    victims = [f"bench-victim-{i}@example.com" for i in range(args.victims)]
+    for email, password in users:
+        fake.seed_user(email, password)
+    for email in victims:
+        fake.seed_user(email, uuid.uuid4().hex)
+
+    workload = _Workload(base_url, users, victims, run_id)
+    print(f"Fake Supabase at {fake_server.url} (latency {args.latency_ms}±{args.jitter_ms} ms), app at {base_url}")
+    print(f"Setting up {len(users)} users...")
+    with httpx.Client(base_url=base_url, timeout=60) as client:
+        workload.setup(client)
+
+    # 3. Measured run
+    print(f"Running {args.mix} with {args.concurrency} clients for {args.duration}s...")
+    samples, elapsed = _drive(workload, base_url, mix, args.concurrency, args.duration, args.requests)
+    audit_logger.flush()
+
+    results = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": vars(args),
+        },
+        "totals": _summarize(samples, elapsed),
+        "upstream_calls": fake.call_stats(),
+        "kdf_executor": kdf_executor.stats(),
+        "audit_logger": audit_logger.stats(),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    _print_report(results)
+    print(f"\nResults written to {args.output}")
+
+    ok = True
+    if args.baseline:
+        ok = _compare(results, args.baseline, args.fail_on_regression)
+
+    app_server.shutdown()
+    fake_server.stop()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+from database.supabase_client import get_supabase_admin, to_bytea, from_bytea
+import os
+
+# An encrypted stream is stored as ordered user_data_chunks rows of roughly this size.
+CHUNK_STORAGE_SEGMENT_BYTES = int(os.getenv("CHUNK_STORAGE_SEGMENT_BYTES", str(512 * 1024)))
+# Segments sent per insert request / fetched per select request.
+CHUNK_STORAGE_BATCH = int(os.getenv("CHUNK_STORAGE_BATCH", "4"))
+
+
+def write_stream(data_id, stream) -> int:
+    """
+    Stores an iterable of byte strings as user_data_chunks rows for data_id.
+    At most CHUNK_STORAGE_BATCH segments are held in memory at once.
+    Returns the number of bytes stored.
+    """
+    admin = get_supabase_admin()
+    buffer = bytearray()
+    batch = []
+    seq = 0
+    stored = 0
+
+    def flush(rows):
+        if rows:
+            admin.table("user_data_chunks").insert(rows, returning="minimal").execute()
+
+    for piece in stream:
+        buffer += piece
+        while len(buffer) >= CHUNK_STORAGE_SEGMENT_BYTES:
+            segment = bytes(buffer[:CHUNK_STORAGE_SEGMENT_BYTES])
+            del buffer[:CHUNK_STORAGE_SEGMENT_BYTES]
+            batch.append({"data_id": data_id, "seq": seq, "chunk": to_bytea(segment)})
+            seq += 1
+            stored += len(segment)
+            if len(batch) >= CHUNK_STORAGE_BATCH:
+                flush(batch)
+                batch = []
+    if buffer:
+        batch.append({"data_id": data_id, "seq": seq, "chunk": to_bytea(bytes(buffer))})
+        stored += len(buffer)
+    flush(batch)
+    return stored
+
+
+def read_stream(data_id):
+    """Yields the stored segments for data_id in order, fetching CHUNK_STORAGE_BATCH rows at a time."""
+    admin = get_supabase_admin()
+    next_seq = 0
+    while True:
+        res = admin.table("user_data_chunks") \
+                   .select("seq, chunk") \
+                   .eq("data_id", data_id) \
+                   .gte("seq", next_seq) \
+                   .order("seq") \
+                   .limit(CHUNK_STORAGE_BATCH) \
+                   .execute()
+        if not res.data:
+            return
+        for row in res.data:
+            yield from_bytea(row["chunk"])
+        next_seq = res.data[-1]["seq"] + 1
+        if len(res.data) < CHUNK_STORAGE_BATCH:
+            return
+
+
+def delete_stream(data_id):
+    get_supabase_admin().table("user_data_chunks").delete().eq("data_id", data_id).execute()
@@ -0,0 +1,22 @@
+from database.supabase_client import get_supabase_admin
+
+
+def fetch_profile(user_id):
+    """Returns the user's `profiles` row (what the profile cache holds for them), or None."""
+    # "*" so tokens_valid_after and password_changed_at are optional until migrations 008 / 009 have run
+    res = get_supabase_admin().table("profiles").select("*").eq("user_id", user_id).limit(1).execute()
+    return res.data[0] if res.data else None
+
+def set_tokens_valid_after(user_id, moment):
+    """Rejects the user's access tokens issued before `moment` (an aware datetime), in every process."""
+    get_supabase_admin().table("profiles") \
+        .update({"tokens_valid_after": moment.isoformat()}) \
+        .eq("user_id", user_id) \
+        .execute()
+
+def set_password_changed_at(user_id, moment):
+    """Records a password change, so data keys wrapped before it are known to be stale (user_keys.py)."""
+    get_supabase_admin().table("profiles") \
+        .update({"password_changed_at": moment.isoformat()}) \
+        .eq("user_id", user_id) \
+        .execute()
@@ -0,0 +1,266 @@
+"""
+Failure handling for Supabase calls, applied to every request by the pooled
+transports in supabase_client.py:
+
+  - Deadline budget: a request to this app gets SUPABASE_REQUEST_BUDGET_SECONDS
+    for all of its Supabase calls together. Each call's timeout is cut to what
+    is left, and a call with nothing left fails at once with DeadlineExceeded.
+  - Retries: idempotent reads (GET, and the read-only RPCs listed in
+    SUPABASE_IDEMPOTENT_RPCS) are retried on connection errors, timeouts and
+    502/503/504, a bounded number of times with jittered exponential backoff,
+    and only while the budget allows.
+  - Circuit breaker per table / RPC / auth endpoint: after
+    SUPABASE_BREAKER_FAILURES consecutive failures, calls fail fast with
+    CircuitOpenError for SUPABASE_BREAKER_OPEN_SECONDS, then a few probe calls
+    decide whether it closes again.
+  - Degraded modes: callers that must decide what a failure means (e.g. the
+    lock check) look up their policy with degraded_mode(caller).
+
+CircuitOpenError and DeadlineExceeded are httpx.TransportError subclasses, so
+callers see them like any other connection failure.
+"""
+from contextlib import contextmanager
+from observability.metrics import registry
+import contextvars
+import os
+import random
+import threading
+import time
+import httpx
+
+# Time all Supabase calls of one incoming request may take together (0 = no budget)
+SUPABASE_REQUEST_BUDGET_SECONDS = float(os.getenv("SUPABASE_REQUEST_BUDGET_SECONDS", "15"))
+# Extra attempts for an idempotent read
+SUPABASE_RETRY_ATTEMPTS = int(os.getenv("SUPABASE_RETRY_ATTEMPTS", "2"))
+SUPABASE_RETRY_BASE_SECONDS = float(os.getenv("SUPABASE_RETRY_BASE_SECONDS", "0.05"))
+SUPABASE_RETRY_MAX_SECONDS = float(os.getenv("SUPABASE_RETRY_MAX_SECONDS", "1.0"))
+# RPCs that only read, and so are as safe to retry as a GET
+SUPABASE_IDEMPOTENT_RPCS = frozenset(
+    name.strip() for name in os.getenv("SUPABASE_IDEMPOTENT_RPCS", "login_security_check").split(",") if name.strip())
+SUPABASE_BREAKER_FAILURES = int(os.getenv("SUPABASE_BREAKER_FAILURES", "5"))
+SUPABASE_BREAKER_OPEN_SECONDS = float(os.getenv("SUPABASE_BREAKER_OPEN_SECONDS", "10"))
+SUPABASE_BREAKER_HALF_OPEN_PROBES = int(os.getenv("SUPABASE_BREAKER_HALF_OPEN_PROBES", "1"))
+
+RETRY_STATUSES = frozenset((502, 503, 504))
+# A retry is pointless if it would have less than this left to run in
+MIN_ATTEMPT_SECONDS = 0.05
+
+FAIL_OPEN = "open"
+FAIL_CLOSED = "closed"
+# What a caller does when Supabase cannot answer: "closed" refuses the request (503),
+# "open" carries on as if the answer were the harmless one. DEGRADED_MODE_<CALLER> overrides.
+_DEGRADED_DEFAULTS = {
+    "lock_check": FAIL_CLOSED,      # unknown lock state: do not let the password be tried
+    "record_failure": FAIL_OPEN,    # failed attempt not recorded: still answer 401
+    "clear_failures": FAIL_OPEN,    # successful login, old failures not cleared: still log in
+    "token_revocation": FAIL_OPEN,  # shared revocations unreadable: only this process's are applied
+}
+
+SUPABASE_RETRIES = registry.counter(
+    "supabase_retries_total", "Supabase reads retried after a failure.", ("service", "target"))
+SUPABASE_SHORT_CIRCUITED = registry.counter(
+    "supabase_short_circuited_total", "Supabase calls refused by an open circuit breaker.", ("service", "target"))
+SUPABASE_DEADLINE_EXCEEDED = registry.counter(
+    "supabase_deadline_exceeded_total", "Supabase calls not made because the request's budget was spent.",
+    ("service", "target"))
+
+
+class UpstreamUnavailable(httpx.TransportError):
+    """Supabase was not called. `retry_after` is a hint for the client, in seconds."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+class DeadlineExceeded(UpstreamUnavailable):
+    pass
+
+
+def retry_after_hint(error, default=1):
+    """The retry_after of an UpstreamUnavailable, also when a client library has wrapped it."""
+    while error is not None:
+        if isinstance(error, UpstreamUnavailable):
+            return error.retry_after
+        error = error.__cause__ or error.__context__
+    return default
+
+def degraded_mode(caller):
+    """FAIL_OPEN or FAIL_CLOSED for a caller named in _DEGRADED_DEFAULTS."""
+    mode = os.getenv(f"DEGRADED_MODE_{caller.upper()}", _DEGRADED_DEFAULTS[caller]).lower()
+    return FAIL_CLOSED if mode == FAIL_CLOSED else FAIL_OPEN
+
+
+# --- Deadline budget (per incoming request, carried in a context variable) ---
+_deadline = contextvars.ContextVar("supabase_deadline", default=None)
+
+def start_budget(seconds=SUPABASE_REQUEST_BUDGET_SECONDS):
+    """Starts the current request's budget. Returns a token for end_budget()."""
+    return _deadline.set(time.monotonic() + seconds if seconds > 0 else None)
+
+def end_budget(token):
+    _deadline.reset(token)
+
+@contextmanager
+def budget(seconds=SUPABASE_REQUEST_BUDGET_SECONDS):
+    token = start_budget(seconds)
+    try:
+        yield
+    finally:
+        end_budget(token)
+
+def remaining_budget():
+    """Seconds left in the current budget, or None outside of one."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def no_request_budget(view):
+    """Marks a Flask view (e.g. a long upload) whose Supabase calls are not bound by the request budget."""
+    view.no_request_budget = True
+    return view
+
+
+# --- Circuit breakers ---
+class CircuitBreaker:
+    """
+    Closed -> open after `failures` consecutive failures; open -> half-open once
+    `open_seconds` have passed, letting `probes` calls through; a probe's
+    success closes it again, a failure re-opens it.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failures=SUPABASE_BREAKER_FAILURES, open_seconds=SUPABASE_BREAKER_OPEN_SECONDS,
+                 probes=SUPABASE_BREAKER_HALF_OPEN_PROBES):
+        self.failure_threshold = failures
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call may not go out now."""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                wait = self._opened_at + self.open_seconds - now
+                if wait > 0:
+                    raise CircuitOpenError("circuit open", retry_after=max(1, round(wait)))
+                self.state = self.HALF_OPEN
+                self._probes_in_flight = 0
+            if self._probes_in_flight >= self.probes:
+                raise CircuitOpenError("circuit half-open, probe in flight", retry_after=1)
+            self._probes_in_flight += 1
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            if self.state != self.CLOSED:
+                self.state = self.CLOSED
+                self._probes_in_flight = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or (
+                    self.state == self.CLOSED and 0 < self.failure_threshold <= self._failures):
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probes_in_flight = 0
+
+
+class CircuitBreakers:
+    """One breaker per (service, target), e.g. ("rest", "profiles") or ("rpc", "login_security_check")."""
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, service, target):
+        key = (service, target)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(key, CircuitBreaker())
+        return breaker
+
+    def states(self):
+        with self._lock:
+            return {key: breaker.state for key, breaker in self._breakers.items()}
+
+breakers = CircuitBreakers()
+
+_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.OPEN: 1, CircuitBreaker.HALF_OPEN: 2}
+
+def _collect_breaker_states():
+    return [("supabase_circuit_state", "Circuit breaker per Supabase target: 0 closed, 1 open, 2 half-open.",
+             {"service": service, "target": target}, _STATE_VALUES[state])
+            for (service, target), state in breakers.states().items()]
+
+registry.register_collector(_collect_breaker_states)
+
+
+# --- Per-call policy used by the transports ---
+class CallPolicy:
+    """The retry / breaker / budget bookkeeping for one outgoing Supabase request."""
+
+    def __init__(self, request, service, target):
+        self.request = request
+        self.service = service
+        self.target = target
+        self.breaker = breakers.get(service, target)
+        self.idempotent = request.method in ("GET", "HEAD") or (
+            service == "rpc" and target in SUPABASE_IDEMPOTENT_RPCS)
+        self.attempt = 0
+        self._timeouts = dict(request.extensions.get("timeout") or {})
+
+    def before_attempt(self):
+        """Fits the timeout into the budget and checks the breaker. Raises UpstreamUnavailable."""
+        left = remaining_budget()
+        if left is not None:
+            if left <= 0:
+                SUPABASE_DEADLINE_EXCEEDED.inc(service=self.service, target=self.target)
+                raise DeadlineExceeded("request deadline exceeded")
+            self.request.extensions["timeout"] = {
+                name: left if value is None else min(value, left) for name, value in self._timeouts.items()
+            } or {"connect": left, "read": left, "write": left, "pool": left}
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            SUPABASE_SHORT_CIRCUITED.inc(service=self.service, target=self.target)
+            raise
+
+    def succeeded(self, response):
+        """True if the response is final; records it with the breaker."""
+        if response.status_code < 500:
+            self.breaker.record_success()
+            return True
+        self.breaker.record_failure()
+        return False
+
+    def failed(self):
+        self.breaker.record_failure()
+
+    def retry_delay(self, response=None):
+        """Seconds to wait before the next attempt, or None if this outcome is final."""
+        if not self.idempotent or self.attempt >= SUPABASE_RETRY_ATTEMPTS:
+            return None
+        if response is not None and response.status_code not in RETRY_STATUSES:
+            return None
+        delay = random.uniform(0, min(SUPABASE_RETRY_MAX_SECONDS, SUPABASE_RETRY_BASE_SECONDS * 2 ** self.attempt))
+        left = remaining_budget()
+        if left is not None and left - delay < MIN_ATTEMPT_SECONDS:
+            return None
+        self.attempt += 1
+        SUPABASE_RETRIES.inc(service=self.service, target=self.target)
+        return delay
@@ -1,6 +1,19 @@
+import asyncio
 import os
-from supabase import create_client, Client
+import threading
+import time
+import weakref
+import httpx
 from dotenv import load_dotenv
+from gotrue import SyncMemoryStorage, AsyncMemoryStorage
+from postgrest import SyncPostgrestClient, AsyncPostgrestClient
+from postgrest.utils import SyncClient as _HTTPClient, AsyncClient as _AsyncHTTPClient
+from supabase import Client, ClientOptions
+from supabase._sync.auth_client import SyncSupabaseAuthClient
+from supabase._async.auth_client import AsyncSupabaseAuthClient
+from database.resilience import CallPolicy
+from observability.metrics import METRICS_ENABLED, SUPABASE_REQUEST_SECONDS, SUPABASE_ERRORS
+from observability.log import get_logger
 
 # Load environment variables from .env file
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
@@ -11,15 +24,448 @@ SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 # --- ---
 
-if not SUPABASE_URL or not SUPABASE_ANON_KEY:
-    raise ValueError("Missing SUPABASE_URL or SUPABASE_ANON_KEY in .env file")
-if not SUPABASE_SERVICE_KEY:
-     print("Warning: SUPABASE_SERVICE_KEY not found in .env. Admin operations will fail.")
+# Connection pool shared by every client in this process (per worker).
+SUPABASE_POOL_MAX_CONNECTIONS = int(os.getenv("SUPABASE_POOL_MAX_CONNECTIONS", "20"))
+SUPABASE_POOL_MAX_KEEPALIVE = int(os.getenv("SUPABASE_POOL_MAX_KEEPALIVE", "10"))
+SUPABASE_POOL_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_POOL_KEEPALIVE_EXPIRY", "30"))
+SUPABASE_HTTP_TIMEOUT = float(os.getenv("SUPABASE_HTTP_TIMEOUT", "10"))
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "true").lower() in ("1", "true", "yes")
 
-# Client for general, anonymous use (subject to RLS)
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
 
-# Admin client with service key (bypasses RLS - defaults to 'public' schema)
-supabase_admin: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+log = get_logger(__name__)
 
-print("Supabase clients initialized.")
\ No newline at end of file
+def _classify(request):
+    """(service, target) of a Supabase request, e.g. ("rest", "profiles") or ("rpc", "login_security_check")."""
+    path = request.url.path
+    if path.startswith("/rest/v1/rpc/"):
+        return "rpc", path[len("/rest/v1/rpc/"):]
+    if path.startswith("/rest/v1/"):
+        return "rest", path[len("/rest/v1/"):]
+    if path.startswith("/auth/v1/"):
+        return "auth", path[len("/auth/v1/"):]
+    return "other", "other"
+
+
+def _count_status(service, target, status_code):
+    # Rejected credentials and the like are normal answers from the auth server, not failures
+    if status_code >= 500 or (status_code >= 400 and service != "auth"):
+        SUPABASE_ERRORS.inc(service=service, target=target, kind=f"http_{status_code}")
+
+
+class _SharedTransport(httpx.BaseTransport):
+    """
+    Wraps the pooled transport so that closing one client does not close the
+    pool for everyone else. The pool itself is closed by the manager.
+    Every call goes through the deadline budget, retry policy and circuit
+    breaker of database/resilience.py, and is timed and counted (see
+    observability/metrics.py).
+    """
+
+    def __init__(self, transport):
+        self._transport = transport
+
+    def handle_request(self, request):
+        service, target = _classify(request)
+        policy = CallPolicy(request, service, target)
+        while True:
+            policy.before_attempt()
+            try:
+                response = self._send(request, service, target)
+            except Exception:
+                policy.failed()
+                delay = policy.retry_delay()
+                if delay is None:
+                    raise
+            else:
+                if policy.succeeded(response):
+                    return response
+                delay = policy.retry_delay(response)
+                if delay is None:
+                    return response
+                response.close()
+            time.sleep(delay)
+
+    def _send(self, request, service, target):
+        if not METRICS_ENABLED:
+            return self._transport.handle_request(request)
+        started = time.perf_counter()
+        try:
+            response = self._transport.handle_request(request)
+            # Supabase responses are small JSON documents; reading them here makes the
+            # timing cover the whole round trip rather than just the headers.
+            response.read()
+        except Exception as e:
+            SUPABASE_ERRORS.inc(service=service, target=target, kind=type(e).__name__)
+            raise
+        finally:
+            SUPABASE_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                             service=service, target=target, method=request.method)
+        _count_status(service, target, response.status_code)
+        return response
+
+    def close(self):
+        pass
+
+
+class _SharedAsyncTransport(httpx.AsyncBaseTransport):
+    """_SharedTransport for the async clients (one pool per event loop)."""
+
+    def __init__(self, transport):
+        self._transport = transport
+
+    async def handle_async_request(self, request):
+        service, target = _classify(request)
+        policy = CallPolicy(request, service, target)
+        while True:
+            policy.before_attempt()
+            try:
+                response = await self._send(request, service, target)
+            except Exception:
+                policy.failed()
+                delay = policy.retry_delay()
+                if delay is None:
+                    raise
+            else:
+                if policy.succeeded(response):
+                    return response
+                delay = policy.retry_delay(response)
+                if delay is None:
+                    return response
+                await response.aclose()
+            await asyncio.sleep(delay)
+
+    async def _send(self, request, service, target):
+        if not METRICS_ENABLED:
+            return await self._transport.handle_async_request(request)
+        started = time.perf_counter()
+        try:
+            response = await self._transport.handle_async_request(request)
+            await response.aread()
+        except Exception as e:
+            SUPABASE_ERRORS.inc(service=service, target=target, kind=type(e).__name__)
+            raise
+        finally:
+            SUPABASE_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                             service=service, target=target, method=request.method)
+        _count_status(service, target, response.status_code)
+        return response
+
+    async def aclose(self):
+        pass
+
+
+class _PooledPostgrestClient(SyncPostgrestClient):
+    """PostgREST client whose HTTP session uses the shared pooled transport."""
+
+    def __init__(self, base_url, transport, **kwargs):
+        self._transport = transport
+        super().__init__(base_url, **kwargs)
+
+    def create_session(self, base_url, headers, timeout, verify=True, proxy=None):
+        return _HTTPClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            follow_redirects=True,
+            transport=self._transport,
+        )
+
+
+class _PooledAsyncPostgrestClient(AsyncPostgrestClient):
+    """Async PostgREST client on the current event loop's pooled transport."""
+
+    def __init__(self, base_url, transport, **kwargs):
+        self._transport = transport
+        super().__init__(base_url, **kwargs)
+
+    def create_session(self, base_url, headers, timeout, verify=True, proxy=None):
+        return _AsyncHTTPClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            follow_redirects=True,
+            transport=self._transport,
+        )
+
+
+class _PooledClient(Client):
+    """Supabase client whose PostgREST and auth requests go through the shared pool."""
+
+    def __init__(self, supabase_url, supabase_key, options, manager):
+        self._manager = manager
+        super().__init__(supabase_url, supabase_key, options)
+
+    def _init_supabase_auth_client(self, auth_url, client_options, verify=True, proxy=None):
+        return SyncSupabaseAuthClient(
+            url=auth_url,
+            auto_refresh_token=client_options.auto_refresh_token,
+            persist_session=client_options.persist_session,
+            storage=client_options.storage,
+            headers=client_options.headers,
+            flow_type=client_options.flow_type,
+            http_client=self._manager.http_client(),
+        )
+
+    def _init_postgrest_client(self, rest_url, headers, schema, timeout=None, verify=True, proxy=None):
+        return self._manager.postgrest_client(headers, schema)
+
+
+class SupabaseClientManager:
+    """
+    Creates Supabase clients lazily and shares one pooled, keep-alive HTTP
+    transport between them. Nothing here touches the network or validates
+    configuration until a client is first requested, so importing the app
+    stays fast.
+
+    The pool belongs to the process that created it: after a fork the
+    manager notices the new pid and builds fresh clients and a fresh pool.
+
+    The async clients (async_admin(), async_auth_client()) get a pool of their
+    own per event loop, since async connections cannot move between loops.
+    """
+
+    def __init__(self, url=None, anon_key=None, service_key=None):
+        self.url = url
+        self.anon_key = anon_key
+        self.service_key = service_key
+        self._lock = threading.RLock()
+        self._pid = None
+        self._transport = None
+        self._anon = None
+        self._admin = None
+        self._async_transports = weakref.WeakKeyDictionary()  # event loop -> transport
+        self._async_admins = weakref.WeakKeyDictionary()      # event loop -> PostgREST client
+
+    def _check_process(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Connections inherited from the parent must never be reused.
+                    self._transport = None
+                    self._anon = None
+                    self._admin = None
+                    self._async_transports = weakref.WeakKeyDictionary()
+                    self._async_admins = weakref.WeakKeyDictionary()
+                    self._pid = os.getpid()
+
+    def _require_config(self, need_service_key=False):
+        if not self.url or not self.anon_key:
+            raise ValueError("Missing SUPABASE_URL or SUPABASE_ANON_KEY in .env file")
+        if need_service_key and not self.service_key:
+            raise ValueError("Missing SUPABASE_SERVICE_KEY in .env file. Admin operations will fail.")
+
+    def transport(self):
+        """Returns the process-wide pooled transport, creating it on first use."""
+        self._check_process()
+        if self._transport is None:
+            with self._lock:
+                if self._transport is None:
+                    self._transport = _SharedTransport(httpx.HTTPTransport(
+                        http2=SUPABASE_HTTP2,
+                        limits=self._pool_limits(),
+                    ))
+        return self._transport
+
+    def _pool_limits(self):
+        return httpx.Limits(
+            max_connections=SUPABASE_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=SUPABASE_POOL_KEEPALIVE_EXPIRY,
+        )
+
+    def http_client(self, base_url="", headers=None):
+        """A lightweight httpx client on top of the shared pool."""
+        return _HTTPClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=SUPABASE_HTTP_TIMEOUT,
+            follow_redirects=True,
+            transport=self.transport(),
+        )
+
+    def postgrest_client(self, headers, schema="public"):
+        return _PooledPostgrestClient(
+            f"{self.url}/rest/v1",
+            self.transport(),
+            headers=headers,
+            schema=schema,
+            timeout=SUPABASE_HTTP_TIMEOUT,
+        )
+
+    def _create_client(self, key):
+        options = ClientOptions(
+            storage=SyncMemoryStorage(),
+            auto_refresh_token=False,
+            persist_session=False,
+            postgrest_client_timeout=SUPABASE_HTTP_TIMEOUT,
+        )
+        return _PooledClient(self.url, key, options, self)
+
+    def anon(self):
+        """Client for general, anonymous use (subject to RLS)."""
+        self._check_process()
+        if self._anon is None:
+            with self._lock:
+                if self._anon is None:
+                    self._require_config()
+                    self._anon = self._create_client(self.anon_key)
+                    log.info("supabase_client_initialized", client="anon")
+        return self._anon
+
+    def admin(self):
+        """Admin client with service key (bypasses RLS - defaults to 'public' schema)."""
+        self._check_process()
+        if self._admin is None:
+            with self._lock:
+                if self._admin is None:
+                    self._require_config(need_service_key=True)
+                    self._admin = self._create_client(self.service_key)
+                    log.info("supabase_client_initialized", client="admin")
+        return self._admin
+
+    def auth_client(self):
+        """
+        A fresh auth client for one request (sign in, set_session, update_user, ...).
+        Its session lives only on this object, so one user's login can never leak
+        into the shared clients, and it reuses the pooled connections.
+        """
+        self._require_config()
+        return SyncSupabaseAuthClient(
+            url=f"{self.url}/auth/v1",
+            headers={"apiKey": self.anon_key, "Authorization": f"Bearer {self.anon_key}"},
+            auto_refresh_token=False,
+            persist_session=False,
+            storage=SyncMemoryStorage(),
+            http_client=self.http_client(),
+        )
+
+    def user_client(self, access_token):
+        """A PostgREST client scoped to one user's access token (RLS applies)."""
+        self._require_config()
+        return self.postgrest_client({
+            "apiKey": self.anon_key,
+            "Authorization": f"Bearer {access_token}",
+        })
+
+    # --- Async clients (asyncio serving mode, see asgi_server.py) ---
+
+    def async_transport(self):
+        """The running event loop's pooled transport, creating it on first use."""
+        self._check_process()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._async_transports.get(loop)
+            if transport is None:
+                transport = _SharedAsyncTransport(httpx.AsyncHTTPTransport(
+                    http2=SUPABASE_HTTP2,
+                    limits=self._pool_limits(),
+                ))
+                self._async_transports[loop] = transport
+        return transport
+
+    def async_http_client(self, base_url="", headers=None):
+        return _AsyncHTTPClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=SUPABASE_HTTP_TIMEOUT,
+            follow_redirects=True,
+            transport=self.async_transport(),
+        )
+
+    def async_postgrest_client(self, headers, schema="public"):
+        return _PooledAsyncPostgrestClient(
+            f"{self.url}/rest/v1",
+            self.async_transport(),
+            headers=headers,
+            schema=schema,
+            timeout=SUPABASE_HTTP_TIMEOUT,
+        )
+
+    def async_admin(self):
+        """Service-role PostgREST client (table() / rpc()) for the running event loop."""
+        self._check_process()
+        loop = asyncio.get_running_loop()
+        client = self._async_admins.get(loop)
+        if client is None:
+            self._require_config(need_service_key=True)
+            client = self.async_postgrest_client({
+                "apiKey": self.service_key,
+                "Authorization": f"Bearer {self.service_key}",
+            })
+            with self._lock:
+                client = self._async_admins.setdefault(loop, client)
+        return client
+
+    def async_auth_client(self):
+        """auth_client() for async code: a fresh session holder on the loop's pool."""
+        self._require_config()
+        return AsyncSupabaseAuthClient(
+            url=f"{self.url}/auth/v1",
+            headers={"apiKey": self.anon_key, "Authorization": f"Bearer {self.anon_key}"},
+            auto_refresh_token=False,
+            persist_session=False,
+            storage=AsyncMemoryStorage(),
+            http_client=self.async_http_client(),
+        )
+
+    async def aclose_async(self):
+        """Closes the running event loop's async pool (e.g. when an ASGI worker shuts down)."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._async_transports.pop(loop, None)
+            self._async_admins.pop(loop, None)
+        if transport is not None:
+            await transport._transport.aclose()
+
+    def reset(self):
+        """Drops all clients and closes the pool (e.g. on worker shutdown)."""
+        with self._lock:
+            if self._transport is not None and self._pid == os.getpid():
+                self._transport._transport.close()
+            self._transport = None
+            self._anon = None
+            self._admin = None
+
+
+clients = SupabaseClientManager(SUPABASE_URL, SUPABASE_ANON_KEY, SUPABASE_SERVICE_KEY)
+
+def get_supabase():
+    """Returns the shared anonymous client."""
+    return clients.anon()
+
+def get_supabase_admin():
+    """Returns the shared service-role client."""
+    return clients.admin()
+
+def get_auth_client():
+    """Returns a per-request auth client on the shared connection pool."""
+    return clients.auth_client()
+
+def get_user_client(access_token):
+    """Returns a per-request PostgREST client acting as the given user."""
+    return clients.user_client(access_token)
+
+def get_async_supabase_admin():
+    """Returns the service-role PostgREST client of the running event loop (queries are awaited)."""
+    return clients.async_admin()
+
+def get_async_auth_client():
+    """Returns a per-request async auth client on the event loop's connection pool."""
+    return clients.async_auth_client()
+
+def to_bytea(data: bytes) -> str:
+    """Encodes bytes for a bytea column (PostgREST exchanges bytea as hex text)."""
+    return "\\x" + data.hex()
+
+def from_bytea(value: str) -> bytes:
+    """Decodes a bytea column value returned by PostgREST."""
+    return bytes.fromhex(value[2:] if value.startswith("\\x") else value)
+
+def __getattr__(name):
+    # Backwards compatibility for `supabase_client.supabase` / `.supabase_admin`,
+    # resolved lazily so that importing this module never builds a client.
+    if name == "supabase":
+        return get_supabase()
+    if name == "supabase_admin":
+        return get_supabase_admin()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
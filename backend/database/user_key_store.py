@@ -0,0 +1,80 @@
+from database.supabase_client import get_supabase_admin, get_async_supabase_admin, to_bytea, from_bytea
+from security_logic.kdf_params import KDFParams, PBKDF2_SHA256
+from datetime import datetime, timezone
+
+
+def _kdf_columns(kdf, replacing=None):
+    # PBKDF2 is fully described by kdf_iterations; kdf_params (migration 005) is only needed for other KDFs
+    if kdf.algorithm != PBKDF2_SHA256:
+        return {"kdf_iterations": None, "kdf_params": kdf.encode()}
+    if replacing is not None and replacing.algorithm != PBKDF2_SHA256:
+        return {"kdf_iterations": kdf.iterations, "kdf_params": None}
+    return {"kdf_iterations": kdf.iterations}
+
+
+def load_user_key(user_id):
+    """Returns the user's wrapped data key as {wrapped_key, kdf_salt, kdf} (bytes/KDFParams), or None."""
+    # "*" so the kdf_params column is optional until docs/migrations/005_kdf_params.sql has run
+    res = get_supabase_admin().table("user_keys") \
+                .select("*") \
+                .eq("user_id", user_id) \
+                .limit(1) \
+                .execute()
+    return _decode_row(res.data)
+
+async def load_user_key_async(user_id):
+    """load_user_key() for coroutines."""
+    res = await get_async_supabase_admin().table("user_keys") \
+                .select("*") \
+                .eq("user_id", user_id) \
+                .limit(1) \
+                .execute()
+    return _decode_row(res.data)
+
+def _decode_row(rows):
+    if not rows:
+        return None
+    row = rows[0]
+    if row.get("kdf_params"):
+        kdf = KDFParams.parse(row["kdf_params"])
+    else:
+        kdf = KDFParams.pbkdf2(row["kdf_iterations"])
+    stored = {
+        "wrapped_key": from_bytea(row["wrapped_key"]),
+        "kdf_salt": from_bytea(row["kdf_salt"]),
+        "kdf": kdf,
+    }
+    # Only once docs/migrations/009_key_wrapping_times.sql has run
+    if "wrapped_at" in row:
+        stored["wrapped_at"] = row["wrapped_at"]
+    return stored
+
+def insert_user_key(user_id, wrapped_key, kdf_salt, kdf):
+    """Stores a user's first wrapped key. If another request stored one first, theirs is kept."""
+    get_supabase_admin().table("user_keys").upsert({
+        "user_id": user_id,
+        "wrapped_key": to_bytea(wrapped_key),
+        "kdf_salt": to_bytea(kdf_salt),
+        **_kdf_columns(kdf),
+    }, ignore_duplicates=True, returning="minimal").execute()
+
+def update_user_key(user_id, wrapped_key, kdf_salt, kdf, stored, new_password=False):
+    """
+    Replaces the wrapping (e.g. after a password change or a KDF upgrade), only if it is
+    still `stored` (as returned by load_user_key). Returns True if the row was updated.
+    new_password: the key is now wrapped under a different password (sets wrapped_at).
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    columns = {
+        "wrapped_key": to_bytea(wrapped_key),
+        "kdf_salt": to_bytea(kdf_salt),
+        "updated_at": now,
+        **_kdf_columns(kdf, replacing=stored["kdf"]),
+    }
+    if new_password and "wrapped_at" in stored:
+        columns["wrapped_at"] = now
+    res = get_supabase_admin().table("user_keys").update(columns) \
+                .eq("user_id", user_id) \
+                .eq("wrapped_key", to_bytea(stored["wrapped_key"])) \
+                .execute()
+    return bool(res.data)
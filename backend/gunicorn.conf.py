@@ -0,0 +1,72 @@
+"""
+Gunicorn settings used by serve.py (production).
+
+The app is imported once in the master (preload_app), then forked into
+WEB_WORKERS processes with WEB_THREADS threads each. Everything that holds
+connections or threads (Supabase pool, job queue, KDF pool) is created per
+worker after the fork, and each worker warms itself up before taking traffic.
+On shutdown a worker finishes its requests, then drains the jobs only it holds
+secrets for, the lock and audit write-behind queues and its log queue.
+"""
+import os
+import time
+
+_cpus = os.cpu_count() or 1
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+chdir = os.path.dirname(os.path.abspath(__file__))
+workers = int(os.getenv("WEB_WORKERS", str(min(_cpus, 4))))
+threads = int(os.getenv("WEB_THREADS", "8"))
+worker_class = "gthread"
+preload_app = True
+timeout = int(os.getenv("WEB_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("WEB_KEEPALIVE", "5"))
+# Recycle workers now and then so slow leaks cannot build up (0 = never)
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+accesslog = "-" if os.getenv("WEB_ACCESS_LOG", "false").lower() in ("1", "true", "yes") else None
+errorlog = "-"
+
+# Requests made in each worker before it accepts traffic
+WARMUP_PATHS = ("/healthz", "/")
+
+
+def post_fork(server, worker):
+    # The Supabase client manager and job queue notice the new pid on first use and
+    # build their own pools; nothing inherited from the master is reused.
+    from security_logic.kdf_executor import kdf_executor
+
+    # Each web worker has its own KDF process pool: share the cores between the
+    # workers actually started (--workers included) instead of starting cpu_count
+    # KDF processes per worker. The pool itself is only started in post_worker_init.
+    if "KDF_EXECUTOR_WORKERS" not in os.environ:
+        kdf_workers = max(1, _cpus // max(server.cfg.workers, 1))
+        kdf_executor.configure(kdf_workers, int(os.getenv("KDF_QUEUE_LIMIT", str(kdf_workers * 4))))
+    server.log.info(f"Worker {worker.pid} forked")
+
+
+def post_worker_init(worker):
+    """Warms up the worker: runs requests through the app, opens the Supabase pool, starts the KDF pool."""
+    from database.supabase_client import get_supabase_admin
+    from security_logic.kdf_executor import kdf_executor
+
+    started = time.perf_counter()
+    app = worker.wsgi
+    with app.test_client() as client:
+        for path in WARMUP_PATHS:
+            client.get(path)
+    try:
+        get_supabase_admin().table("profiles").select("user_id").limit(1).execute()
+    except Exception as e:
+        worker.log.warning(f"Warm-up could not reach Supabase: {e}")
+    kdf_executor.warm_up()
+    worker.log.info(f"Worker {worker.pid} warmed up in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+
+def worker_exit(server, worker):
+    """Drains in-process queues once the worker has stopped serving (in order, see lifecycle.py)."""
+    from lifecycle import shutdown_process
+
+    shutdown_process()
+    server.log.info(f"Worker {worker.pid} drained")
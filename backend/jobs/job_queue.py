@@ -0,0 +1,338 @@
+from observability.metrics import registry
+from observability.log import get_logger
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+JOB_QUEUE_PATH = os.getenv(
+    "JOB_QUEUE_PATH",
+    os.path.join(os.path.dirname(__file__), '..', 'jobs.sqlite3')
+)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "1.0"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "60.0"))
+# A claimed job whose worker died is handed out again once its lease runs out
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60.0"))
+JOB_POLL_SECONDS = 1.0
+# Finished jobs (and jobs whose in-memory secrets were lost) are deleted after this long
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# How long drain() keeps running this process's secret-holding jobs on shutdown
+JOB_DRAIN_SECONDS = float(os.getenv("JOB_DRAIN_SECONDS", "10.0"))
+
+log = get_logger(__name__)
+
+JOBS_FINISHED = registry.counter(
+    "jobs_finished_total", "Background job runs by kind and result (done, retry, failed).", ("kind", "result"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_key      TEXT PRIMARY KEY,
+    kind         TEXT NOT NULL,
+    payload      TEXT NOT NULL,
+    status       TEXT NOT NULL,           -- pending | running | done | failed
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    run_after    REAL NOT NULL,
+    locked_until REAL,
+    secret_owner TEXT,                    -- queue instance holding the job's secrets in memory
+    last_error   TEXT,
+    created_at   REAL NOT NULL,
+    updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready_idx ON jobs (status, run_after);
+"""
+
+
+class JobQueue:
+    """
+    Durable background jobs in a local SQLite file, run by worker threads.
+
+    - enqueue() is idempotent: a job key that already exists is not added twice
+    - a failing job is retried with exponential backoff up to JOB_MAX_ATTEMPTS
+    - claims are leases, so jobs left "running" by a crashed process run again
+    - handlers must be idempotent: a job can run more than once
+
+    Secrets a job needs (e.g. a password to derive a key from) are never
+    written to disk: they stay in this process's memory and only this queue
+    instance's workers pick such jobs up. drain() runs them before the process
+    exits; if it dies first, the job stays pending until a caller supplies the
+    secrets again via resume() or run_now().
+
+    Like the Supabase clients, the queue belongs to the process that uses it:
+    a forked worker gets its own instance id, connections and threads.
+    """
+
+    def __init__(self, path=JOB_QUEUE_PATH, workers=JOB_WORKERS, max_attempts=JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._handlers = {}
+        self._last_purge = 0.0
+        self._pid = None
+        self._check_process()
+
+    def _check_process(self):
+        if self._pid != os.getpid():
+            # Threads and connections inherited through fork() are unusable; secrets belong to the parent
+            self.instance_id = uuid.uuid4().hex
+            self._secrets = {}     # job_key -> dict, held only in memory
+            self._local = threading.local()
+            self._cond = threading.Condition()
+            self._threads = []
+            self._stopping = False
+            self._drained = False
+            self._pid = os.getpid()
+
+    # --- storage ---
+    def _db(self):
+        self._check_process()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _claim(self, conn, where, params, now):
+        """Atomically marks one matching job as running and returns it, or None."""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(f"SELECT * FROM jobs WHERE {where} ORDER BY run_after LIMIT 1", params).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', locked_until = ?, updated_at = ? WHERE job_key = ?",
+                    (now + JOB_LEASE_SECONDS, now, row["job_key"]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    # --- producer side ---
+    def register(self, kind, handler):
+        """`handler(payload, secrets)` does the work; raising schedules a retry."""
+        self._handlers[kind] = handler
+
+    def enqueue(self, kind, job_key, payload, secrets=None):
+        """Adds a job unless job_key already exists. Returns True if it was added."""
+        self._check_process()
+        now = time.time()
+        with self._cond:
+            # Secrets go in first so a worker never claims the new row without them
+            previous = self._secrets.get(job_key)
+            if secrets is not None:
+                self._secrets[job_key] = secrets
+            cursor = self._db().execute(
+                "INSERT OR IGNORE INTO jobs (job_key, kind, payload, status, run_after, secret_owner, "
+                "created_at, updated_at) VALUES (?, ?, ?, 'pending', ?, ?, ?, ?)",
+                (job_key, kind, json.dumps(payload), now,
+                 self.instance_id if secrets is not None else None, now, now))
+            added = cursor.rowcount == 1
+            if not added and secrets is not None:
+                # An existing job keeps whatever secrets it was enqueued with
+                if previous is None:
+                    self._secrets.pop(job_key, None)
+                else:
+                    self._secrets[job_key] = previous
+            self._cond.notify()
+        self.start()
+        return added
+
+    def status(self, job_key):
+        row = self._db().execute("SELECT status FROM jobs WHERE job_key = ?", (job_key,)).fetchone()
+        return row["status"] if row else None
+
+    def has_unfinished(self, kind, path, value):
+        """True if a pending or running job of `kind` has `value` (any case) at JSON `path` of its payload."""
+        row = self._db().execute(
+            "SELECT 1 FROM jobs WHERE kind = ? AND status IN ('pending', 'running') "
+            "AND lower(json_extract(payload, ?)) = lower(?) LIMIT 1", (kind, path, value)).fetchone()
+        return row is not None
+
+    def holds_secrets(self, job_key):
+        """True if this process holds the secrets job_key was enqueued with."""
+        self._check_process()
+        return job_key in self._secrets
+
+    def run_now(self, job_key, secrets=None, timeout=10.0):
+        """
+        Runs a job in the calling thread, whatever its status (handlers are idempotent,
+        so a finished job simply checks its work again), or waits for the worker
+        already running it. Returns the job's status afterwards, or None if there is
+        no such job. Errors from a job run here are re-raised after the retry is recorded.
+        `secrets` replace the ones the job was enqueued with; without them those are used.
+        """
+        now = time.time()
+        row = self._claim(self._db(), "job_key = ? AND (status != 'running' OR locked_until < ?)",
+                          (job_key, now), now)
+        if row is not None:
+            if secrets is None:
+                secrets = self._secrets.get(job_key)
+            return self._execute(row, secrets, raise_errors=True)
+
+        # Missing, or another thread or process is on it
+        return self.wait(job_key, timeout)
+
+    def wait(self, job_key, timeout=10.0):
+        """Waits up to `timeout` seconds while the job is running. Returns its status (None if there is no job)."""
+        deadline = time.monotonic() + timeout
+        status = self.status(job_key)
+        while status == "running" and time.monotonic() < deadline:
+            time.sleep(0.05)
+            status = self.status(job_key)
+        return status
+
+    def resume(self, job_key, secrets):
+        """
+        Hands a job that is not done (nor running elsewhere) new secrets, held by this process,
+        and makes it ready to run with a fresh set of attempts (e.g. after the process holding
+        its old ones died). Returns True if there was such a job.
+        """
+        self._check_process()
+        now = time.time()
+        with self._cond:
+            self._secrets[job_key] = secrets
+            cursor = self._db().execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, run_after = ?, locked_until = NULL, "
+                "secret_owner = ?, updated_at = ? WHERE job_key = ? "
+                "AND (status IN ('pending', 'failed') OR (status = 'running' AND locked_until < ?))",
+                (now, self.instance_id, now, job_key, now))
+            resumed = cursor.rowcount == 1
+            if not resumed:
+                self._secrets.pop(job_key, None)
+            self._cond.notify()
+        self.start()
+        return resumed
+
+    # --- worker side ---
+    def start(self):
+        self._check_process()
+        if self._threads or self.workers <= 0:
+            return
+        with self._cond:
+            if self._threads or self._stopping:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                if not self.run_pending():
+                    self._purge()
+                    with self._cond:
+                        if not self._stopping:
+                            self._cond.wait(JOB_POLL_SECONDS)
+            except Exception:
+                log.exception("job_worker_error")
+                time.sleep(JOB_POLL_SECONDS)
+
+    def run_pending(self):
+        """Claims and runs one ready job. Returns False when there was nothing to do."""
+        now = time.time()
+        row = self._claim(
+            self._db(),
+            "((status = 'pending' AND run_after <= ?) OR (status = 'running' AND locked_until < ?)) "
+            "AND (secret_owner IS NULL OR secret_owner = ?)",
+            (now, now, self.instance_id), now)
+        if row is None:
+            return False
+        self._execute(row, self._secrets.get(row["job_key"]))
+        return True
+
+    def _execute(self, row, secrets, raise_errors=False):
+        job_key, kind = row["job_key"], row["kind"]
+        attempts = row["attempts"] + 1
+        try:
+            handler = self._handlers[kind]
+            handler(json.loads(row["payload"]), secrets or {})
+        except Exception as e:
+            now = time.time()
+            if attempts >= self.max_attempts:
+                status, run_after = "failed", now
+                self._secrets.pop(job_key, None)
+                log.error("job_failed", job_key=job_key, kind=kind, attempts=attempts, error=str(e))
+            else:
+                status = "pending"
+                run_after = now + min(JOB_RETRY_BASE_SECONDS * (2 ** (attempts - 1)), JOB_RETRY_MAX_SECONDS)
+                log.warning("job_retry", job_key=job_key, kind=kind, attempts=attempts,
+                            retry_in=round(run_after - now, 1), error=str(e))
+            self._db().execute(
+                "UPDATE jobs SET status = ?, attempts = ?, run_after = ?, locked_until = NULL, "
+                "last_error = ?, updated_at = ? WHERE job_key = ?",
+                (status, attempts, run_after, str(e), now, job_key))
+            JOBS_FINISHED.inc(kind=kind, result="failed" if status == "failed" else "retry")
+            if raise_errors:
+                raise
+            return status
+
+        self._db().execute(
+            "UPDATE jobs SET status = 'done', attempts = ?, locked_until = NULL, last_error = NULL, "
+            "updated_at = ? WHERE job_key = ?",
+            (attempts, time.time(), job_key))
+        self._secrets.pop(job_key, None)
+        JOBS_FINISHED.inc(kind=kind, result="done")
+        return "done"
+
+    def _purge(self):
+        now = time.time()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        self._db().execute("DELETE FROM jobs WHERE status != 'running' AND updated_at < ?",
+                           (now - JOB_RETENTION_SECONDS,))
+
+    def stop(self, timeout=5.0):
+        """Stops the workers; a job still running is picked up again after its lease."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def drain(self, timeout=JOB_DRAIN_SECONDS):
+        """
+        Stops the workers, then runs the pending jobs only this process can run (their
+        secrets die with it), even those waiting for a retry. Other jobs stay queued.
+        """
+        if self._pid != os.getpid() or self._drained:
+            return
+        self._drained = True
+        deadline = time.monotonic() + timeout
+        self.stop(timeout)
+        conn = self._db()
+        keys = [row["job_key"] for row in conn.execute(
+            "SELECT job_key FROM jobs WHERE status = 'pending' AND secret_owner = ? ORDER BY run_after",
+            (self.instance_id,))]
+        drained = 0
+        for job_key in keys:
+            if time.monotonic() >= deadline:
+                break
+            # One try each: a failing job is not retried in a tight loop
+            row = self._claim(conn, "job_key = ? AND status = 'pending'", (job_key,), time.time())
+            if row is not None:
+                self._execute(row, self._secrets.get(job_key))
+                drained += 1
+        if drained:
+            log.info("jobs_drained", jobs=drained)
+
+    def stats(self):
+        counts = dict(self._db().execute("SELECT status, count(*) FROM jobs GROUP BY status").fetchall())
+        return {
+            "workers": self.workers,
+            "pending": counts.get("pending", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "secrets_held": len(self._secrets),
+        }
+
+
+job_queue = JobQueue()
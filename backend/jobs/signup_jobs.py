@@ -0,0 +1,119 @@
+from database.supabase_client import get_supabase_admin
+from database.profile_store import fetch_profile
+from jobs.job_queue import job_queue
+from security_logic.user_keys import encrypt_for_user, DataKeyNotReady
+from security_logic.profile_cache import profile_cache
+from security_logic.record_format import TOKEN_FORMATS
+from observability.log import get_logger
+from datetime import datetime
+
+log = get_logger(__name__)
+
+PROFILE_JOB = "signup-profile"
+INITIAL_DATA_JOB = "signup-initial-data"
+
+
+def _profile_job_key(user_id):
+    return f"{PROFILE_JOB}:{user_id}"
+
+def _initial_data_job_key(user_id):
+    return f"{INITIAL_DATA_JOB}:{user_id}"
+
+
+def create_profile(payload, secrets):
+    """Upserts the new user's row in `profiles` (safe to repeat)."""
+    profile_data = payload["profile"]
+    # Use ADMIN client to bypass RLS and modify profile
+    get_supabase_admin().table("profiles").upsert(profile_data).execute()
+    profile_cache.remember_signup(profile_data["user_id"], profile_data["email"],
+                                  {"username": profile_data["username"], "email": profile_data["email"]})
+
+
+def create_initial_data(payload, secrets):
+    """Encrypts the user's first data file with their password, unless it already exists."""
+    user_id = payload["user_id"]
+    existing = get_supabase_admin().table("user_data") \
+                    .select("data_id") \
+                    .eq("user_id", user_id) \
+                    .in_("storage_format", list(TOKEN_FORMATS)) \
+                    .limit(1) \
+                    .execute()
+    if existing.data:
+        return
+
+    password = secrets.get("password")
+    if not password:
+        raise RuntimeError("password not available in this process; it is supplied again at the next login")
+
+    # Jobs resumed at login do not carry the username
+    username = payload.get("username") or (profile_cache.get_profile(user_id, fetch_profile) or {}).get("username", "User")
+    initial_data = f"User {username}'s secure file, created on {datetime.now().isoformat()}"
+    # Creates the user's data key on the way (see user_keys.py). The password is known to be
+    # right: Supabase Auth accepted it at signup or login
+    user_data_payload = {
+        "user_id": user_id,
+        "data_type": "profile_info",
+        "encrypted": True,
+        "content_size": len(initial_data.encode()),
+        **encrypt_for_user(user_id, password, [initial_data], password_verified=True)[0],
+    }
+    get_supabase_admin().table("user_data").insert(user_data_payload).execute()
+    log.info("initial_data_created", user_id=user_id)
+
+
+def profile_pending(email):
+    """True while a signup with this email waits for its profiles row (jobs are shared by the host's workers)."""
+    return job_queue.has_unfinished(PROFILE_JOB, "$.profile.email", email.strip())
+
+
+job_queue.register(PROFILE_JOB, create_profile)
+job_queue.register(INITIAL_DATA_JOB, create_initial_data)
+profile_cache.track_pending_signups(profile_pending)
+
+
+def enqueue_signup(profile_data, password):
+    """Queues profile and initial-data creation for a user that Supabase Auth just created."""
+    user_id = profile_data["user_id"]
+    job_queue.enqueue(PROFILE_JOB, _profile_job_key(user_id), {"profile": profile_data})
+    job_queue.enqueue(INITIAL_DATA_JOB, _initial_data_job_key(user_id),
+                      {"user_id": user_id, "username": profile_data["username"]},
+                      secrets={"password": password})
+
+
+def resume_initial_data(user_id, password):
+    """
+    Called with the password of a successful login. If the user's initial-data job
+    lost the password it was queued with (its process restarted) or gave up, it is
+    handed this one and queued again; an account without a job gets one (which
+    only checks that the file exists). Best effort: never fails the login.
+    """
+    job_key = _initial_data_job_key(user_id)
+    try:
+        if job_queue.holds_secrets(job_key):
+            return
+        status = job_queue.status(job_key)
+        if status is None:
+            job_queue.enqueue(INITIAL_DATA_JOB, job_key, {"user_id": user_id}, secrets={"password": password})
+        elif status != "done":
+            job_queue.resume(job_key, {"password": password})
+    except Exception as e:
+        log.warning("initial_data_resume_error", user_id=user_id, error=str(e))
+
+
+def ensure_initial_data(user_id, timeout=10.0):
+    """
+    Makes sure the user's initial data file exists: runs their pending job now if
+    this process holds the password it was queued with, or waits for the worker
+    running it. Returns the job status, or None if the user has no profile.
+    Raises DataKeyNotReady if no process has the password any more (the next
+    login supplies it again); KDFBusyError and other job errors propagate.
+    """
+    job_key = _initial_data_job_key(user_id)
+    if job_queue.holds_secrets(job_key):
+        return job_queue.run_now(job_key, timeout=timeout)
+    status = job_queue.wait(job_key, timeout=timeout)
+    if status is None and not profile_cache.get_profile(user_id, fetch_profile):
+        return None
+    if status != "done":
+        raise DataKeyNotReady()
+    return status
@@ -0,0 +1,41 @@
+"""
+Ordered shutdown of a server process's in-memory queues and pools.
+
+gunicorn's worker_exit, the ASGI lifespan and (as a fallback, e.g. for the
+Flask development server) atexit all call shutdown_process(). The order
+matters: jobs this process holds secrets for still derive keys and write to
+Supabase, so they run first; lock and audit writes follow; the KDF pool and
+the Supabase pool are closed only after everything that may use them, and
+the log queue is flushed last.
+
+Keep the steps here rather than in separate atexit hooks: those run
+last-registered first, i.e. in whatever order the modules happened to be
+imported.
+"""
+from database.supabase_client import clients
+from jobs.job_queue import job_queue
+from security_logic.audit_logger import audit_logger
+from security_logic.kdf_executor import kdf_executor
+from security_logic.lockout_manager import drain_lockout_writes
+from observability.log import drain_logs
+import atexit
+import os
+
+_shut_down_pid = None
+
+
+def shutdown_process():
+    """Drains and closes everything this process holds. Runs once per process."""
+    global _shut_down_pid
+    if _shut_down_pid == os.getpid():
+        return
+    _shut_down_pid = os.getpid()
+    job_queue.drain()
+    drain_lockout_writes()
+    audit_logger.drain()
+    kdf_executor.shutdown()
+    clients.reset()
+    drain_logs()
+
+
+atexit.register(shutdown_process)
@@ -0,0 +1,297 @@
+"""
+Structured, non-blocking logging for the request paths.
+
+    from observability.log import get_logger
+    log = get_logger(__name__)
+    log.info("login_failed", email=email, ip=ip, reason=str(error))
+    log.exception("file_access_error")          # adds the traceback
+    log.info("flagged", key=address, email_fields=("key",))   # `key` holds an email too
+
+A request thread only builds a LogRecord and puts it on a bounded queue; a
+background thread formats it (one JSON object per line by default) and
+writes it to stdout. If the queue is full, the record is dropped and counted
+rather than making the request wait. Every record carries the current
+request's correlation id (X-Request-ID).
+
+Levels are per logger (module): LOG_LEVEL is the default and LOG_LEVELS
+overrides it, e.g. "security_logic.profile_cache=WARNING,httpx=INFO".
+High-volume INFO/DEBUG events can be sampled with LOG_SAMPLE_RATES, e.g.
+"login_failed=0.1": a sampled record carries its sample_rate so counts can
+be scaled back up. Warnings and errors are never sampled.
+"""
+from logging.handlers import QueueHandler
+from observability.metrics import registry
+import atexit
+import contextvars
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Per-logger overrides: "<logger>=<LEVEL>,..."
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# "json" (one object per line) or "text" (for reading in a terminal)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Records waiting for the writer thread; beyond this they are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# "<event>=<rate>,..." for INFO/DEBUG events
+LOG_SAMPLE_RATES = os.getenv(
+    "LOG_SAMPLE_RATES", "login_failed=0.1,login_succeeded=0.1,login_refused=0.1,rate_limited=0.1")
+# How `email` fields are written: "hash" (keyed digest, same domain), "plain" or "omit"
+LOG_EMAILS = os.getenv("LOG_EMAILS", "hash").lower()
+# Secret key for "hash"; without one, emails are omitted (a plain digest of an address is easy to reverse)
+LOG_EMAIL_HMAC_KEY = os.getenv("LOG_EMAIL_HMAC_KEY", "")
+
+# Libraries that log every HTTP call at INFO; LOG_LEVELS can turn them back up
+_LIBRARY_LEVELS = {"httpx": "WARNING", "httpcore": "WARNING", "hpack": "WARNING"}
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+# LogRecord attribute holding an event's structured fields
+_RECORD_FIELDS = "fields"
+# ... and the names of those that are email addresses (written as LOG_EMAILS says)
+_RECORD_EMAIL_FIELDS = "email_fields"
+EMAIL_FIELDS = frozenset({"email"})
+
+LOG_RECORDS_DROPPED = registry.counter(
+    "log_records_dropped_total", "Log records not written.", ("reason",))
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def _parse_rates(spec):
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        event, _, rate = item.partition("=")
+        rates[event.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+_sample_rates = _parse_rates(LOG_SAMPLE_RATES)
+
+
+# --- Request correlation ids ---
+def new_request_id(incoming=None):
+    """The id for a new request: the caller's X-Request-ID if it looks sane, else a fresh one."""
+    if incoming and _REQUEST_ID_PATTERN.match(incoming):
+        return incoming
+    return uuid.uuid4().hex
+
+def bind_request_id(request_id):
+    """Makes request_id current for this context. Returns a token for unbind_request_id()."""
+    return _request_id.set(request_id)
+
+def unbind_request_id(token):
+    _request_id.reset(token)
+
+def current_request_id():
+    return _request_id.get()
+
+
+# --- Loggers ---
+class EventLogger(logging.LoggerAdapter):
+    """
+    A logger whose message is an event name and whose keyword arguments are
+    structured fields. Nothing is formatted on the calling thread.
+    """
+
+    def log(self, level, event, *args, exc_info=None, stack_info=False, email_fields=(), **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        rate = _sample_rates.get(event)
+        if rate is not None and level < logging.WARNING:
+            if random.random() >= rate:
+                LOG_RECORDS_DROPPED.inc(reason="sampled")
+                return
+            fields["sample_rate"] = rate
+        extra = {_RECORD_FIELDS: fields}
+        if email_fields:
+            extra[_RECORD_EMAIL_FIELDS] = EMAIL_FIELDS.union(email_fields)
+        self.logger.log(level, event, *args, exc_info=exc_info, stack_info=stack_info,
+                        extra=extra, stacklevel=3)
+
+    def debug(self, event, *args, **fields):
+        self.log(logging.DEBUG, event, *args, **fields)
+
+    def info(self, event, *args, **fields):
+        self.log(logging.INFO, event, *args, **fields)
+
+    def warning(self, event, *args, **fields):
+        self.log(logging.WARNING, event, *args, **fields)
+
+    def error(self, event, *args, **fields):
+        self.log(logging.ERROR, event, *args, **fields)
+
+    def exception(self, event, *args, exc_info=True, **fields):
+        self.log(logging.ERROR, event, *args, exc_info=exc_info, **fields)
+
+def get_logger(name):
+    configure_logging()
+    return EventLogger(logging.getLogger(name), {})
+
+
+# --- Formatting (on the writer thread) ---
+def _email(value):
+    if LOG_EMAILS == "plain" or not isinstance(value, str):
+        return value
+    if LOG_EMAILS == "omit" or not LOG_EMAIL_HMAC_KEY:
+        return None
+    address = value.strip().lower()
+    local, _, domain = address.rpartition("@")
+    if not local:
+        return None
+    # Same address, same digest: lines can still be correlated without the address in them,
+    # and without the key nobody can test guessed addresses against them
+    digest = hmac.new(LOG_EMAIL_HMAC_KEY.encode(), address.encode(), hashlib.sha256).hexdigest()[:16]
+    return f"{digest}@{domain}"
+
+def _record_dict(record):
+    entry = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+        "level": record.levelname.lower(),
+        "logger": record.name,
+        "event": record.getMessage(),
+    }
+    request_id = getattr(record, "request_id", None)
+    if request_id:
+        entry["request_id"] = request_id
+    email_fields = getattr(record, _RECORD_EMAIL_FIELDS, EMAIL_FIELDS)
+    for key, value in getattr(record, _RECORD_FIELDS, {}).items():
+        entry[key] = _email(value) if key in email_fields else value
+    if record.exc_info:
+        entry["error_type"] = record.exc_info[0].__name__
+        entry["traceback"] = "".join(traceback.format_exception(*record.exc_info))
+    return entry
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(_record_dict(record), default=str, ensure_ascii=False)
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        entry = _record_dict(record)
+        head = f"{entry.pop('ts')} {entry.pop('level').upper():<7} {entry.pop('event')}"
+        entry.pop("logger")
+        trace = entry.pop("traceback", None)
+        line = " ".join([head] + [f"{key}={value}" for key, value in entry.items()])
+        return f"{line}\n{trace.rstrip()}" if trace else line
+
+
+# --- Queue handler and writer thread ---
+class _RequestIdFilter(logging.Filter):
+    """Stamps the correlation id on every record, on the thread that logged it (library loggers too)."""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+class BackgroundHandler(QueueHandler):
+    """
+    Hands records to a writer thread through a bounded queue. Never blocks the
+    caller: a full queue drops the record. The thread (and queue) are created
+    per process on first use, so records logged after a fork are not lost.
+    """
+
+    def __init__(self, stream=None, formatter=None, maxsize=LOG_QUEUE_SIZE):
+        super().__init__(None)
+        self.stream = stream
+        self.target_formatter = formatter or (TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+        self.maxsize = maxsize
+        self.addFilter(_RequestIdFilter())
+        self._pid = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self.queue = queue.Queue(self.maxsize)
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def prepare(self, record):
+        # Formatting is left to the writer thread
+        return record
+
+    def enqueue(self, record):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(reason="queue_full")
+
+    def _write(self, record):
+        stream = self.stream or sys.stdout
+        try:
+            stream.write(self.target_formatter.format(record) + "\n")
+            stream.flush()
+        except Exception:
+            LOG_RECORDS_DROPPED.inc(reason="write_error")
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            try:
+                if record is None:
+                    return
+                self._write(record)
+            finally:
+                self.queue.task_done()
+
+    def depth(self):
+        return self.queue.qsize() if self._pid == os.getpid() else 0
+
+    def drain(self, timeout=5.0):
+        """Waits (up to timeout) until the records queued so far are written."""
+        if self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+_handler = None
+
+def configure_logging():
+    """Routes the root logger through the background handler (once per process)."""
+    global _handler
+    if _handler is not None:
+        return _handler
+    _handler = BackgroundHandler()
+    root = logging.getLogger()
+    root.handlers[:] = [_handler]
+    root.setLevel(LOG_LEVEL)
+    levels = dict(_LIBRARY_LEVELS)
+    for item in filter(None, (part.strip() for part in LOG_LEVELS.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+    if LOG_EMAILS == "hash" and not LOG_EMAIL_HMAC_KEY:
+        EventLogger(logging.getLogger(__name__), {}).warning(
+            "log_emails_omitted", reason="LOG_EMAILS=hash needs LOG_EMAIL_HMAC_KEY")
+    return _handler
+
+def drain_logs(timeout=5.0):
+    if _handler is not None:
+        _handler.drain(timeout)
+
+atexit.register(drain_logs)
+# Never fork (gunicorn workers, the KDF process pool) in the middle of a write to stdout
+os.register_at_fork(before=lambda: drain_logs(timeout=1.0))
+
+def _collect_log_gauges():
+    return [("log_queue_depth", "Log records waiting for the writer thread.", None,
+             _handler.depth() if _handler is not None else 0)]
+
+registry.register_collector(_collect_log_gauges)
@@ -0,0 +1,199 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Counters and histograms are plain Python objects guarded by one lock per
+labelled series, so recording a value costs a dict lookup, a bisect and a
+lock round trip. Set METRICS_ENABLED=false to turn every call into a no-op.
+
+Values are per process: with several workers, each one serves its own
+/metrics and Prometheus sums them.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import logging
+import os
+import threading
+import time
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Seconds; covers a ~1 ms PostgREST call up to a saturated PBKDF2 queue
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, state in series:
+            lines.extend(self._render_series(key, state))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._series.get(self._key(labels), 0)
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._series.get(key)
+            if state is None:
+                # [per-bucket counts (+Inf last), sum, count]
+                state = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of the `with` block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_series(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Holds metrics plus collectors that report point-in-time gauges when scraped."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def register_collector(self, collect):
+        """`collect()` returns [(name, help, {label: value} or None, value), ...]; reported as gauges."""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        gauges = {}
+        for collect in collectors:
+            try:
+                for name, help_text, labels, value in collect():
+                    gauges.setdefault(name, (help_text, []))[1].append((labels or {}, value))
+            except Exception:
+                # observability/log.py builds on this module, so this goes through plain logging
+                logging.getLogger(__name__).exception(
+                    "metrics_collector_failed", extra={"fields": {"collector": getattr(collect, '__name__', str(collect))}})
+        for name, (help_text, samples) in gauges.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# --- metrics shared across modules ---
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Time spent handling an HTTP request.", ("method", "route", "status"))
+SUPABASE_REQUEST_SECONDS = registry.histogram(
+    "supabase_request_duration_seconds", "Round trip of one Supabase call, body included.",
+    ("service", "target", "method"))
+SUPABASE_ERRORS = registry.counter(
+    "supabase_errors_total", "Supabase calls that failed or returned an error status.",
+    ("service", "target", "kind"))
+KDF_SECONDS = registry.histogram(
+    "kdf_duration_seconds", "PBKDF2 key derivation time; phase is wait (queued for a worker) or run.",
+    ("phase",))
+KDF_REJECTED = registry.counter("kdf_rejected_total", "Key derivations refused because the KDF queue was full.")
+LOGIN_STAGE_SECONDS = registry.histogram(
+    "login_stage_duration_seconds", "Time spent in each stage of /api/login.", ("stage",))
+LOGIN_ATTEMPTS = registry.counter("login_attempts_total", "Login attempts by outcome.", ("outcome",))
+LOCKOUTS_TRIGGERED = registry.counter("lockouts_triggered_total", "Account locks created.", ("backend",))
+DECRYPT_FAILURES = registry.counter(
+    "decrypt_failures_total", "Decryptions that failed (wrong password or corrupt data).", ("format",))
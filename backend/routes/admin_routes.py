@@ -0,0 +1,257 @@
+from flask import Blueprint, Response, request, jsonify
+from database.supabase_client import get_supabase_admin
+from database.resilience import no_request_budget
+from routes import responses
+from security_logic.lockout_manager import lookup_user_ids, unlock_users, clear_failed_attempts_bulk, get_utc_now
+from security_logic.attack_detector import attack_detector, ATTACK_DETECTOR_ACTION
+from observability.log import get_logger
+from datetime import datetime
+import csv
+import hmac
+import httpx
+import io
+import itertools
+import json
+import os
+
+# The admin API is disabled unless this is set; requests then need "Authorization: Bearer <ADMIN_API_TOKEN>".
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+# Rows fetched per request while streaming an export
+ADMIN_EXPORT_PAGE_SIZE = int(os.getenv("ADMIN_EXPORT_PAGE_SIZE", "1000"))
+# Most users one bulk request may name
+ADMIN_BULK_MAX_USERS = int(os.getenv("ADMIN_BULK_MAX_USERS", "10000"))
+
+log = get_logger(__name__)
+
+
+def _timestamp(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).isoformat()
+
+def _boolean(value):
+    if value.lower() not in ("true", "false"):
+        raise ValueError(f"expected true or false, got {value!r}")
+    return value.lower()
+
+
+class _Export:
+    """A table that can be exported: its keyset column, its columns and its query-string filters."""
+
+    def __init__(self, table, key, columns, filters):
+        self.table = table
+        self.key = key
+        self.columns = columns
+        # query parameter -> (column, filter method, parser)
+        self.filters = filters
+
+    def parse_filters(self, args):
+        """[(column, method, value)] for the filters in the query string. Raises ValueError."""
+        parsed = []
+        for param, (column, method, parse) in self.filters.items():
+            if args.get(param):
+                try:
+                    parsed.append((column, method, parse(args[param])))
+                except ValueError as e:
+                    raise ValueError(f"Invalid {param}: {e}")
+        return parsed
+
+    def pages(self, filters, after, limit):
+        """
+        Yields the matching rows a page at a time, in key order after `after`.
+        Each page is a `key > last key` query, so every page costs the same
+        however deep into the table the export is.
+        """
+        while limit is None or limit > 0:
+            size = ADMIN_EXPORT_PAGE_SIZE if limit is None else min(ADMIN_EXPORT_PAGE_SIZE, limit)
+            query = get_supabase_admin().table(self.table).select(", ".join(self.columns))
+            for column, method, value in filters:
+                query = getattr(query, method)(column, value)
+            if after is not None:
+                query = query.gt(self.key, after)
+            rows = query.order(self.key).limit(size).execute().data
+            if not rows:
+                return
+            yield rows
+            after = rows[-1][self.key]
+            if limit is not None:
+                limit -= len(rows)
+            if len(rows) < size:
+                return
+
+
+EXPORTS = {
+    "login-attempts": _Export(
+        "login_attempts", "attempt_id",
+        ["attempt_id", "timestamp", "user_id", "username_attempted", "ip_address", "success", "failure_reason"],
+        {
+            "user_id": ("user_id", "eq", str),
+            "email": ("username_attempted", "eq", str),
+            "ip": ("ip_address", "eq", str),
+            "success": ("success", "eq", _boolean),
+            "reason": ("failure_reason", "eq", str),
+            "since": ("timestamp", "gte", _timestamp),
+            "until": ("timestamp", "lt", _timestamp),
+        },
+    ),
+    "account-locks": _Export(
+        "account_locks", "lock_id",
+        ["lock_id", "user_id", "locked_at", "unlock_at", "failed_attempts_count"],
+        {
+            "user_id": ("user_id", "eq", str),
+            "since": ("locked_at", "gte", _timestamp),
+            "until": ("locked_at", "lt", _timestamp),
+        },
+    ),
+}
+
+admin_api = Blueprint('admin_api', __name__)
+
+
+@admin_api.before_request
+def require_admin_token():
+    """Every admin route needs the admin token; without one configured, the API does not exist."""
+    if not ADMIN_API_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    auth_header = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(auth_header, f"Bearer {ADMIN_API_TOKEN}"):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+
+def _csv_cell(value):
+    # Emails and failure reasons come from whoever tried to log in: keep spreadsheets from running them as formulas
+    if isinstance(value, str) and value[:1] in ("=", "+", "-", "@"):
+        return "'" + value
+    return value
+
+def _encode(export, pages, fmt):
+    """Serializes pages as they arrive. A failure mid-stream ends NDJSON output with a line to resume from."""
+    last_key = None
+    try:
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(export.columns)
+            for rows in pages:
+                writer.writerows([_csv_cell(row.get(column)) for column in export.columns] for row in rows)
+                last_key = rows[-1][export.key] if rows else last_key
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            for rows in pages:
+                if rows:
+                    last_key = rows[-1][export.key]
+                    yield "".join(json.dumps(row) + "\n" for row in rows)
+    except Exception:
+        log.exception("export_interrupted", table=export.table, resume_after=last_key)
+        if fmt == "ndjson":
+            yield json.dumps({"error": "Export interrupted", "resume_after": last_key}) + "\n"
+
+
+@admin_api.route('/api/admin/export/<name>', methods=['GET'])
+@no_request_budget
+def export_rows(name):
+    """
+    Streams login_attempts or account_locks rows, oldest first.
+    Query: ?format=ndjson|csv&after=<key to resume after>&limit=<n> plus the table's filters, e.g.
+    /api/admin/export/login-attempts?ip=203.0.113.7&success=false&since=2024-05-01T00:00:00Z
+    Memory use does not depend on the size of the result.
+    """
+    export = EXPORTS.get(name)
+    if export is None:
+        return jsonify({"error": f"Unknown export. Use one of: {', '.join(EXPORTS)}"}), 404
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ("ndjson", "csv"):
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+    try:
+        filters = export.parse_filters(request.args)
+        after = request.args.get('after', type=int)
+        limit = request.args.get('limit', type=int)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if name == "account-locks" and request.args.get('active') == 'true':
+        filters.append(("unlock_at", "gt", get_utc_now().isoformat()))
+
+    log.info("admin_export", table=export.table, format=fmt, filters=filters, after=after, limit=limit)
+    pages = export.pages(filters, after, limit)
+    try:
+        # Fetch the first page before answering, so a failing query is still an error status
+        first = next(pages, [])
+    except httpx.TransportError as e:
+        log.warning("database_unavailable", table=export.table, error=str(e))
+        return responses.unavailable(e)
+    except Exception:
+        log.exception("export_error", table=export.table)
+        return jsonify({"error": "An internal server error occurred"}), 500
+
+    extension, mimetype = ("csv", "text/csv") if fmt == "csv" else ("ndjson", "application/x-ndjson")
+    return Response(_encode(export, itertools.chain([first], pages), fmt), mimetype=mimetype, headers={
+        "Content-Disposition": f"attachment; filename={export.table}.{extension}",
+        # Let a reverse proxy pass pages on as they come instead of buffering the whole export
+        "X-Accel-Buffering": "no",
+    })
+
+
+@admin_api.route('/api/admin/attack-detector', methods=['GET'])
+def attack_report():
+    """
+    Top offenders of the attack detector right now, per client IP, subnet and email attempted.
+    Query: ?limit=<n>. Counts are approximate (never low) and belong to the process answering.
+    """
+    top = attack_detector.top(limit=request.args.get('limit', type=int))
+    return jsonify({
+        "window_seconds": attack_detector.window_seconds,
+        "action": ATTACK_DETECTOR_ACTION,
+        "thresholds": attack_detector.thresholds,
+        "flagged": [flag._asdict() for flag in attack_detector.flagged()],
+        "top": {dimension: [{"key": key, "failures": count} for key, count in entries]
+                for dimension, entries in top.items()},
+        "stats": attack_detector.stats(),
+    }), 200
+
+
+def _bulk(operation, verb):
+    """Runs a bulk lockout operation on {"user_ids": [...], "emails": [...]} from the JSON body."""
+    data = request.get_json(silent=True) or {}
+    user_ids = data.get('user_ids') or []
+    emails = data.get('emails') or []
+    if not isinstance(user_ids, list) or not isinstance(emails, list) \
+            or not all(isinstance(value, str) for value in user_ids + emails):
+        return jsonify({"error": "user_ids and emails must be lists of strings"}), 400
+    if not user_ids and not emails:
+        return jsonify({"error": "user_ids or emails is required"}), 400
+    if len(user_ids) + len(emails) > ADMIN_BULK_MAX_USERS:
+        return jsonify({"error": f"At most {ADMIN_BULK_MAX_USERS} users per request"}), 400
+
+    try:
+        found = lookup_user_ids(emails) if emails else {}
+        targets = list(dict.fromkeys(user_ids + list(found.values())))
+        operation(targets)
+    except httpx.TransportError as e:
+        # Every step is idempotent, so the whole request can simply be repeated
+        log.warning("database_unavailable", operation=verb, error=str(e))
+        return responses.unavailable(e)
+    except Exception:
+        log.exception("admin_bulk_error", operation=verb)
+        return jsonify({"error": "An internal server error occurred"}), 500
+
+    log.info("admin_bulk", operation=verb, users=len(targets), emails_not_found=len(emails) - len(found))
+    return jsonify({
+        "success": True,
+        "users": len(targets),
+        "emails_not_found": [email for email in emails if email not in found],
+    }), 200
+
+
+@admin_api.route('/api/admin/unlock', methods=['POST'])
+@no_request_budget
+def bulk_unlock():
+    """Ends active locks, clears failed attempts and resets profiles.is_locked for many users at once."""
+    return _bulk(unlock_users, "unlock")
+
+
+@admin_api.route('/api/admin/clear-failures', methods=['POST'])
+@no_request_budget
+def bulk_clear_failures():
+    """Clears the failed login attempts of many users at once, leaving their locks in place."""
+    return _bulk(clear_failed_attempts_bulk, "clear")
@@ -0,0 +1,354 @@
+"""
+The busiest auth_api / data_api endpoints, written once for asyncio.
+
+Each handler is a coroutine taking plain request data and returning
+(payload, status, headers), so the same code serves both modes:
+  - asgi_server.py awaits them on its event loop (uvicorn);
+  - the Flask views (auth_routes.py, data_routes.py) return run_handler(...),
+    which runs them on one event loop thread per process.
+
+Supabase calls go through the async clients and independent ones run
+concurrently; key derivation is awaited on the KDF pool, and the remaining
+synchronous steps (job queue, lazy record migration) run on a thread, so the
+event loop never blocks.
+"""
+from flask import jsonify
+from database.supabase_client import get_async_supabase_admin, get_async_auth_client
+from database.resilience import budget, remaining_budget, retry_after_hint
+from database.user_key_store import load_user_key_async
+from security_logic.lockout_manager import (
+    resolve_login_state_async,
+    check_lock_status,
+    log_login_attempt_async,
+    record_failed_login_async,
+    clear_failed_attempts_async,
+    apply_degraded_mode,
+    LockoutUnavailable,
+)
+from security_logic.data_encryptor import decrypt_with_data_key
+from security_logic.kdf_executor import kdf_executor, KDFBusyError
+from security_logic.profile_cache import profile_cache
+from security_logic.login_screening import screen_login, login_unavailable
+from security_logic.record_format import decode_record, TOKEN_FORMATS
+from security_logic.user_keys import (
+    decrypt_for_user,
+    unlock_data_key_async,
+    WrongPasswordError,
+    DataKeyRewrapRequired,
+    DataKeyNotReady,
+)
+from routes import responses
+from jobs.signup_jobs import enqueue_signup, ensure_initial_data, resume_initial_data
+from observability.metrics import LOGIN_STAGE_SECONDS, LOGIN_ATTEMPTS
+from observability.log import get_logger, bind_request_id, current_request_id
+from gotrue.errors import AuthRetryableError
+import asyncio
+import httpx
+import os
+import threading
+
+log = get_logger(__name__)
+
+
+class _EventLoopThread:
+    """One event loop per process on a daemon thread, for calling handlers from WSGI threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+
+    def _get_loop(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # A loop inherited through fork has no thread running it
+                    self._loop = asyncio.new_event_loop()
+                    threading.Thread(target=self._loop.run_forever, name="async-handlers", daemon=True).start()
+                    self._pid = os.getpid()
+        return self._loop
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop()).result()
+
+_loop_thread = _EventLoopThread()
+
+async def _within(seconds, request_id, coro):
+    # Runs as its own task, so neither setting leaks into other handlers
+    bind_request_id(request_id)
+    if seconds is None:
+        return await coro
+    with budget(seconds):
+        return await coro
+
+def run_handler(coro):
+    """Runs a handler from a Flask view and returns the view's response."""
+    # The loop thread does not see the view's context: hand it what is left of the
+    # request budget, and the request id its log lines are tagged with
+    payload, status, headers = _loop_thread.run(_within(remaining_budget(), current_request_id(), coro))
+    return jsonify(payload), status, headers
+
+
+# ----------------------------------------------------------
+# 🟢 SIGN UP
+# ----------------------------------------------------------
+async def signup(data):
+    """POST /api/signup"""
+    try:
+        username = data.get('username')
+        email = data.get('email')
+        password = data.get('password')
+
+        if not all([username, email, password]):
+            return {'error': 'Username, email, and password are required'}, 400, {}
+        if len(password) < 6:
+            return {'error': 'Password must be at least 6 characters long'}, 400, {}
+        if not kdf_executor.has_capacity():
+            return responses.busy()
+
+        auth_response = await get_async_auth_client().sign_up({"email": email, "password": password})
+
+        if auth_response.user:
+            user_id = auth_response.user.id
+            log.info("user_created", user_id=user_id, email=email)
+            profile_data = {
+                "user_id": user_id,
+                "username": username,
+                "email": email,
+                "first_name": data.get('first_name', ''),
+                "last_name": data.get('last_name', ''),
+                "is_locked": False
+            }
+            # A local SQLite write: off the loop, but no network involved
+            await asyncio.to_thread(enqueue_signup, profile_data, password)
+            return {
+                'success': True,
+                'user_id': user_id,
+                'message': 'User created successfully. Please check your email for confirmation.'
+            }, 201, {}
+
+        error_message = "Failed to create user in Auth."
+        if hasattr(auth_response, 'error') and auth_response.error:
+            error_message += f" Reason: {auth_response.error.message}"
+        elif hasattr(auth_response, 'message'):
+            error_message += f" Reason: {auth_response.message}"
+        log.warning("signup_failed", email=email, reason=error_message)
+        return {'error': error_message}, 400, {}
+
+    except Exception as e:
+        log.exception("signup_error")
+        return {'error': f"An internal server error occurred: {str(e)}"}, 500, {}
+
+
+# ----------------------------------------------------------
+# 🟡 LOGIN
+# ----------------------------------------------------------
+async def _clear_failures(user_id):
+    try:
+        await clear_failed_attempts_async(user_id)
+    except Exception as clear_error:
+        apply_degraded_mode("clear_failures", clear_error)
+
+async def login(data, remote_addr):
+    """POST /api/login"""
+    try:
+        email = data.get('email')
+        password = data.get('password')
+        if not all([email, password]):
+            return {'error': 'Email and password are required'}, 400, {}
+        refused = screen_login(email, remote_addr)
+        if refused:
+            LOGIN_ATTEMPTS.inc(outcome="refused")
+            return refused
+
+        # The lock check has to finish before the password is tried, so it is not overlapped
+        with LOGIN_STAGE_SECONDS.time(stage="lock_check"):
+            user_id, is_locked, message, remaining_sec = await resolve_login_state_async(email)
+        if is_locked:
+            LOGIN_ATTEMPTS.inc(outcome="locked")
+            return {
+                'error': 'account_locked',
+                'message': message,
+                'lockout_duration_seconds': remaining_sec
+            }, 429, {}
+
+        try:
+            with LOGIN_STAGE_SECONDS.time(stage="auth"):
+                session_response = await get_async_auth_client().sign_in_with_password({
+                    "email": email,
+                    "password": password
+                })
+
+            if session_response.session and session_response.user:
+                if user_id is None:
+                    # Account created by another worker after our Bloom filter was built:
+                    # its lock was never checked, so check it before answering
+                    profile_cache.remember_signup(session_response.user.id, email)
+                    is_locked, message, remaining_sec = await asyncio.to_thread(
+                        check_lock_status, session_response.user.id)
+                    if is_locked:
+                        LOGIN_ATTEMPTS.inc(outcome="locked")
+                        return {
+                            'error': 'account_locked',
+                            'message': message,
+                            'lockout_duration_seconds': remaining_sec
+                        }, 429, {}
+                user_id = session_response.user.id
+                log.info("login_succeeded", user_id=user_id, email=email, ip=remote_addr)
+
+                # The audit row and the failed-attempt cleanup are independent: run them together
+                with LOGIN_STAGE_SECONDS.time(stage="clear_failures"):
+                    await asyncio.gather(
+                        log_login_attempt_async(user_id, email, remote_addr, True, None),
+                        _clear_failures(user_id),
+                    )
+                # Hands the initial-data job this password if it lost the one from signup
+                await asyncio.to_thread(resume_initial_data, user_id, password)
+                LOGIN_ATTEMPTS.inc(outcome="success")
+
+                return {
+                    'success': True,
+                    'message': 'Login successful!',
+                    'access_token': session_response.session.access_token,
+                    'refresh_token': session_response.session.refresh_token
+                }, 200, {}
+            raise Exception("Login response from Supabase unexpected.")
+
+        except LockoutUnavailable:
+            raise
+
+        except AuthRetryableError as auth_down:
+            log.warning("auth_unavailable", email=email, error=str(auth_down))
+            return login_unavailable(), 503, {'Retry-After': str(retry_after_hint(auth_down))}
+
+        except Exception as auth_error:
+            log.info("login_failed", email=email, ip=remote_addr, reason=str(auth_error))
+            with LOGIN_STAGE_SECONDS.time(stage="record_failure"):
+                is_now_locked, message, duration_sec = await record_failed_login_async(
+                    user_id, email, remote_addr, "Invalid credentials"
+                )
+            LOGIN_ATTEMPTS.inc(outcome="locked" if is_now_locked else "failure")
+            if is_now_locked:
+                return {
+                    'error': 'account_locked',
+                    'message': message,
+                    'lockout_duration_seconds': duration_sec
+                }, 429, {}
+            return {'error': 'Invalid email or password'}, 401, {}
+
+    except LockoutUnavailable as unavailable:
+        log.warning("login_unavailable", email=data.get('email'), error=str(unavailable))
+        LOGIN_ATTEMPTS.inc(outcome="unavailable")
+        return login_unavailable(), 503, {'Retry-After': str(unavailable.retry_after)}
+
+    except Exception:
+        log.exception("login_error")
+        return {'error': 'An internal server error occurred.'}, 500, {}
+
+
+# ----------------------------------------------------------
+# FORGOT PASSWORD
+# ----------------------------------------------------------
+async def forgot_password(data):
+    """POST /api/forgot-password"""
+    answer = {
+        'success': True,
+        'message': 'If an account with that email exists, a password reset link has been sent.'
+    }
+    try:
+        email = data.get('email')
+        if not email:
+            return {'error': 'Email is required'}, 400, {}
+        log.info("password_reset_requested", email=email)
+        await get_async_auth_client().reset_password_for_email(
+            email, {"redirect_to": "http://localhost:5000/reset-password"}
+        )
+    except Exception:
+        log.exception("forgot_password_error")
+    # Same answer either way, to prevent email enumeration
+    return answer, 200, {}
+
+
+# ----------------------------------------------------------
+# ACCESS FILE
+# ----------------------------------------------------------
+async def _fetch_token_rows(user_id):
+    res = await get_async_supabase_admin().table("user_data") \
+                .select("data_id, data_content, salt, data_blob, storage_format, updated_at") \
+                .eq("user_id", user_id) \
+                .in_("storage_format", list(TOKEN_FORMATS)) \
+                .order("data_id") \
+                .limit(1) \
+                .execute()
+    return res.data
+
+async def _decrypt_row(user_id, password, row, stored):
+    """decrypt_for_user() for one row, with the user_keys row possibly already loaded."""
+    token, salt, _ = decode_record(row)
+    if salt is not None:
+        # Salted rows are migrated to the data key as they are read; that path stays synchronous
+        return (await asyncio.to_thread(decrypt_for_user, user_id, password, [row]))[0]
+    try:
+        data_key = await unlock_data_key_async(user_id, password, stored)
+    except DataKeyRewrapRequired:
+        raise
+    except WrongPasswordError:
+        return None
+    if data_key is None:
+        return None
+    return decrypt_with_data_key([token], data_key)[0]
+
+async def access_file(user_id, data):
+    """POST /api/access-file (user_id verified by the caller)"""
+    try:
+        log.info("file_access", user_id=user_id)
+        password = data.get('password')
+        if not password:
+            return {"error": "Password is required"}, 400, {}
+
+        # The record and the wrapped data key are independent lookups: fetch both at once
+        rows, stored = await asyncio.gather(_fetch_token_rows(user_id), load_user_key_async(user_id))
+
+        if not rows:
+            log.warning("user_data_missing", user_id=user_id, action="running the initial data job")
+            try:
+                job_status = await asyncio.to_thread(ensure_initial_data, user_id)
+            except (KDFBusyError, DataKeyNotReady, httpx.TransportError):
+                raise
+            except Exception:
+                log.exception("initial_data_error", user_id=user_id)
+                return {"error": "Failed to create initial data file. Please try again."}, 500, {}
+            if job_status is None:
+                log.warning("profile_missing", user_id=user_id)
+                return {"error": "User profile not found"}, 404, {}
+            rows = await _fetch_token_rows(user_id)
+            if not rows:
+                return {"error": "Failed to create initial data file"}, 500, {}
+            # The job may have created the data key just now
+            stored = None
+
+        decrypted_content = await _decrypt_row(user_id, password, rows[0], stored)
+        if decrypted_content is None:
+            return {"error": "Decryption failed. Invalid password."}, 403, {}
+        return {"success": True, "decrypted_data": decrypted_content}, 200, {}
+
+    except DataKeyRewrapRequired as stale:
+        return responses.rewrap_required(stale)
+
+    except DataKeyNotReady as pending:
+        return responses.setup_pending(pending)
+
+    except WrongPasswordError:
+        return {"error": "Decryption failed. Invalid password."}, 403, {}
+
+    except KDFBusyError as busy:
+        log.warning("kdf_busy", user_id=user_id)
+        return responses.busy(busy.retry_after)
+
+    except httpx.TransportError as e:
+        log.warning("database_unavailable", user_id=user_id, error=str(e))
+        return responses.unavailable(e)
+
+    except Exception:
+        log.exception("file_access_error", user_id=user_id)
+        return {"error": "An internal server error occurred"}, 500, {}
@@ -1,108 +1,48 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
 from database.supabase_client import (
-    supabase,
-    supabase_admin,
-    SUPABASE_URL,
-    SUPABASE_SERVICE_KEY,
-    SUPABASE_ANON_KEY
+    get_auth_client
 )
 from security_logic.lockout_manager import (
-    check_lock_status,
-    log_login_attempt,
-    trigger_lock_if_needed,
+    clear_failed_attempts,
     LOCKOUT_DURATION_SECONDS
 )
-from security_logic.data_encryptor import encrypt_data
-import base64
-from datetime import datetime
-import traceback
+from security_logic.data_encryptor import invalidate_cached_keys
+from security_logic.kdf_executor import KDFBusyError
+from security_logic.token_verifier import token_verifier
+from security_logic.rate_limiter import rate_limiter
+from database.profile_store import set_password_changed_at
+from routes.decorators import require_auth
+from routes import responses
+from security_logic.user_keys import rewrap_data_key, WrongPasswordError
+from routes import async_handlers
+from routes.async_handlers import run_handler
+from observability.log import get_logger
+from datetime import datetime, timezone
+
+log = get_logger(__name__)
 
 auth_api = Blueprint('auth_api', __name__)
 
+
+@auth_api.before_request
+def enforce_rate_limit():
+    """Per-IP and per-subnet budgets, checked before any database or auth call."""
+    allowed, retry_after, scope = rate_limiter.check(request.path, request.remote_addr)
+    if not allowed:
+        log.info("rate_limited", ip=request.remote_addr, scope=scope, path=request.path, retry_after=retry_after)
+        return jsonify({
+            'error': 'rate_limited',
+            'message': f'Too many requests. Please try again in {retry_after} seconds.',
+            'retry_after_seconds': retry_after
+        }), 429, {'Retry-After': str(retry_after)}
+
 # ----------------------------------------------------------
 # 🟢 SIGN UP
 # ----------------------------------------------------------
 @auth_api.route('/api/signup', methods=['POST'])
 def signup():
     """Handle user sign-up"""
-    try:
-        data = request.get_json()
-        username = data.get('username')
-        email = data.get('email')
-        password = data.get('password')
-        first_name = data.get('first_name', '')
-        last_name = data.get('last_name', '')
-
-        if not all([username, email, password]):
-            return jsonify({'error': 'Username, email, and password are required'}), 400
-        if len(password) < 6:
-            return jsonify({'error': 'Password must be at least 6 characters long'}), 400
-
-        print(f"Attempting signup for: {email}")
-
-        # Create the user in Supabase Auth
-        auth_response = supabase.auth.sign_up({"email": email, "password": password})
-
-        if auth_response.user:
-            user_id = auth_response.user.id
-            print(f"✅ User created in Auth: {user_id}")
-
-            # 1. Insert or update user profile in 'profiles' table
-            profile_data = {
-                "user_id": user_id,
-                "username": username,
-                "email": email,
-                "first_name": first_name,
-                "last_name": last_name,
-                "is_locked": False
-            }
-            # Use ADMIN client to bypass RLS and modify profile
-            supabase_admin.table("profiles").upsert(profile_data).execute()
-            print("✅ Profile upserted.")
-
-            try:
-                initial_data = f"User {username}'s secure file, created on {datetime.now().isoformat()}"
-                
-                # 3. Encrypt it using the new user's password
-                encrypted_content_bytes, salt_bytes = encrypt_data(initial_data, password)
-                
-                # 4. Encode to base64 text for database storage
-                encrypted_content_text = base64.b64encode(encrypted_content_bytes).decode('utf-8')
-                salt_text = base64.b64encode(salt_bytes).decode('utf-8')
-
-                # 5. Insert the encrypted data and the salt into user_data
-                user_data_payload = {
-                    "user_id": user_id,
-                    "data_type": "profile_info",
-                    "data_content": encrypted_content_text, # Store encrypted text
-                    "salt": salt_text,                   # Store the salt
-                    "encrypted": True
-                }
-                data_result = supabase_admin.table("user_data").insert(user_data_payload).execute()
-                print(f"✅ Initial user data (encrypted) created.")
-
-            except Exception as data_err:
-                    print(f"❌ Warning: Could not create initial user_data. {data_err}")
-                    # Don't fail the whole signup, just log the warning
-
-            return jsonify({
-                'success': True,
-                'user_id': user_id,
-                'message': 'User created successfully. Please check your email for confirmation.'
-            }), 201
-        else:
-            error_message = "Failed to create user in Auth."
-            if hasattr(auth_response, 'error') and auth_response.error:
-                error_message += f" Reason: {auth_response.error.message}"
-            elif hasattr(auth_response, 'message'):
-                error_message += f" Reason: {auth_response.message}"
-            print(error_message)
-            return jsonify({'error': error_message}), 400
-
-    except Exception as e:
-        print(f"❌ Sign-up endpoint error: {e}")
-        traceback.print_exc()
-        return jsonify({'error': f"An internal server error occurred: {str(e)}"}), 500
+    return run_handler(async_handlers.signup(request.get_json(silent=True) or {}))
 
 
 # ----------------------------------------------------------
@@ -111,138 +51,29 @@ def signup():
 @auth_api.route('/api/login', methods=['POST'])
 def login():
     """Handle user login with custom security checks"""
-    try:
-        data = request.get_json()
-        email = data.get('email')
-        password = data.get('password')
-        user_id = None
-
-        if not all([email, password]):
-            return jsonify({'error': 'Email and password are required'}), 400
-
-        # --- 1. Lookup user_id from the profiles table ---
-        try:
-            user_res = supabase_admin.from_("profiles").select("user_id").eq("email", email).execute()
-            if user_res.data and len(user_res.data) > 0:
-                user_id = user_res.data[0]['user_id']
-                print(f"Found user_id ({user_id}) for email {email}.")
-            else:
-                print(f"No user found for email {email}.")
-        except Exception as lookup_err:
-            print(f"Admin client error looking up user by email: {lookup_err}")
-
-        # --- 2. Check lockout status ---
-        if user_id:
-            is_locked, message, remaining_sec = check_lock_status(user_id)
-            if is_locked:
-                return jsonify({
-                    'error': 'account_locked',
-                    'message': message,
-                    'lockout_duration_seconds': remaining_sec
-                }), 429
-
-        # --- 3. Attempt login ---
-        try:
-            session_response = supabase.auth.sign_in_with_password({
-                "email": email,
-                "password": password
-            })
-
-            # --- 4. Success ---
-            if session_response.session and session_response.user:
-                user_id = session_response.user.id
-                print(f"✅ Login successful for user {user_id} ({email}).")
-
-                log_login_attempt(user_id, email, request.remote_addr, True, None)
-                
-                # --- RESET FAILED ATTEMPTS ON SUCCESSFUL LOGIN ---
-                print(f"Resetting failed login attempts for user {user_id}.")
-                supabase_admin.table("login_attempts") \
-                              .delete() \
-                              .eq("user_id", user_id) \
-                              .eq("success", False) \
-                              .execute()
-
-                supabase_admin.table("profiles").update({"is_locked": False}).eq("user_id", user_id).execute()
-
-                return jsonify({
-                    'success': True,
-                    'message': 'Login successful!',
-                    'access_token': session_response.session.access_token,
-                    'refresh_token': session_response.session.refresh_token
-                }), 200
-            else:
-                raise Exception("Login response from Supabase unexpected.")
-
-        except Exception as auth_error:
-            # --- 5. FAILURE ---
-            print(f"❌ Authentication failed for {email}: {auth_error}")
-            log_login_attempt(user_id, email, request.remote_addr, False, "Invalid credentials")
-
-            if user_id: # Only lock if we know who the user is
-                is_now_locked, message, duration_sec = trigger_lock_if_needed(user_id, email)
-                if is_now_locked:
-                    return jsonify({
-                        'error': 'account_locked',
-                        'message': message,
-                        'lockout_duration_seconds': duration_sec 
-                    }), 429
-
-            return jsonify({'error': 'Invalid email or password'}), 401
-
-    except Exception as e:
-        print(f"🔥 FATAL login endpoint error: {e}")
-        traceback.print_exc()
-        return jsonify({'error': 'An internal server error occurred.'}), 500
+    return run_handler(async_handlers.login(request.get_json(silent=True) or {}, request.remote_addr))
 
 
 #forgot pass
 @auth_api.route('/api/forgot-password', methods=['POST'])
 def forgot_password():
     """Send password reset email to user"""
-    try:
-        data = request.get_json()
-        email = data.get('email')
-
-        if not email:
-            return jsonify({'error': 'Email is required'}), 400
-
-        print(f"Attempting password reset for: {email}")
-
-        # Use Supabase Auth to send password reset email
-        # This will send an email with a reset link to the user
-        response = supabase.auth.reset_password_for_email(
-            email,
-            {
-                "redirect_to": "http://localhost:5000/reset-password"
-            }
-        )
-
-        # Supabase doesn't raise an error if email doesn't exist (security feature)
-        # So we always return success to prevent email enumeration
-        return jsonify({
-            'success': True,
-            'message': 'If an account with that email exists, a password reset link has been sent.'
-        }), 200
-
-    except Exception as e:
-        print(f"Forgot password endpoint error: {e}")
-        traceback.print_exc()
-        # Still return success to prevent email enumeration
-        return jsonify({
-            'success': True,
-            'message': 'If an account with that email exists, a password reset link has been sent.'
-        }), 200
+    return run_handler(async_handlers.forgot_password(request.get_json(silent=True) or {}))
 
 
 #reset pass
 @auth_api.route('/api/reset-password', methods=['POST'])
 def reset_password():
-    """Reset user password using token from email"""
+    """
+    Reset user password using token from email.
+    If the old password is sent too (`old_password`), the user's data key is
+    re-wrapped so their encrypted data stays readable with the new one.
+    """
     try:
         data = request.get_json()
         password = data.get('password')
         token = data.get('token')
+        old_password = data.get('old_password')
 
         if not password:
             return jsonify({'error': 'Password is required'}), 400
@@ -251,34 +82,49 @@ def reset_password():
         if not token:
             return jsonify({'error': 'Reset token is required'}), 400
 
-        print(f"Attempting password reset with token")
-
         # Exchange the token for a session and update password
-        session_response = supabase.auth.set_session(token)
+        # (on a per-request auth client so the session never touches shared state)
+        auth_client = get_auth_client()
+        session_response = auth_client.set_session(token)
         
         if session_response.user:
             user_id = session_response.user.id
             
             # Update the password
-            update_response = supabase.auth.update_user({
+            update_response = auth_client.update_user({
                 "password": password
             })
 
             if update_response.user:
-                print(f"Password reset successful for user {user_id}")
-                
-                # Also unlock the account if it was locked
-                supabase_admin.table("profiles").update({"is_locked": False}).eq("user_id", user_id).execute()
-                
-                # Clear failed login attempts
-                supabase_admin.table("login_attempts") \
-                              .delete() \
-                              .eq("user_id", user_id) \
-                              .eq("success", False) \
-                              .execute()
+                log.info("password_reset", user_id=user_id)
+
+                # Data keys wrapped before now are stale, unless re-wrapped below (see user_keys.py)
+                try:
+                    set_password_changed_at(user_id, datetime.now(timezone.utc))
+                except Exception as e:
+                    log.warning("password_change_not_recorded", user_id=user_id, error=str(e))
+
+                # Also unlock the account and clear failed login attempts
+                clear_failed_attempts(user_id)
+
+                # Keys derived from the old password must not be served from cache
+                invalidate_cached_keys(user_id)
+
+                # Sessions issued before the reset are no longer accepted
+                token_verifier.revoke_user_tokens(user_id)
+
+                data_key_rewrapped = False
+                if old_password:
+                    try:
+                        data_key_rewrapped = rewrap_data_key(user_id, old_password, password)
+                    except WrongPasswordError:
+                        log.warning("data_key_not_rewrapped", user_id=user_id, reason="old password does not unlock it")
+                    except Exception:
+                        log.exception("data_key_rewrap_error", user_id=user_id)
 
                 return jsonify({
                     'success': True,
+                    'data_key_rewrapped': data_key_rewrapped,
                     'message': 'Password reset successful. You can now login with your new password.'
                 }), 200
             else:
@@ -286,54 +132,64 @@ def reset_password():
         else:
             return jsonify({'error': 'Invalid or expired reset token'}), 400
 
-    except Exception as e:
-        print(f"Reset password endpoint error: {e}")
-        traceback.print_exc()
+    except Exception:
+        log.exception("reset_password_error")
         return jsonify({'error': 'Invalid or expired reset token'}), 400
 
 
 
 # reset pass (unlock account after reset)
 @auth_api.route('/api/reset-password-cleanup', methods=['POST'])
+@require_auth
 def reset_password_cleanup():
     """Unlock account and clear failed attempts after password reset"""
     try:
-        # Get access token from Authorization header
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Missing or invalid authorization token'}), 401
-        
-        access_token = auth_header.split('Bearer ')[1]
-        
-        # Create a Supabase client with the access token to get user info
-        from supabase import create_client
-        supabase_with_token = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
-        
-        # Get the user from the token
-        user_res = supabase_with_token.auth.get_user(access_token)
-        
-        if not user_res.user:
-            return jsonify({'error': 'Invalid or expired token'}), 401
+        # The access token was verified by @require_auth
+        user_id = g.user_id
+        log.info("password_reset_cleanup", user_id=user_id)
 
-        user_id = user_res.user.id
-        print(f"Cleaning up after password reset for user {user_id}")
+        # Unlock the account and clear failed login attempts
+        clear_failed_attempts(user_id)
 
-        # Unlock the account if it was locked
-        supabase_admin.table("profiles").update({"is_locked": False}).eq("user_id", user_id).execute()
-        
-        # Clear failed login attempts
-        supabase_admin.table("login_attempts") \
-                      .delete() \
-                      .eq("user_id", user_id) \
-                      .eq("success", False) \
-                      .execute()
+        # Keys derived from the old password must not be served from cache
+        invalidate_cached_keys(user_id)
+
+        # Sessions issued before the reset are no longer accepted
+        token_verifier.revoke_user_tokens(user_id)
 
         return jsonify({
             'success': True,
             'message': 'Account unlocked and login attempts cleared.'
         }), 200
 
-    except Exception as e:
-        print(f"Reset password cleanup error: {e}")
-        traceback.print_exc()
-        return jsonify({'error': 'An error occurred during cleanup'}), 500
\ No newline at end of file
+    except Exception:
+        log.exception("reset_password_cleanup_error")
+        return jsonify({'error': 'An error occurred during cleanup'}), 500
+
+
+# re-wrap the data key (after a reset done without the old password)
+@auth_api.route('/api/rewrap-data-key', methods=['POST'])
+@require_auth
+def rewrap_data_key_endpoint():
+    """Re-wraps the user's data key from their previous password to the current one."""
+    try:
+        user_id = g.user_id
+        data = request.get_json(silent=True) or {}
+        old_password = data.get('old_password')
+        new_password = data.get('new_password')
+        if not all([old_password, new_password]):
+            return jsonify({'error': 'Old and new password are required'}), 400
+
+        if not rewrap_data_key(user_id, old_password, new_password):
+            return jsonify({'error': 'No data key found for this account'}), 404
+        return jsonify({'success': True, 'message': 'Your data is now unlocked by your new password.'}), 200
+
+    except WrongPasswordError:
+        return jsonify({'error': 'Old password is incorrect'}), 403
+
+    except KDFBusyError as busy:
+        return responses.busy(busy.retry_after)
+
+    except Exception:
+        log.exception("data_key_rewrap_error", user_id=g.user_id)
+        return jsonify({'error': 'An internal server error occurred'}), 500
@@ -1,98 +1,212 @@
-from flask import Blueprint, request, jsonify
-from database.supabase_client import supabase, supabase_admin
-from security_logic.data_encryptor import encrypt_data, decrypt_data
-from datetime import datetime
+from flask import Blueprint, request, jsonify, g, Response
+from database.supabase_client import get_supabase_admin
+from database.resilience import no_request_budget
+from database.chunk_store import write_stream, read_stream
+from security_logic.chunked_cipher import encrypt_stream, decrypt_stream, read_header, StreamFormatError, SALT_SIZE, KDF_DATA_KEY
+from security_logic.user_keys import (
+    decrypt_for_user,
+    data_key_for_write,
+    unlock_data_key,
+    WrongPasswordError,
+    DataKeyRewrapRequired,
+    DataKeyNotReady,
+    USER_DATA_ENVELOPE
+)
+from security_logic.record_format import TOKEN_FORMATS, CHUNKED_FORMAT
+from security_logic.kdf_executor import KDFBusyError
+from routes.decorators import require_auth
+from routes import responses
+from jobs.signup_jobs import ensure_initial_data
+from routes import async_handlers
+from routes.async_handlers import run_handler
+from observability.metrics import DECRYPT_FAILURES
+from observability.log import get_logger
 import base64
+import httpx
+import itertools
+import os
+
+# Largest plaintext accepted by the streaming upload endpoint
+MAX_STREAM_UPLOAD_BYTES = int(os.getenv("MAX_STREAM_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+STREAM_READ_SIZE = 64 * 1024
+
+log = get_logger(__name__)
+
+
+class _UploadTooLarge(Exception):
+    pass
 
 data_api = Blueprint('data_api', __name__)
 
 @data_api.route('/api/access-file', methods=['POST'])
+@require_auth
 def access_file():
     """
     Securely fetches and decrypts a user's data.
     Expects a valid JWT for auth and the user's password in the body.
     """
+    return run_handler(async_handlers.access_file(g.user_id, request.get_json(silent=True) or {}))
+
+
+def _read_request_body(counter):
+    """Yields the raw request body in pieces, enforcing MAX_STREAM_UPLOAD_BYTES."""
+    while True:
+        piece = request.stream.read(STREAM_READ_SIZE)
+        if not piece:
+            return
+        counter[0] += len(piece)
+        if counter[0] > MAX_STREAM_UPLOAD_BYTES:
+            raise _UploadTooLarge()
+        yield piece
+
+
+@data_api.route('/api/files', methods=['POST'])
+@require_auth
+@no_request_budget
+def upload_file():
+    """
+    Streams the raw request body into a new encrypted user_data row.
+    The password goes in the X-Data-Password header, an optional label in X-Data-Type.
+    Plaintext is encrypted and stored chunk by chunk, never held whole in memory.
+    """
+    user_id = g.user_id
+    password = request.headers.get('X-Data-Password')
+    if not password:
+        return jsonify({"error": "X-Data-Password header is required"}), 400
+    if request.content_length is not None and request.content_length > MAX_STREAM_UPLOAD_BYTES:
+        return jsonify({"error": "File is too large"}), 413
+
+    data_id = None
+    try:
+        salt = os.urandom(SALT_SIZE)
+        plaintext_size = [0]
+        if USER_DATA_ENVELOPE:
+            try:
+                data_key = data_key_for_write(user_id, password)
+            except DataKeyNotReady:
+                # As for new records (record_routes.py): the initial-data job makes the key
+                ensure_initial_data(user_id)
+                data_key = data_key_for_write(user_id, password)
+            stream = encrypt_stream(_read_request_body(plaintext_size), salt=salt, data_key=data_key)
+        else:
+            stream = encrypt_stream(_read_request_body(plaintext_size), password, salt=salt)
+        # Pull the header first: it derives the key, so a busy KDF pool fails before anything is written
+        header = next(stream)
+
+        row = get_supabase_admin().table("user_data").insert({
+            "user_id": user_id,
+            "data_type": request.headers.get('X-Data-Type', 'file'),
+            "data_content": None,
+            "salt": base64.b64encode(salt).decode('utf-8'),
+            "encrypted": True,
+            "storage_format": CHUNKED_FORMAT,
+        }).execute()
+        data_id = row.data[0]['data_id']
+
+        stored = write_stream(data_id, itertools.chain([header], stream))
+        get_supabase_admin().table("user_data").update({"content_size": plaintext_size[0]}).eq("data_id", data_id).execute()
+        log.info("file_uploaded", user_id=user_id, data_id=data_id, size=plaintext_size[0], stored_size=stored)
+
+        return jsonify({"success": True, "data_id": data_id, "size": plaintext_size[0]}), 201
+
+    except DataKeyRewrapRequired as stale:
+        return responses.rewrap_required(stale)
+
+    except DataKeyNotReady as pending:
+        return responses.setup_pending(pending)
+
+    except WrongPasswordError:
+        return jsonify({"error": "Invalid password."}), 403
+
+    except KDFBusyError as busy:
+        log.warning("kdf_busy", user_id=user_id)
+        return responses.busy(busy.retry_after)
+
+    except _UploadTooLarge:
+        _discard_upload(data_id)
+        return jsonify({"error": "File is too large"}), 413
+
+    except Exception:
+        log.exception("file_upload_error", user_id=user_id, data_id=data_id)
+        _discard_upload(data_id)
+        return jsonify({"error": "An internal server error occurred"}), 500
+
+
+def _discard_upload(data_id):
+    """Removes a partially written upload (its chunks go with it via ON DELETE CASCADE)."""
+    if data_id is None:
+        return
+    try:
+        get_supabase_admin().table("user_data").delete().eq("data_id", data_id).execute()
+    except Exception as e:
+        log.warning("upload_cleanup_error", data_id=data_id, error=str(e))
+
+
+@data_api.route('/api/files/<int:data_id>/download', methods=['POST'])
+@require_auth
+def download_file(data_id):
+    """
+    Streams a decrypted user_data row back to its owner.
+    Expects the user's password in the JSON body. Works for both streamed
+    uploads and the original Fernet rows.
+    """
     try:
-        # 1. Get access token from Authorization header
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({"error": "Missing or invalid authorization token"}), 401
-        
-        access_token = auth_header.split('Bearer ')[1]
-        
-        # 2. Get user from their session token
-        user_res = supabase.auth.get_user(access_token)
-        if not user_res.user:
-            return jsonify({"error": "Not authenticated"}), 401
-        
-        user_id = user_res.user.id
-        print(f"🔍 Accessing file for user_id: {user_id}")
-        
-        # 3. Get password from request body
-        data = request.get_json()
+        user_id = g.user_id
+        data = request.get_json(silent=True) or {}
         password = data.get('password')
         if not password:
             return jsonify({"error": "Password is required"}), 400
 
-        # 4. Fetch the user's encrypted data from the 'user_data' table
-        # This assumes you have one row of data per user.
-        db_res = supabase_admin.table("user_data").select("data_content", "salt").eq("user_id", user_id).limit(1).execute()
-
+        db_res = get_supabase_admin().table("user_data") \
+                    .select("data_id, data_type, data_content, salt, data_blob, storage_format, content_size, updated_at") \
+                    .eq("data_id", data_id) \
+                    .eq("user_id", user_id) \
+                    .limit(1) \
+                    .execute()
         if not db_res.data:
-            print(f"⚠️ No user_data found for user_id: {user_id}. Creating initial data...")
-            # Check if user exists in profiles table
-            profile_check = supabase_admin.table("profiles").select("username, email").eq("user_id", user_id).limit(1).execute()
-            if not profile_check.data:
-                print(f"❌ User profile also not found for user_id: {user_id}")
-                return jsonify({"error": "User profile not found"}), 404
-            
-            # User exists but no data file - create initial data
-            username = profile_check.data[0].get('username', 'User')
-            try:
-                initial_data = f"User {username}'s secure file, created on {datetime.now().isoformat()}"
-                
-                # Encrypt it using the user's password
-                encrypted_content_bytes, salt_bytes = encrypt_data(initial_data, password)
-                
-                # Encode to base64 text for database storage
-                encrypted_content_text = base64.b64encode(encrypted_content_bytes).decode('utf-8')
-                salt_text = base64.b64encode(salt_bytes).decode('utf-8')
-
-                # Insert the encrypted data and the salt into user_data
-                user_data_payload = {
-                    "user_id": user_id,
-                    "data_type": "profile_info",
-                    "data_content": encrypted_content_text,
-                    "salt": salt_text,
-                    "encrypted": True
-                }
-                supabase_admin.table("user_data").insert(user_data_payload).execute()
-                print(f"✅ Initial user data (encrypted) created for user_id: {user_id}")
-                
-                # Now fetch the newly created data
-                db_res = supabase_admin.table("user_data").select("data_content", "salt").eq("user_id", user_id).limit(1).execute()
-                if not db_res.data:
-                    return jsonify({"error": "Failed to create initial data file"}), 500
-            except Exception as create_err:
-                print(f"❌ Error creating initial user_data: {create_err}")
-                return jsonify({"error": "Failed to create initial data file. Please try again."}), 500
-
-        # 5. Decode the data from the database
-        encrypted_data = base64.b64decode(db_res.data[0]['data_content'])
-        salt = base64.b64decode(db_res.data[0]['salt'])
-
-        # 6. Decrypt the data using the provided password
-        decrypted_content = decrypt_data(encrypted_data, password, salt)
-
-        if decrypted_content is None:
+            return jsonify({"error": "File not found"}), 404
+        record = db_res.data[0]
+        headers = {"X-Data-Type": record.get("data_type") or ""}
+
+        if record.get("storage_format") in TOKEN_FORMATS:
+            # Single-token rows are small; decrypt them in one piece
+            decrypted_content = decrypt_for_user(user_id, password, [record])[0]
+            if decrypted_content is None:
+                return jsonify({"error": "Decryption failed. Invalid password."}), 403
+            return Response(decrypted_content.encode(), mimetype='application/octet-stream', headers=headers)
+
+        # The header says whether the file is keyed by the password or by the user's data key
+        segments = read_stream(data_id)
+        first_segment = next(segments, b"")
+        try:
+            data_key = None
+            if read_header(first_segment)["kdf_id"] == KDF_DATA_KEY:
+                data_key = unlock_data_key(user_id, password)
+            plaintext = decrypt_stream(itertools.chain([first_segment], segments), password, data_key=data_key)
+            # Decrypt the first chunk before answering so a wrong password is still a 403
+            first = next(plaintext)
+        except DataKeyRewrapRequired as stale:
+            return responses.rewrap_required(stale)
+        except (StreamFormatError, WrongPasswordError) as e:
+            log.info("decrypt_failed", user_id=user_id, data_id=data_id, reason=str(e))
+            DECRYPT_FAILURES.inc(format=CHUNKED_FORMAT)
             return jsonify({"error": "Decryption failed. Invalid password."}), 403
 
-        # 7. Success! Send the decrypted data back
-        return jsonify({
-            "success": True,
-            "decrypted_data": decrypted_content
-        }), 200
+        if record.get("content_size") is not None:
+            headers["Content-Length"] = str(record["content_size"])
+        return Response(itertools.chain([first], plaintext), mimetype='application/octet-stream', headers=headers)
 
-    except Exception as e:
-        print(f"🔥 FATAL data access error: {e}")
-        return jsonify({"error": "An internal server error occurred"}), 500
\ No newline at end of file
+    except DataKeyRewrapRequired as stale:
+        return responses.rewrap_required(stale)
+
+    except KDFBusyError as busy:
+        log.warning("kdf_busy", user_id=g.user_id, data_id=data_id)
+        return responses.busy(busy.retry_after)
+
+    except httpx.TransportError as e:
+        log.warning("database_unavailable", user_id=g.user_id, data_id=data_id, error=str(e))
+        return responses.unavailable(e)
+
+    except Exception:
+        log.exception("file_download_error", user_id=g.user_id, data_id=data_id)
+        return jsonify({"error": "An internal server error occurred"}), 500
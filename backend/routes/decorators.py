@@ -0,0 +1,36 @@
+from flask import request, jsonify, g
+from functools import wraps
+from security_logic.token_verifier import token_verifier, TokenError
+from observability.log import get_logger
+
+log = get_logger(__name__)
+
+
+def require_auth(view):
+    """
+    Requires a valid Supabase access token in the Authorization header.
+    On success the view can read g.user_id, g.access_token and g.token_claims.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'error': 'Missing or invalid authorization token'}), 401
+
+        access_token = auth_header.split('Bearer ')[1]
+        try:
+            verified = token_verifier.verify(access_token)
+        except TokenError as e:
+            log.info("token_rejected", reason=str(e))
+            return jsonify({'error': 'Invalid or expired token'}), 401
+        except Exception:
+            # Local verification was inconclusive and the auth server could not be reached
+            log.exception("token_verification_error")
+            return jsonify({'error': 'Authentication service unavailable'}), 503
+
+        g.user_id = verified.user_id
+        g.access_token = access_token
+        g.token_claims = verified.claims
+        return view(*args, **kwargs)
+
+    return wrapper
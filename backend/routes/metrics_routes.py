@@ -0,0 +1,93 @@
+from flask import Blueprint, Response, request, g, jsonify
+from observability.metrics import registry, HTTP_REQUEST_SECONDS, METRICS_ENABLED
+from security_logic.audit_logger import audit_logger
+from security_logic.kdf_executor import kdf_executor
+from security_logic.key_cache import key_cache
+from security_logic.profile_cache import profile_cache
+from security_logic.rate_limiter import rate_limiter
+from jobs.job_queue import job_queue
+from security_logic.token_verifier import token_verifier
+import hmac
+import os
+import time
+
+# When set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>".
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+metrics_api = Blueprint('metrics_api', __name__)
+
+
+def _collect_runtime_gauges():
+    """Point-in-time state of the in-process queues and caches."""
+    kdf = kdf_executor.stats()
+    audit = audit_logger.stats()
+    cache = key_cache.stats()
+    profiles = profile_cache.stats()
+    limiter = rate_limiter.stats()
+    jobs = job_queue.stats()
+    return [
+        ("kdf_queue_depth", "Key derivations running or waiting.", None, kdf["queue_depth"]),
+        ("kdf_queue_limit", "Key derivations allowed at once.", None, kdf["queue_limit"]),
+        ("kdf_workers", "KDF worker processes (0 = inline).", None, kdf["workers"]),
+        ("audit_queue_depth", "login_attempts rows waiting to be written.", None, audit["queued"]),
+        ("audit_rows", "login_attempts rows handled by the write-behind logger since start.",
+         {"state": "written"}, audit["written"]),
+        ("audit_rows", "login_attempts rows handled by the write-behind logger since start.",
+         {"state": "spilled"}, audit["spilled"]),
+        ("audit_rows", "login_attempts rows handled by the write-behind logger since start.",
+         {"state": "replayed"}, audit["replayed"]),
+        ("key_cache_entries", "Derived keys currently cached.", None, cache["size"]),
+        ("key_cache_lookups", "Derived-key cache lookups since start.", {"result": "hit"}, cache["hits"]),
+        ("key_cache_lookups", "Derived-key cache lookups since start.", {"result": "miss"}, cache["misses"]),
+        ("token_verifications", "Access tokens verified since start.",
+         {"where": "local"}, token_verifier.local_verifications),
+        ("token_verifications", "Access tokens verified since start.",
+         {"where": "remote"}, token_verifier.remote_verifications),
+        ("profile_cache_entries", "Entries in the profile lookup cache.", {"kind": "email"}, profiles["emails"]),
+        ("profile_cache_entries", "Entries in the profile lookup cache.", {"kind": "profile"}, profiles["profiles"]),
+        ("profile_cache_entries", "Entries in the profile lookup cache.", {"kind": "negative"}, profiles["negatives"]),
+        ("profile_bloom_items", "Emails in the profile Bloom filter.", None, profiles["bloom_items"] or 0),
+        ("profile_bloom_bytes", "Size of the profile Bloom filter.", None, profiles["bloom_bytes"]),
+        ("rate_limit_buckets", "Token buckets held by the auth rate limiter.", None, limiter["buckets"]),
+        ("jobs", "Background jobs in the local queue by status.", {"status": "pending"}, jobs["pending"]),
+        ("jobs", "Background jobs in the local queue by status.", {"status": "running"}, jobs["running"]),
+        ("jobs", "Background jobs in the local queue by status.", {"status": "failed"}, jobs["failed"]),
+    ]
+
+registry.register_collector(_collect_runtime_gauges)
+
+
+def instrument_app(app):
+    """Times every request into http_request_duration_seconds."""
+    if not METRICS_ENABLED:
+        return
+
+    @app.before_request
+    def _start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.get('request_started')
+        if started is not None:
+            # The URL rule (e.g. /api/files/<int:data_id>/download) keeps label cardinality bounded
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                         method=request.method, route=route, status=response.status_code)
+        return response
+
+
+@metrics_api.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of this process's metrics."""
+    if METRICS_TOKEN:
+        auth_header = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(auth_header, f"Bearer {METRICS_TOKEN}"):
+            return jsonify({'error': 'Unauthorized'}), 401
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@metrics_api.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness check for load balancers. Touches nothing outside this process."""
+    return jsonify({'status': 'ok', 'pid': os.getpid()}), 200
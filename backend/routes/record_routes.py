@@ -0,0 +1,280 @@
+from flask import Blueprint, request, jsonify, g
+from database.supabase_client import get_supabase_admin
+from security_logic.user_keys import (
+    encrypt_for_user,
+    decrypt_for_user,
+    WrongPasswordError,
+    DataKeyRewrapRequired,
+    DataKeyNotReady,
+)
+from security_logic.record_format import TOKEN_FORMATS
+from security_logic.kdf_executor import KDFBusyError
+from routes.decorators import require_auth
+from routes import responses
+from jobs.signup_jobs import ensure_initial_data
+from observability.log import get_logger
+from datetime import datetime, timezone
+import httpx
+import os
+
+# Most records read or written by one request
+RECORDS_MAX_BATCH = int(os.getenv("RECORDS_MAX_BATCH", "100"))
+RECORDS_PAGE_SIZE = 50
+
+log = get_logger(__name__)
+
+_METADATA_COLUMNS = "data_id, data_type, storage_format, encrypted, content_size, created_at, updated_at"
+
+record_api = Blueprint('record_api', __name__)
+
+
+def _metadata(row):
+    return {
+        "data_id": row["data_id"],
+        "data_type": row.get("data_type"),
+        "storage_format": row.get("storage_format"),
+        "encrypted": row.get("encrypted"),
+        "size": row.get("content_size"),
+        "created_at": row.get("created_at"),
+        "updated_at": row.get("updated_at"),
+    }
+
+
+@record_api.route('/api/records', methods=['GET'])
+@require_auth
+def list_records():
+    """
+    Lists the user's records, metadata only (no ciphertext is read).
+    Query: ?limit=<n>&cursor=<data_id from next_cursor>&type=<data_type>
+    """
+    try:
+        try:
+            limit = min(max(int(request.args.get('limit', RECORDS_PAGE_SIZE)), 1), RECORDS_MAX_BATCH)
+            cursor = request.args.get('cursor', type=int)
+        except ValueError:
+            return jsonify({"error": "limit must be a number"}), 400
+
+        query = get_supabase_admin().table("user_data") \
+                    .select(_METADATA_COLUMNS) \
+                    .eq("user_id", g.user_id)
+        if request.args.get('type'):
+            query = query.eq("data_type", request.args['type'])
+        if cursor is not None:
+            query = query.gt("data_id", cursor)
+        # One extra row tells us whether there is a next page
+        rows = query.order("data_id").limit(limit + 1).execute().data
+
+        page = rows[:limit]
+        return jsonify({
+            "records": [_metadata(row) for row in page],
+            "next_cursor": page[-1]["data_id"] if len(rows) > limit else None,
+        }), 200
+
+    except httpx.TransportError as e:
+        log.warning("database_unavailable", user_id=g.user_id, error=str(e))
+        return responses.unavailable(e)
+
+    except Exception:
+        log.exception("record_list_error", user_id=g.user_id)
+        return jsonify({"error": "An internal server error occurred"}), 500
+
+
+@record_api.route('/api/records/fetch', methods=['POST'])
+@require_auth
+def fetch_records():
+    """
+    Fetches and decrypts several records in one request.
+    Body: {"password": "...", "ids": [data_id, ...]}. One PBKDF2 run unlocks the
+    user's data key for all of them; older per-row-salt records cost one per distinct salt.
+    """
+    try:
+        user_id = g.user_id
+        data = request.get_json(silent=True) or {}
+        password = data.get('password')
+        ids = data.get('ids')
+        if not password:
+            return jsonify({"error": "Password is required"}), 400
+        if not isinstance(ids, list) or not ids or \
+                not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            return jsonify({"error": "ids must be a non-empty list of record ids"}), 400
+        if len(ids) > RECORDS_MAX_BATCH:
+            return jsonify({"error": f"At most {RECORDS_MAX_BATCH} records per request"}), 400
+
+        rows = get_supabase_admin().table("user_data") \
+                    .select("data_id, data_type, data_content, salt, data_blob, storage_format, updated_at") \
+                    .eq("user_id", user_id) \
+                    .in_("data_id", sorted(set(ids))) \
+                    .execute().data
+        by_id = {row["data_id"]: row for row in rows}
+
+        token_rows = [row for row in rows if row.get("storage_format") in TOKEN_FORMATS]
+        plaintexts = decrypt_for_user(user_id, password, token_rows)
+        decrypted = {row["data_id"]: text for row, text in zip(token_rows, plaintexts)}
+
+        results = []
+        for data_id in ids:
+            row = by_id.get(data_id)
+            if row is None:
+                results.append({"data_id": data_id, "error": "not_found"})
+            elif data_id not in decrypted:
+                # Streamed files are too large for a JSON batch
+                results.append({"data_id": data_id, "error": "use_download",
+                                "download_url": f"/api/files/{data_id}/download"})
+            elif decrypted[data_id] is None:
+                results.append({"data_id": data_id, "error": "decryption_failed"})
+            else:
+                results.append({"data_id": data_id, "data_type": row.get("data_type"), "data": decrypted[data_id]})
+
+        if decrypted and all(text is None for text in decrypted.values()):
+            return jsonify({"error": "Decryption failed. Invalid password.", "records": results}), 403
+        return jsonify({"success": True, "records": results}), 200
+
+    except DataKeyRewrapRequired as stale:
+        return responses.rewrap_required(stale)
+
+    except KDFBusyError as busy:
+        log.warning("kdf_busy", user_id=g.user_id)
+        return responses.busy(busy.retry_after)
+
+    except httpx.TransportError as e:
+        log.warning("database_unavailable", user_id=g.user_id, error=str(e))
+        return responses.unavailable(e)
+
+    except Exception:
+        log.exception("record_fetch_error", user_id=g.user_id)
+        return jsonify({"error": "An internal server error occurred"}), 500
+
+
+@record_api.route('/api/records', methods=['POST'])
+@require_auth
+def create_records():
+    """
+    Encrypts and stores one or more records.
+    Body: {"password": "...", "records": [{"data_type": "...", "data": "..."}, ...]}
+    All records are encrypted with the user's data key (one key derivation) and written
+    with a single insert whose response already carries the new data_ids.
+    """
+    try:
+        user_id = g.user_id
+        data = request.get_json(silent=True) or {}
+        password = data.get('password')
+        records = data.get('records')
+        if not password:
+            return jsonify({"error": "Password is required"}), 400
+        if not isinstance(records, list) or not records:
+            return jsonify({"error": "records must be a non-empty list"}), 400
+        if len(records) > RECORDS_MAX_BATCH:
+            return jsonify({"error": f"At most {RECORDS_MAX_BATCH} records per request"}), 400
+        if not all(isinstance(r, dict) and isinstance(r.get('data'), str) for r in records):
+            return jsonify({"error": "Every record needs a 'data' string"}), 400
+
+        items = [r['data'] for r in records]
+        try:
+            columns = encrypt_for_user(user_id, password, items)
+        except DataKeyNotReady:
+            # The initial-data job makes the key: run it (or wait for it), then try again
+            ensure_initial_data(user_id)
+            columns = encrypt_for_user(user_id, password, items)
+        rows = [{
+            "user_id": user_id,
+            "data_type": record.get('data_type') or 'record',
+            "encrypted": True,
+            "content_size": len(record['data'].encode()),
+            **record_columns,
+        } for record, record_columns in zip(records, columns)]
+
+        inserted = get_supabase_admin().table("user_data").insert(rows).execute().data
+        log.info("records_created", user_id=user_id, count=len(inserted))
+        return jsonify({"success": True, "records": [_metadata(row) for row in inserted]}), 201
+
+    except DataKeyRewrapRequired as stale:
+        return responses.rewrap_required(stale)
+
+    except DataKeyNotReady as pending:
+        return responses.setup_pending(pending)
+
+    except WrongPasswordError:
+        return jsonify({"error": "Invalid password."}), 403
+
+    except KDFBusyError as busy:
+        log.warning("kdf_busy", user_id=g.user_id)
+        return responses.busy(busy.retry_after)
+
+    except httpx.TransportError as e:
+        log.warning("database_unavailable", user_id=g.user_id, error=str(e))
+        return responses.unavailable(e)
+
+    except Exception:
+        log.exception("record_create_error", user_id=g.user_id)
+        return jsonify({"error": "An internal server error occurred"}), 500
+
+
+@record_api.route('/api/records/<int:data_id>', methods=['PUT'])
+@require_auth
+def update_record(data_id):
+    """
+    Replaces a record's content (re-encrypted with the user's data key) and optionally its data_type.
+    Body: {"password": "...", "data": "...", "data_type": "..."}. Streamed files cannot be updated here.
+    """
+    try:
+        user_id = g.user_id
+        data = request.get_json(silent=True) or {}
+        password = data.get('password')
+        content = data.get('data')
+        if not password:
+            return jsonify({"error": "Password is required"}), 400
+        if not isinstance(content, str):
+            return jsonify({"error": "data must be a string"}), 400
+
+        # Checked before encrypting, so a missing or foreign record never costs a key derivation
+        existing = get_supabase_admin().table("user_data") \
+                    .select("storage_format") \
+                    .eq("data_id", data_id) \
+                    .eq("user_id", user_id) \
+                    .limit(1) \
+                    .execute().data
+        if not existing:
+            return jsonify({"error": "Record not found"}), 404
+        if existing[0].get("storage_format") not in TOKEN_FORMATS:
+            return jsonify({"error": "Streamed files cannot be updated here",
+                            "download_url": f"/api/files/{data_id}/download"}), 409
+
+        changes = {
+            "content_size": len(content.encode()),
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            **encrypt_for_user(user_id, password, [content])[0],
+        }
+        if data.get('data_type'):
+            changes["data_type"] = data['data_type']
+
+        # The update returns the changed row, so no follow-up SELECT is needed
+        updated = get_supabase_admin().table("user_data") \
+                    .update(changes) \
+                    .eq("data_id", data_id) \
+                    .eq("user_id", user_id) \
+                    .in_("storage_format", list(TOKEN_FORMATS)) \
+                    .execute().data
+        if not updated:
+            return jsonify({"error": "Record not found"}), 404
+        return jsonify({"success": True, "record": _metadata(updated[0])}), 200
+
+    except DataKeyRewrapRequired as stale:
+        return responses.rewrap_required(stale)
+
+    except DataKeyNotReady as pending:
+        return responses.setup_pending(pending)
+
+    except WrongPasswordError:
+        return jsonify({"error": "Invalid password."}), 403
+
+    except KDFBusyError as busy:
+        log.warning("kdf_busy", user_id=g.user_id)
+        return responses.busy(busy.retry_after)
+
+    except httpx.TransportError as e:
+        log.warning("database_unavailable", user_id=g.user_id, error=str(e))
+        return responses.unavailable(e)
+
+    except Exception:
+        log.exception("record_update_error", user_id=g.user_id)
+        return jsonify({"error": "An internal server error occurred"}), 500
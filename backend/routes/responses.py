@@ -0,0 +1,27 @@
+"""
+Error answers shared by the blueprints and the async handlers.
+
+They return plain (payload, status, headers) tuples: Flask views can return
+them as they are (a dict payload is sent as JSON), and so can the handlers
+in async_handlers.py.
+"""
+from database.resilience import retry_after_hint
+from security_logic.kdf_executor import KDF_RETRY_AFTER_SECONDS
+
+
+def busy(retry_after=KDF_RETRY_AFTER_SECONDS):
+    """503 while the KDF pool is saturated (KDFBusyError.retry_after)."""
+    return {"error": "Server is busy. Please try again shortly."}, 503, {"Retry-After": str(retry_after)}
+
+def unavailable(error):
+    """503 for a Supabase call that failed to connect, timed out or was refused by its circuit breaker."""
+    return {"error": "Service temporarily unavailable. Please try again shortly."}, 503, \
+        {"Retry-After": str(retry_after_hint(error))}
+
+def rewrap_required(error):
+    """409 for a data key still wrapped under the password the user had before a reset."""
+    return {"error": str(error), "rewrap_url": "/api/rewrap-data-key"}, 409, {}
+
+def setup_pending(error):
+    """409 for a user whose data key does not exist yet (user_keys.DataKeyNotReady)."""
+    return {"error": str(error)}, 409, {}
@@ -0,0 +1,99 @@
+from flask import Blueprint, request, send_file, render_template, abort
+from werkzeug.security import safe_join
+from observability.log import get_logger
+import json
+import mimetypes
+import os
+
+# Output of `python -m tools.build_static`; when it is missing, pages are rendered from the templates
+STATIC_DIST_PATH = os.getenv(
+    "STATIC_DIST_PATH",
+    os.path.join(os.path.dirname(__file__), '..', '..', 'frontend', 'dist')
+)
+STATIC_BUILD_ENABLED = os.getenv("STATIC_BUILD_ENABLED", "true").lower() in ("1", "true", "yes")
+# Fingerprinted files never change, so clients may keep them for a year without asking again
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+log = get_logger(__name__)
+
+static_api = Blueprint('static_api', __name__)
+
+
+def _load_manifest():
+    if not STATIC_BUILD_ENABLED:
+        return None
+    try:
+        with open(os.path.join(STATIC_DIST_PATH, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    log.info("frontend_manifest_loaded", pages=len(manifest['pages']), assets=len(manifest['assets']))
+    return manifest
+
+_manifest = _load_manifest()
+
+
+def _pick_encoding(available):
+    """Best encoding of the file that the client accepts (brotli over gzip), or None for identity."""
+    for encoding in ("br", "gzip"):
+        if encoding in available and request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def _send_built(rel_path, immutable):
+    """
+    Sends a file from the build with a strong ETag (one per encoding), answering
+    304 when the client's copy is current. Precompressed variants are sent as is.
+    """
+    entry = _manifest["files"].get(rel_path)
+    path = safe_join(STATIC_DIST_PATH, rel_path)
+    if entry is None or path is None:
+        abort(404)
+
+    encoding = _pick_encoding(entry["encodings"])
+    etag = entry["etag"] if encoding is None else f"{entry['etag']}-{encoding}"
+    # The mimetype comes from the original name, not the .br/.gz variant
+    response = send_file(
+        os.path.abspath(path + _SUFFIXES[encoding] if encoding else path),
+        mimetype=None if encoding is None else _mimetype(rel_path),
+        etag=etag,
+        conditional=True,
+        last_modified=None,
+    )
+    # Not a download: drop the filename send_file derives from the (possibly .gz) path
+    response.headers.pop("Content-Disposition", None)
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    if entry["encodings"]:
+        response.vary.add("Accept-Encoding")
+    if immutable:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = ASSET_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # Pages keep their URL across builds: always revalidate (a 304 costs no body)
+        response.cache_control.no_cache = True
+    return response
+
+
+def _mimetype(rel_path):
+    return mimetypes.guess_type(rel_path)[0] or 'application/octet-stream'
+
+
+def serve_page(template_name):
+    """A page route's response: the pre-rendered page if there is a build, else the rendered template."""
+    if _manifest is not None and template_name in _manifest["pages"]:
+        return _send_built(_manifest["pages"][template_name], immutable=False)
+    return render_template(template_name)
+
+
+@static_api.route('/assets/<path:filename>', methods=['GET'])
+def serve_asset(filename):
+    """Fingerprinted assets from the build, cached by clients for good."""
+    if _manifest is None:
+        abort(404)
+    return _send_built(f"assets/{filename}", immutable=True)
@@ -0,0 +1,329 @@
+from database.supabase_client import get_supabase_admin
+from security_logic.rate_limiter import subnet_of
+from observability.metrics import registry
+from observability.log import get_logger
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from array import array
+import hashlib
+import math
+import os
+import threading
+import time
+
+ATTACK_DETECTOR_ENABLED = os.getenv("ATTACK_DETECTOR_ENABLED", "true").lower() in ("1", "true", "yes")
+# What the login endpoint does for a flagged client or account: "block" (429) or "log"
+ATTACK_DETECTOR_ACTION = os.getenv("ATTACK_DETECTOR_ACTION", "block").lower()
+# Failed logins are counted over this sliding window, kept as ATTACK_WINDOW_SLICES slices
+ATTACK_WINDOW_SECONDS = int(os.getenv("ATTACK_WINDOW_SECONDS", "600"))
+ATTACK_WINDOW_SLICES = int(os.getenv("ATTACK_WINDOW_SLICES", "10"))
+# Count-min sketch size per slice and key type: memory is 3 * slices * depth * width * 4 bytes
+ATTACK_SKETCH_WIDTH = int(os.getenv("ATTACK_SKETCH_WIDTH", "2048"))
+ATTACK_SKETCH_DEPTH = int(os.getenv("ATTACK_SKETCH_DEPTH", "4"))
+ATTACK_TOP_K = int(os.getenv("ATTACK_TOP_K", "20"))
+# Failures within the window that flag a key (0 = never flag on this key type)
+ATTACK_THRESHOLDS = {
+    "ip": int(os.getenv("ATTACK_THRESHOLD_IP", "100")),
+    "subnet": int(os.getenv("ATTACK_THRESHOLD_SUBNET", "300")),
+    "username": int(os.getenv("ATTACK_THRESHOLD_USERNAME", "30")),
+}
+# Seed a new process with the failures of the last window from login_attempts
+ATTACK_DETECTOR_REPLAY = os.getenv("ATTACK_DETECTOR_REPLAY", "true").lower() in ("1", "true", "yes")
+ATTACK_REPLAY_PAGE_SIZE = 1000
+
+DIMENSIONS = ("ip", "subnet", "username")
+
+log = get_logger(__name__)
+
+ATTACK_FLAGS = registry.counter(
+    "attack_flags_raised_total", "Keys whose failed logins crossed the attack detector's threshold.", ("dimension",))
+ATTACK_BLOCKED = registry.counter(
+    "attack_blocked_total", "Logins refused because the attack detector flagged the client or account.",
+    ("dimension",))
+
+# A key whose failures in the window reached its threshold
+Flag = namedtuple("Flag", "dimension key count threshold")
+
+
+def flag_log_fields(flag):
+    """A flag's log fields. A username key is an email address and is logged like one."""
+    return {"dimension": flag.dimension, "key": flag.key, "failures": flag.count,
+            "email_fields": ("key",) if flag.dimension == "username" else ()}
+
+
+def _positions(key, width, depth):
+    """`depth` counter positions for key (double hashing on one BLAKE2b digest)."""
+    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % width for i in range(depth)]
+
+
+class CountMinSketch:
+    """`depth` rows of `width` counters. Estimates may overcount through hash collisions, never undercount."""
+
+    def __init__(self, width, depth):
+        self.width = width
+        self.depth = depth
+        self.clear()
+
+    def add(self, positions, count=1):
+        # Conservative update: only counters below the new estimate are raised, which limits overcounting
+        target = self.estimate(positions) + count
+        for row, pos in zip(self._rows, positions):
+            if row[pos] < target:
+                row[pos] = target
+
+    def estimate(self, positions):
+        return min(row[pos] for row, pos in zip(self._rows, positions))
+
+    def clear(self):
+        self._rows = [array("I", bytes(4 * self.width)) for _ in range(self.depth)]
+
+
+class _WindowedSketch:
+    """
+    One sketch per time slice of the window. A slice is cleared and reused
+    once it has fallen out of the window, so counts expire a slice at a time.
+    """
+
+    def __init__(self, window_seconds, slices, width, depth):
+        self.slice_seconds = window_seconds / slices
+        self._sketches = [CountMinSketch(width, depth) for _ in range(slices)]
+        self._slice_ids = [None] * slices
+
+    def add(self, positions, when):
+        slice_id = int(when // self.slice_seconds)
+        index = slice_id % len(self._sketches)
+        held = self._slice_ids[index]
+        if held != slice_id:
+            if held is not None and held > slice_id:
+                return  # older than the window
+            self._sketches[index].clear()
+            self._slice_ids[index] = slice_id
+        self._sketches[index].add(positions)
+
+    def estimate(self, positions, now):
+        newest = int(now // self.slice_seconds)
+        oldest = newest - len(self._sketches) + 1
+        return sum(sketch.estimate(positions) for sketch, slice_id in zip(self._sketches, self._slice_ids)
+                   if slice_id is not None and oldest <= slice_id <= newest)
+
+
+class AttackDetector:
+    """
+    Approximate counts of failed logins per client IP, per subnet and per email
+    attempted, over a sliding window, in fixed memory.
+
+    Per-account lockouts never see a spray of one or two guesses against
+    thousands of accounts from a few addresses; the IP and subnet counts do.
+    The email counts cover one account (or unknown address) tried from many
+    addresses. Besides the sketches, each key type keeps a bounded set of
+    heavy-hitter candidates, re-estimated on read, for the top offenders.
+
+    Counts are per process, like the rate limiter's.
+    """
+
+    def __init__(self, window_seconds=ATTACK_WINDOW_SECONDS, slices=ATTACK_WINDOW_SLICES,
+                 width=ATTACK_SKETCH_WIDTH, depth=ATTACK_SKETCH_DEPTH, top_k=ATTACK_TOP_K, thresholds=None):
+        self.window_seconds = window_seconds
+        self.slices = slices
+        self.width = width
+        self.depth = depth
+        self.top_k = top_k
+        self.thresholds = dict(ATTACK_THRESHOLDS if thresholds is None else thresholds)
+        self.slice_seconds = window_seconds / slices
+        self.observed = 0
+        self.replayed = 0
+        self._replay_started = False
+        self._lock = threading.Lock()
+        self.clear()
+
+    def _keys(self, ip, email):
+        keys = {"ip": ip or None, "subnet": subnet_of(ip) if ip else None,
+                "username": email.strip().lower() if email else None}
+        return [(dimension, key) for dimension, key in keys.items() if key]
+
+    def _remember(self, dimension, key, count):
+        """Keeps key among the heavy-hitter candidates if it is one of the largest seen."""
+        candidates = self._candidates[dimension]
+        if key in candidates or len(candidates) < self.top_k * 4:
+            candidates[key] = count
+            return
+        smallest = min(candidates, key=candidates.get)
+        if count > candidates[smallest]:
+            del candidates[smallest]
+            candidates[key] = count
+
+    def _newly_raised(self, dimension, key, when):
+        """
+        False if the key was already flagged within the window: its count only
+        dipped as a slice expired, it is the same attack.
+        """
+        last = self._raised.get((dimension, key))
+        if last is not None and when - last < self.window_seconds:
+            return False
+        if len(self._raised) >= self.top_k * 16:
+            self._raised = {k: t for k, t in self._raised.items() if when - t < self.window_seconds}
+        self._raised[(dimension, key)] = when
+        return True
+
+    def observe(self, ip, email, when=None):
+        """Counts one failed login. Returns the Flags it newly raised."""
+        if not ATTACK_DETECTOR_ENABLED:
+            return []
+        when = time.time() if when is None else when
+        raised = []
+        with self._lock:
+            self.observed += 1
+            for dimension, key in self._keys(ip, email):
+                positions = _positions(key, self.width, self.depth)
+                sketch = self._sketches[dimension]
+                before = sketch.estimate(positions, when)
+                sketch.add(positions, when)
+                count = sketch.estimate(positions, when)
+                self._remember(dimension, key, count)
+                threshold = self.thresholds.get(dimension)
+                if threshold and before < threshold <= count and self._newly_raised(dimension, key, when):
+                    raised.append(Flag(dimension, key, count, threshold))
+        for flag in raised:
+            ATTACK_FLAGS.inc(dimension=flag.dimension)
+            log.warning("attack_suspected", **flag_log_fields(flag), window_seconds=self.window_seconds)
+        return raised
+
+    def check(self, ip, email, now=None):
+        """The first Flag for this client or account if any of its counts is at the threshold, else None."""
+        if not ATTACK_DETECTOR_ENABLED:
+            return None
+        self._ensure_replayed()
+        now = time.time() if now is None else now
+        with self._lock:
+            for dimension, key in self._keys(ip, email):
+                threshold = self.thresholds.get(dimension)
+                if not threshold:
+                    continue
+                count = self._sketches[dimension].estimate(_positions(key, self.width, self.depth), now)
+                if count >= threshold:
+                    return Flag(dimension, key, count, threshold)
+        return None
+
+    def screen(self, ip, email):
+        """check() plus ATTACK_DETECTOR_ACTION: the Flag when the login should be refused, else None."""
+        flag = self.check(ip, email)
+        if flag is None:
+            return None
+        if ATTACK_DETECTOR_ACTION != "block":
+            log.info("login_flagged", email=email, ip=ip, **flag_log_fields(flag))
+            return None
+        ATTACK_BLOCKED.inc(dimension=flag.dimension)
+        return flag
+
+    def retry_after(self):
+        """Seconds until the oldest slice of the window expires."""
+        return max(1, math.ceil(self.slice_seconds))
+
+    def top(self, limit=None, now=None):
+        """{dimension: [(key, failures)]}, largest first, re-estimated for the current window."""
+        now = time.time() if now is None else now
+        limit = limit or self.top_k
+        result = {}
+        with self._lock:
+            for dimension in DIMENSIONS:
+                sketch = self._sketches[dimension]
+                candidates = self._candidates[dimension]
+                for key in list(candidates):
+                    count = sketch.estimate(_positions(key, self.width, self.depth), now)
+                    if count:
+                        candidates[key] = count
+                    else:
+                        del candidates[key]
+                result[dimension] = sorted(candidates.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return result
+
+    def flagged(self, now=None):
+        """Flags for the top offenders that are at their threshold right now."""
+        return [Flag(dimension, key, count, self.thresholds[dimension])
+                for dimension, entries in self.top(now=now).items()
+                for key, count in entries
+                if self.thresholds.get(dimension) and count >= self.thresholds[dimension]]
+
+    # --- Replay ---
+    def replay(self, rows):
+        """
+        Feeds historical login_attempts rows (oldest first) through the detector
+        at their own timestamps. Returns the Flags raised on the way.
+        """
+        raised = []
+        for row in rows:
+            if row.get("success"):
+                continue
+            when = datetime.fromisoformat(row["timestamp"].replace('Z', '+00:00')).timestamp()
+            raised.extend(self.observe(row.get("ip_address"), row.get("username_attempted"), when))
+            self.replayed += 1
+        return raised
+
+    def _ensure_replayed(self):
+        if not ATTACK_DETECTOR_REPLAY or self._replay_started:
+            return
+        with self._lock:
+            if self._replay_started:
+                return
+            self._replay_started = True
+        # Started on first use, so a preloading server never forks with this thread running
+        threading.Thread(target=self.load_recent, name="attack-replay", daemon=True).start()
+
+    def load_recent(self):
+        """Replays the failures of the last window from login_attempts (those logged before now only)."""
+        until = datetime.now(timezone.utc)
+        try:
+            self.replay(iter_failed_attempts(until - timedelta(seconds=self.window_seconds), until))
+            log.info("attack_detector_seeded", failures=self.replayed, window_seconds=self.window_seconds)
+        except Exception as e:
+            log.warning("attack_detector_seed_error", error=str(e))
+
+    def clear(self):
+        with self._lock:
+            self._sketches = {d: _WindowedSketch(self.window_seconds, self.slices, self.width, self.depth)
+                              for d in DIMENSIONS}
+            self._candidates = {d: {} for d in DIMENSIONS}  # key -> estimate when last seen
+            self._raised = {}  # (dimension, key) -> when it was last flagged
+
+    def stats(self):
+        return {
+            "enabled": ATTACK_DETECTOR_ENABLED,
+            "observed": self.observed,
+            "replayed": self.replayed,
+            "sketch_bytes": len(DIMENSIONS) * self.slices * self.depth * self.width * 4,
+            "flagged": len(self.flagged()),
+        }
+
+
+def iter_failed_attempts(since, until=None, page_size=ATTACK_REPLAY_PAGE_SIZE):
+    """Failed login_attempts rows with since <= timestamp < until, read in keyset pages by attempt_id."""
+    last_id = None
+    while True:
+        query = get_supabase_admin().table("login_attempts") \
+                    .select("attempt_id, username_attempted, ip_address, timestamp") \
+                    .eq("success", False) \
+                    .gte("timestamp", since.isoformat())
+        if until is not None:
+            query = query.lt("timestamp", until.isoformat())
+        if last_id is not None:
+            query = query.gt("attempt_id", last_id)
+        rows = query.order("attempt_id").limit(page_size).execute().data
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]["attempt_id"]
+
+
+attack_detector = AttackDetector()
+
+def _collect_detector_gauges():
+    stats = attack_detector.stats()
+    return [
+        ("attack_detector_flagged", "Keys currently at the attack detector's threshold.", None, stats["flagged"]),
+        ("attack_detector_sketch_bytes", "Memory held by the attack detector's sketches.", None, stats["sketch_bytes"]),
+    ]
+
+registry.register_collector(_collect_detector_gauges)
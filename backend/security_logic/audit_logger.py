@@ -0,0 +1,312 @@
+from database.supabase_client import get_supabase_admin
+from observability.log import get_logger
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows, where only the single-process development server runs
+    fcntl = None
+
+# Write login_attempts rows from a background thread instead of the login request.
+AUDIT_WRITE_BEHIND = os.getenv("AUDIT_WRITE_BEHIND", "true").lower() in ("1", "true", "yes")
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_INTERVAL_SECONDS = float(os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", "1.0"))
+AUDIT_MAX_RETRIES = int(os.getenv("AUDIT_MAX_RETRIES", "3"))
+# Rows that cannot be written to Supabase are appended here (one JSON object per line)
+# and replayed once the database accepts writes again. Every worker of a host shares
+# it: they take turns through file locks next to it.
+AUDIT_SPILL_PATH = os.getenv(
+    "AUDIT_SPILL_PATH",
+    os.path.join(os.path.dirname(__file__), '..', 'audit_spill.jsonl')
+)
+
+
+log = get_logger(__name__)
+
+def _insert_rows(rows):
+    """Bulk-inserts login_attempts rows in a single request."""
+    get_supabase_admin().table("login_attempts").insert(rows, returning="minimal").execute()
+
+def _delete_failures(user_id):
+    get_supabase_admin().table("login_attempts") \
+                  .delete() \
+                  .eq("user_id", user_id) \
+                  .eq("success", False) \
+                  .execute()
+
+
+class AuditLogger:
+    """
+    Write-behind pipeline for login_attempts.
+
+    log() only appends to a bounded in-memory buffer. A background thread
+    flushes the buffer in batches once AUDIT_BATCH_SIZE rows are waiting or
+    AUDIT_FLUSH_INTERVAL_SECONDS has passed, retrying with backoff and spilling
+    to AUDIT_SPILL_PATH when Supabase is unavailable. Failed attempts that have
+    not been written yet are still visible through pending_failures(), so the
+    lockout count never misses them.
+    """
+
+    def __init__(self, insert_rows=_insert_rows, delete_failures=_delete_failures,
+                 max_queue=AUDIT_QUEUE_SIZE, batch_size=AUDIT_BATCH_SIZE,
+                 flush_interval=AUDIT_FLUSH_INTERVAL_SECONDS, max_retries=AUDIT_MAX_RETRIES,
+                 spill_path=AUDIT_SPILL_PATH):
+        self.insert_rows = insert_rows
+        self.delete_failures = delete_failures
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.spill_path = spill_path
+
+        self._buffer = deque()
+        self._in_flight = []
+        self._pending_failures = {}   # user_id -> {id(row): attempt time in epoch seconds}
+        self._cleared_in_flight = set()
+        self._cond = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+        self.written = 0
+        self.spilled = 0
+        self.replayed = 0
+
+    # --- producer side ---
+    def log(self, row):
+        """Queues a login_attempts row. Never blocks on the database."""
+        now = time.time()
+        row = dict(row)
+        row.setdefault("timestamp", datetime.fromtimestamp(now, timezone.utc).isoformat())
+
+        with self._cond:
+            if len(self._buffer) >= self.max_queue:
+                overflow = True
+            else:
+                overflow = False
+                self._buffer.append(row)
+                if not row.get("success") and row.get("user_id"):
+                    self._pending_failures.setdefault(row["user_id"], {})[id(row)] = now
+                if len(self._buffer) >= self.batch_size:
+                    self._cond.notify()
+        if overflow:
+            # Queue is full (database is far behind): keep the row on disk instead.
+            self._spill([row])
+        self._ensure_started()
+
+    def pending_failures(self, user_id, since):
+        """Number of queued, not yet written failures for user_id at or after `since` (epoch seconds)."""
+        with self._cond:
+            return sum(1 for ts in self._pending_failures.get(user_id, {}).values() if ts >= since)
+
+    def discard_failures(self, user_id):
+        """Drops queued failures for user_id (called when their failed attempts are cleared)."""
+        with self._cond:
+            if self._pending_failures.pop(user_id, None) is None:
+                return
+            self._buffer = deque(
+                row for row in self._buffer
+                if row.get("success") or row.get("user_id") != user_id
+            )
+            # A batch that is being written right now may still contain this user's
+            # failures; delete them again once that batch lands.
+            if any(row.get("user_id") == user_id and not row.get("success") for row in self._in_flight):
+                self._cleared_in_flight.add(user_id)
+
+    # --- flusher side ---
+    def _flusher_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _ensure_started(self):
+        # Also restarts a flusher that died (or did not survive a fork)
+        if not self._flusher_running():
+            with self._cond:
+                if not self._flusher_running() and not self._stopping:
+                    if self._thread is not None:
+                        log.error("audit_flusher_restarted", queued=len(self._buffer))
+                    self._thread = threading.Thread(target=self._run, name="audit-flusher", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._buffer and not self._stopping:
+                    self._cond.wait(self.flush_interval)
+                elif len(self._buffer) < self.batch_size and not self._stopping:
+                    self._cond.wait(self.flush_interval)
+                if self._stopping and not self._buffer:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                # e.g. an unreadable spill file: the rows already taken were written or spilled
+                log.exception("audit_flush_error")
+                time.sleep(self.flush_interval)
+
+    def flush(self):
+        """Writes everything currently buffered, one batch at a time."""
+        wrote_any = False
+        while True:
+            with self._cond:
+                if not self._buffer:
+                    break
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                self._in_flight = batch
+
+            written = self._write_with_retry(batch)
+
+            with self._cond:
+                self._in_flight = []
+                self._forget_pending(batch)
+                recheck = self._cleared_in_flight
+                self._cleared_in_flight = set()
+
+            if written:
+                wrote_any = True
+                for user_id in recheck:
+                    try:
+                        self.delete_failures(user_id)
+                    except Exception as e:
+                        log.warning("audit_reclear_error", user_id=user_id, error=str(e))
+            else:
+                self._spill([row for row in batch
+                             if row.get("success") or row.get("user_id") not in recheck])
+                return
+
+        # The database is accepting writes again: bring back anything spilled earlier
+        if wrote_any:
+            self._replay_spill()
+
+    def _write_with_retry(self, rows):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.insert_rows(rows)
+                self.written += len(rows)
+                return True
+            except Exception as e:
+                log.warning("audit_write_error", rows=len(rows), attempt=attempt + 1, error=str(e))
+                if attempt < self.max_retries and not self._stopping:
+                    time.sleep(min(0.5 * (2 ** attempt), 5.0))
+        return False
+
+    def _forget_pending(self, rows):
+        """Removes written (or spilled) failures from the pending index. Caller holds the lock."""
+        for row in rows:
+            user_id = row.get("user_id")
+            if row.get("success") or not user_id:
+                continue
+            times = self._pending_failures.get(user_id)
+            if times and times.pop(id(row), None) is not None and not times:
+                del self._pending_failures[user_id]
+
+    # --- spill file ---
+    @contextmanager
+    def _file_lock(self, path, blocking=True):
+        """
+        Exclusive lock on `path` across processes. Yields False instead of waiting
+        if blocking is False and someone else holds it.
+        """
+        if fcntl is None:
+            yield True
+            return
+        with open(path, 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _spill(self, rows):
+        if not rows:
+            return
+        with self._spill_lock:
+            try:
+                with self._file_lock(self.spill_path + ".lock"), open(self.spill_path, 'a', encoding='utf-8') as f:
+                    for row in rows:
+                        f.write(json.dumps(row) + "\n")
+                self.spilled += len(rows)
+                log.warning("audit_spilled", rows=len(rows), path=self.spill_path)
+            except OSError as e:
+                log.error("audit_spill_error", rows_lost=len(rows), path=self.spill_path, error=str(e))
+
+    def _replay_spill(self):
+        """Writes spilled rows back to Supabase after a successful flush."""
+        replay_path = self.spill_path + ".replay"
+        # One replay at a time on the host: the others leave it to whoever is at it
+        if not self._replay_lock.acquire(blocking=False):
+            return
+        try:
+            with self._file_lock(replay_path + ".lock", blocking=False) as replaying:
+                if replaying:
+                    self._replay(replay_path)
+        finally:
+            self._replay_lock.release()
+
+    def _replay(self, replay_path):
+        with self._spill_lock, self._file_lock(self.spill_path + ".lock"):
+            # A leftover replay file (e.g. after a crash) is finished before taking a new one
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, replay_path)
+
+        rows = []
+        with open(replay_path, encoding='utf-8', errors='replace') as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    # e.g. the last line of a process killed mid-write
+                    log.error("audit_spill_unreadable", path=replay_path, line=number)
+
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            if not self._write_with_retry(batch):
+                self._spill(rows[start:])
+                break
+            self.replayed += len(batch)
+        try:
+            os.remove(replay_path)
+        except FileNotFoundError:
+            pass
+
+    def drain(self, timeout=10.0):
+        """Stops the flusher and writes (or spills) everything still queued."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+        with self._cond:
+            leftover = list(self._buffer)
+            self._buffer.clear()
+        self._spill(leftover)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": len(self._buffer),
+                "in_flight": len(self._in_flight),
+                "written": self.written,
+                "spilled": self.spilled,
+                "replayed": self.replayed,
+            }
+
+
+audit_logger = AuditLogger()
@@ -0,0 +1,205 @@
+"""
+Versioned, chunked authenticated encryption for large payloads.
+
+Layout (all integers big-endian):
+
+    header  = magic "BSSC" | version u8 | kdf_id u8 | kdf_cost u32
+              | chunk_size u32 | salt (16) | nonce_prefix (7)
+    frame*  = length u32 | AES-256-GCM(ciphertext || tag)
+
+Each frame's 12-byte nonce is nonce_prefix | counter u32 | last u8, so frames
+cannot be reordered or dropped, and a stream that ends without a frame marked
+"last" is rejected as truncated. The header is bound to every frame as
+associated data. Plaintext is never held in memory beyond one chunk.
+
+kdf_id 1 derives the stream key from a password with PBKDF2 (kdf_cost is the
+iteration count); kdf_id 3 uses scrypt (kdf_cost = log2(n) u8 | r u16 | p u8);
+kdf_id 2 derives it from the user's data key (user_keys.py) as
+HMAC-SHA256(data_key, "BSSC file key" | salt), so no KDF runs per file.
+"""
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+from security_logic.data_encryptor import derive_raw_key
+from security_logic.kdf_params import KDFParams, KDFParamsError, CURRENT_KDF, SCRYPT
+import hashlib
+import hmac
+import os
+import struct
+
+MAGIC = b"BSSC"
+FORMAT_VERSION = 1
+KDF_PBKDF2_SHA256 = 1
+KDF_DATA_KEY = 2
+KDF_SCRYPT = 3
+DEFAULT_CHUNK_SIZE = 64 * 1024
+SALT_SIZE = 16
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+
+_HEADER = struct.Struct(">4sBBII16s7s")
+HEADER_SIZE = _HEADER.size
+_LENGTH = struct.Struct(">I")
+
+
+class StreamFormatError(ValueError):
+    """The data is not a valid chunked stream (bad header, truncated, tampered or wrong password)."""
+
+
+def is_chunked_format(data: bytes) -> bool:
+    """True if `data` starts with a chunked-stream header."""
+    return data[:len(MAGIC)] == MAGIC
+
+
+def _nonce(prefix, counter, last):
+    return prefix + struct.pack(">IB", counter, 1 if last else 0)
+
+
+def _rechunk(chunks, size):
+    """Re-slices an iterable of byte strings into pieces of exactly `size` (the last may be shorter)."""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    yield bytes(buffer)
+
+
+def _file_key(data_key: bytes, salt: bytes) -> bytes:
+    return hmac.new(data_key, b"BSSC file key" + salt, hashlib.sha256).digest()
+
+
+def _kdf_fields(kdf: KDFParams):
+    """(kdf_id, kdf_cost) header fields for password-derived stream keys."""
+    if kdf.algorithm == SCRYPT:
+        if kdf.r > 0xFFFF or kdf.p > 0xFF:
+            raise ValueError("scrypt r/p too large for a stream header")
+        return KDF_SCRYPT, (kdf.n.bit_length() - 1) << 24 | kdf.r << 8 | kdf.p
+    return KDF_PBKDF2_SHA256, kdf.iterations
+
+def _kdf_from_fields(kdf_id, cost):
+    if kdf_id == KDF_SCRYPT:
+        return KDFParams.scrypt(1 << (cost >> 24), (cost >> 8) & 0xFFFF, cost & 0xFF)
+    return KDFParams.pbkdf2(cost)
+
+
+def encrypt_stream(chunks, password: str = None, salt: bytes = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   kdf: KDFParams = CURRENT_KDF, data_key: bytes = None):
+    """
+    Encrypts an iterable of plaintext byte strings. Yields the header, then one frame per chunk.
+    Keyed by data_key when given, otherwise by password (derived with `kdf`).
+    """
+    salt = salt or os.urandom(SALT_SIZE)
+    nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+    if data_key is not None:
+        header = _HEADER.pack(MAGIC, FORMAT_VERSION, KDF_DATA_KEY, 0, chunk_size, salt, nonce_prefix)
+        aead = AESGCM(_file_key(data_key, salt))
+    else:
+        kdf_id, kdf_cost = _kdf_fields(kdf)
+        header = _HEADER.pack(MAGIC, FORMAT_VERSION, kdf_id, kdf_cost, chunk_size, salt, nonce_prefix)
+        aead = AESGCM(derive_raw_key(password, salt, kdf))
+    yield header
+
+    counter = 0
+    pending = None
+    # Look one chunk ahead so the final frame can be marked as last
+    for piece in _rechunk(chunks, chunk_size):
+        if pending is not None:
+            sealed = aead.encrypt(_nonce(nonce_prefix, counter, False), pending, header)
+            yield _LENGTH.pack(len(sealed)) + sealed
+            counter += 1
+        pending = piece
+    sealed = aead.encrypt(_nonce(nonce_prefix, counter, True), pending or b"", header)
+    yield _LENGTH.pack(len(sealed)) + sealed
+
+
+class _Reader:
+    """Reads exact byte counts from an iterable of byte strings."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+
+    def read(self, size):
+        while len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def read_header(data: bytes):
+    """
+    Parses a header. Returns a dict with version, kdf_id, kdf (KDFParams, None for
+    data-key streams), chunk_size, salt.
+    """
+    if len(data) < HEADER_SIZE:
+        raise StreamFormatError("stream is shorter than its header")
+    magic, version, kdf_id, kdf_cost, chunk_size, salt, nonce_prefix = _HEADER.unpack(data[:HEADER_SIZE])
+    if magic != MAGIC:
+        raise StreamFormatError("not a chunked stream")
+    if version != FORMAT_VERSION:
+        raise StreamFormatError(f"unsupported stream version {version}")
+    if kdf_id not in (KDF_PBKDF2_SHA256, KDF_DATA_KEY, KDF_SCRYPT):
+        raise StreamFormatError(f"unsupported KDF {kdf_id}")
+    try:
+        kdf = None if kdf_id == KDF_DATA_KEY else _kdf_from_fields(kdf_id, kdf_cost)
+    except KDFParamsError as e:
+        raise StreamFormatError(f"invalid KDF parameters: {e}")
+    return {
+        "version": version,
+        "kdf_id": kdf_id,
+        "kdf": kdf,
+        "chunk_size": chunk_size,
+        "salt": salt,
+        "nonce_prefix": nonce_prefix,
+    }
+
+
+def decrypt_stream(chunks, password: str = None, data_key: bytes = None):
+    """
+    Decrypts an iterable of stream byte strings, yielding plaintext chunks.
+    Streams written with a data key need data_key, the others password.
+    Raises StreamFormatError on a wrong password, tampering or truncation.
+    """
+    reader = _Reader(chunks)
+    header = reader.read(HEADER_SIZE)
+    params = read_header(header)
+    if params["kdf_id"] == KDF_DATA_KEY:
+        if data_key is None:
+            raise StreamFormatError("stream is encrypted with a data key")
+        aead = AESGCM(_file_key(data_key, params["salt"]))
+    else:
+        if password is None:
+            raise StreamFormatError("stream is encrypted with a password")
+        aead = AESGCM(derive_raw_key(password, params["salt"], params["kdf"]))
+    max_frame = params["chunk_size"] + TAG_SIZE
+
+    counter = 0
+    while True:
+        length_bytes = reader.read(_LENGTH.size)
+        if len(length_bytes) < _LENGTH.size:
+            raise StreamFormatError("stream is truncated")
+        (length,) = _LENGTH.unpack(length_bytes)
+        if length < TAG_SIZE or length > max_frame:
+            raise StreamFormatError("invalid frame length")
+        sealed = reader.read(length)
+        if len(sealed) < length:
+            raise StreamFormatError("stream is truncated")
+
+        # Try as an inner frame first, then as the final frame
+        try:
+            yield aead.decrypt(_nonce(params["nonce_prefix"], counter, False), sealed, header)
+        except InvalidTag:
+            try:
+                plaintext = aead.decrypt(_nonce(params["nonce_prefix"], counter, True), sealed, header)
+            except InvalidTag:
+                raise StreamFormatError("authentication failed (wrong password or tampered data)")
+            if reader.read(1):
+                raise StreamFormatError("data after the final frame")
+            yield plaintext
+            return
+        counter += 1
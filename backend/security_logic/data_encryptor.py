@@ -1,39 +1,184 @@
 from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+from security_logic.key_cache import key_cache, KEY_CACHE_ENABLED
+from security_logic.kdf_executor import kdf_executor, KDFBusyError
+from security_logic.kdf_params import derive, LEGACY_KDF, CURRENT_KDF
+from observability.metrics import DECRYPT_FAILURES
+from observability.log import get_logger
 import base64
 import os
 
+DATA_KEY_SIZE = 32
+WRAP_NONCE_SIZE = 12
+
+log = get_logger(__name__)
+
+def derive_raw_key(password: str, salt: bytes, kdf=LEGACY_KDF) -> bytes:
+    """32 raw key bytes. Runs on the shared KDF pool (raises KDFBusyError when it is full)."""
+    return kdf_executor.run(derive, password.encode(), salt, kdf.encode())
+
 # This function creates a strong encryption key from a user's password
-def derive_key(password: str, salt: bytes) -> bytes:
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=100000, # Standard number of iterations
-        backend=default_backend()
-    )
+def derive_key(password: str, salt: bytes, kdf=LEGACY_KDF) -> bytes:
+    raw_key = derive_raw_key(password, salt, kdf)
     # Return a URL-safe base64 encoded key
-    return base64.urlsafe_b64encode(kdf.derive(password.encode()))
+    return base64.urlsafe_b64encode(raw_key)
 
 # --- "Clocking" (Encryption) Function ---
-def encrypt_data(data_to_encrypt: str, password: str) -> tuple[bytes, bytes]:
-    """Encrypts data. Returns (encrypted_data_bytes, salt_bytes)"""
+def encrypt_data(data_to_encrypt: str, password: str, kdf=LEGACY_KDF) -> tuple[bytes, bytes]:
+    """
+    Encrypts data. Returns (encrypted_data_bytes, salt_bytes). Raises KDFBusyError when the KDF pool is full.
+    Store `kdf` with the record (record_format.encode_columns) when it is not LEGACY_KDF.
+    """
     salt = os.urandom(16) # Generate a new, random salt for every encryption
-    key = derive_key(password, salt)
+    key = derive_key(password, salt, kdf)
     f = Fernet(key)
     encrypted_data = f.encrypt(data_to_encrypt.encode())
     return encrypted_data, salt
 
+def encrypt_many(items: list[str], password: str, kdf=LEGACY_KDF) -> tuple[list[bytes], bytes]:
+    """
+    Encrypts several strings under one salt, so the KDF runs once for the batch.
+    Returns ([encrypted_data_bytes, ...], salt_bytes). Every token still gets its own random IV.
+    """
+    salt = os.urandom(16)
+    f = Fernet(derive_key(password, salt, kdf))
+    return [f.encrypt(item.encode()) for item in items], salt
+
 # --- "Un-Clocking" (Decryption) Function ---
-def decrypt_data(encrypted_data: bytes, password: str, salt: bytes) -> str:
-    """Decrypts data. Returns the original string or None if failed."""
+def _decrypt_with_salt(tokens: list[bytes], password: str, salt: bytes, cache_owner=None, kdf=LEGACY_KDF) -> list:
+    """Decrypts tokens that share one salt with a single key derivation. None for each failure."""
+    key = key_cache.get(password, salt) if KEY_CACHE_ENABLED else None
+    from_cache = key is not None
+    if key is None:
+        key = derive_key(password, salt, kdf)
+    f = Fernet(key)
+    results = []
+    for token in tokens:
+        try:
+            results.append(f.decrypt(token).decode())
+        except Exception as e:
+            log.info("decrypt_failed", format="fernet", error_type=type(e).__name__)
+            DECRYPT_FAILURES.inc(format="fernet")
+            results.append(None)
+    # Only cache a key once it has proven to be correct
+    if KEY_CACHE_ENABLED and not from_cache and any(r is not None for r in results):
+        key_cache.put(password, salt, key, owner=cache_owner)
+    return results
+
+def decrypt_data(encrypted_data: bytes, password: str, salt: bytes, cache_owner=None, kdf=LEGACY_KDF) -> str:
+    """
+    Decrypts data. Returns the original string or None if failed.
+    `kdf` is the parameters the record was encrypted with.
+    Raises KDFBusyError when the KDF pool is full.
+    When KEY_CACHE_ENABLED is set, keys that successfully decrypt are cached
+    under `cache_owner` (the user_id) so repeat access skips PBKDF2.
+    """
     try:
-        key = derive_key(password, salt)
-        f = Fernet(key)
-        decrypted_data = f.decrypt(encrypted_data)
-        return decrypted_data.decode()
+        return _decrypt_with_salt([encrypted_data], password, salt, cache_owner, kdf)[0]
+    except KDFBusyError:
+        raise
     except Exception as e:
-        print(f"Decryption failed (likely wrong password): {e}")
-        return None
\ No newline at end of file
+        log.info("decrypt_failed", format="fernet", error_type=type(e).__name__)
+        DECRYPT_FAILURES.inc(format="fernet")
+        return None
+
+def decrypt_many(records: list[tuple], password: str, cache_owner=None) -> list:
+    """
+    Decrypts [(encrypted_data, salt), ...] or [(encrypted_data, salt, kdf), ...] (LEGACY_KDF
+    when left out), deriving the key once per distinct salt and parameters.
+    Returns the strings in the same order, None where decryption failed.
+    Raises KDFBusyError when the KDF pool is full.
+    """
+    by_salt = {}
+    for index, (token, salt, *kdf) in enumerate(records):
+        by_salt.setdefault((bytes(salt), kdf[0] if kdf else LEGACY_KDF), []).append((index, token))
+    results = [None] * len(records)
+    for (salt, kdf), entries in by_salt.items():
+        try:
+            plaintexts = _decrypt_with_salt([token for _, token in entries], password, salt, cache_owner, kdf)
+        except KDFBusyError:
+            raise
+        except Exception as e:
+            log.info("decrypt_failed", format="fernet", error_type=type(e).__name__, count=len(entries))
+            DECRYPT_FAILURES.inc(len(entries), format="fernet")
+            continue
+        for (index, _), plaintext in zip(entries, plaintexts):
+            results[index] = plaintext
+    return results
+
+# --- Envelope encryption: a random per-user data key, wrapped by the password-derived key ---
+def generate_data_key() -> bytes:
+    """A fresh random data key (Fernet signing + encryption halves)."""
+    return os.urandom(DATA_KEY_SIZE)
+
+def _key_encryption_key(password: str, salt: bytes, kdf):
+    """Returns (kek, from_cache). The KEK goes through the derived-key cache like any other key."""
+    kek = key_cache.get(password, salt) if KEY_CACHE_ENABLED else None
+    if kek is not None:
+        return kek, True
+    return derive_raw_key(password, salt, kdf), False
+
+def wrap_data_key(data_key: bytes, password: str, context: bytes, kdf=CURRENT_KDF) -> tuple[bytes, bytes]:
+    """
+    Seals data_key under a key derived from password. `context` (e.g. the user_id)
+    is authenticated, so a wrapped key cannot be moved to another user.
+    Returns (nonce || AES-GCM ciphertext, salt). Raises KDFBusyError when the KDF pool is full.
+    """
+    salt = os.urandom(16)
+    kek = derive_raw_key(password, salt, kdf)
+    nonce = os.urandom(WRAP_NONCE_SIZE)
+    return nonce + AESGCM(kek).encrypt(nonce, data_key, context), salt
+
+def unwrap_data_key(wrapped: bytes, password: str, salt: bytes, kdf, context: bytes, cache_owner=None):
+    """Returns the data key, or None if the password is wrong. Raises KDFBusyError when the KDF pool is full."""
+    kek, from_cache = _key_encryption_key(password, salt, kdf)
+    return _open_wrapped_key(kek, from_cache, wrapped, password, salt, context, cache_owner)
+
+async def unwrap_data_key_async(wrapped: bytes, password: str, salt: bytes, kdf, context: bytes, cache_owner=None):
+    """unwrap_data_key() for coroutines: the KEK is derived without blocking the event loop."""
+    kek = key_cache.get(password, salt) if KEY_CACHE_ENABLED else None
+    from_cache = kek is not None
+    if kek is None:
+        kek = await kdf_executor.run_async(derive, password.encode(), salt, kdf.encode())
+    return _open_wrapped_key(kek, from_cache, wrapped, password, salt, context, cache_owner)
+
+def _open_wrapped_key(kek, from_cache, wrapped, password, salt, context, cache_owner):
+    try:
+        data_key = AESGCM(kek).decrypt(wrapped[:WRAP_NONCE_SIZE], wrapped[WRAP_NONCE_SIZE:], context)
+    except InvalidTag:
+        DECRYPT_FAILURES.inc(format="data-key")
+        return None
+    if KEY_CACHE_ENABLED and not from_cache:
+        key_cache.put(password, salt, kek, owner=cache_owner)
+    return data_key
+
+def encrypt_with_data_key(items: list[str], data_key: bytes) -> list[bytes]:
+    """Encrypts strings with an unwrapped data key (no KDF involved)."""
+    f = Fernet(base64.urlsafe_b64encode(data_key))
+    return [f.encrypt(item.encode()) for item in items]
+
+def decrypt_with_data_key(tokens: list[bytes], data_key: bytes) -> list:
+    """Decrypts tokens made by encrypt_with_data_key. None for each token that fails."""
+    f = Fernet(base64.urlsafe_b64encode(data_key))
+    results = []
+    for token in tokens:
+        try:
+            results.append(f.decrypt(token).decode())
+        except Exception as e:
+            log.warning("decrypt_failed", format="envelope", error_type=type(e).__name__)
+            DECRYPT_FAILURES.inc(format="envelope")
+            results.append(None)
+    return results
+
+def invalidate_cached_keys(user_id):
+    """Drops any cached keys for a user. Call whenever their password changes."""
+    return key_cache.invalidate_owner(user_id)
+
+def key_cache_stats():
+    """Returns hit/miss/size counters for the derived-key cache."""
+    return key_cache.stats()
+
+def kdf_executor_stats():
+    """Returns queue depth and wait/run times for the shared KDF pool."""
+    return kdf_executor.stats()
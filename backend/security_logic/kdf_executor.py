@@ -0,0 +1,171 @@
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+import asyncio
+from observability.metrics import KDF_SECONDS, KDF_REJECTED
+import multiprocessing
+import os
+import threading
+import time
+
+# Worker processes for key derivation. 0 runs the KDF inline on the request thread.
+KDF_EXECUTOR_WORKERS = int(os.getenv("KDF_EXECUTOR_WORKERS", str(os.cpu_count() or 1)))
+# Maximum derivations running or waiting at once before callers are turned away.
+KDF_QUEUE_LIMIT = int(os.getenv("KDF_QUEUE_LIMIT", str(max(KDF_EXECUTOR_WORKERS, 1) * 4)))
+# Value sent in the Retry-After header when the queue is full.
+KDF_RETRY_AFTER_SECONDS = int(os.getenv("KDF_RETRY_AFTER_SECONDS", "1"))
+
+
+class KDFBusyError(Exception):
+    """Raised when the KDF queue is full. Routes turn this into a 503 with Retry-After."""
+
+    def __init__(self, retry_after=KDF_RETRY_AFTER_SECONDS):
+        super().__init__(f"KDF queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _timed_call(fn, args):
+    """Runs in the worker process; returns the result and how long the work itself took."""
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+class KDFExecutor:
+    """
+    Shared process pool for CPU-heavy key derivation with a bounded queue.
+
+    Every call takes a slot from a semaphore sized to `queue_limit`; when no
+    slot is free the call fails immediately with KDFBusyError instead of
+    piling up behind the pool. The time a call spends waiting for a worker
+    is tracked separately from the time spent deriving.
+    """
+
+    def __init__(self, workers=KDF_EXECUTOR_WORKERS, queue_limit=KDF_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    # "spawn" keeps workers independent of the threaded server process.
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+        return self._pool
+
+    def configure(self, workers, queue_limit):
+        """Resizes the pool before it is first used (gunicorn does so per worker, see gunicorn.conf.py)."""
+        with self._pool_lock:
+            if self._pool is not None:
+                raise RuntimeError("the KDF pool is already running")
+            self.workers = workers
+            self.queue_limit = queue_limit
+            self._slots = threading.BoundedSemaphore(queue_limit)
+
+    def has_capacity(self):
+        """True if a new derivation would currently be accepted."""
+        return self._in_flight < self.queue_limit
+
+    def _take_slot(self):
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self.rejected += 1
+            KDF_REJECTED.inc()
+            raise KDFBusyError()
+        with self._stats_lock:
+            self._in_flight += 1
+
+    def _release_slot(self):
+        with self._stats_lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def run(self, fn, *args):
+        """Runs fn(*args) on the pool and returns its result, or raises KDFBusyError."""
+        self._take_slot()
+        submitted = time.perf_counter()
+        try:
+            if self.workers <= 0:
+                result, run_seconds = _timed_call(fn, args)
+            else:
+                try:
+                    future = self._get_pool().submit(_timed_call, fn, args)
+                except BrokenExecutor:
+                    raise
+                except RuntimeError:
+                    # The interpreter is exiting (atexit drains jobs): the pool takes no new work
+                    future = None
+                result, run_seconds = future.result() if future else _timed_call(fn, args)
+        finally:
+            self._release_slot()
+        self._record(submitted, run_seconds)
+        return result
+
+    async def run_async(self, fn, *args):
+        """
+        run() for coroutines: awaits the pool instead of blocking, so the event loop
+        keeps serving while the key is derived. With no worker processes the
+        derivation runs on the loop's default thread pool instead of inline.
+        """
+        self._take_slot()
+        submitted = time.perf_counter()
+        try:
+            if self.workers <= 0:
+                result, run_seconds = await asyncio.get_running_loop().run_in_executor(None, _timed_call, fn, args)
+            else:
+                result, run_seconds = await asyncio.wrap_future(self._get_pool().submit(_timed_call, fn, args))
+        finally:
+            self._release_slot()
+        self._record(submitted, run_seconds)
+        return result
+
+    def _record(self, submitted, run_seconds):
+        wait_seconds = max(time.perf_counter() - submitted - run_seconds, 0.0)
+        KDF_SECONDS.observe(wait_seconds, phase="wait")
+        KDF_SECONDS.observe(run_seconds, phase="run")
+        with self._stats_lock:
+            self.completed += 1
+            self.total_wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+            self.total_run_seconds += run_seconds
+
+    def stats(self):
+        with self._stats_lock:
+            completed = self.completed or 1
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "queue_depth": self._in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait_seconds / completed * 1000, 3),
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+                "avg_run_ms": round(self.total_run_seconds / completed * 1000, 3),
+            }
+
+    def warm_up(self):
+        """Starts every worker process now, so the first real derivations do not pay for spawning them."""
+        if self.workers <= 0:
+            return
+        pool = self._get_pool()
+        for future in [pool.submit(_timed_call, os.getpid, ()) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+kdf_executor = KDFExecutor()
@@ -0,0 +1,116 @@
+"""
+Versioned key-derivation parameters.
+
+Every password-derived key is stored together with the parameters that
+produced it, written as a short string:
+
+    pbkdf2-sha256:i=<iterations>
+    scrypt:n=<cost>,r=<block size>,p=<parallelism>
+
+Data written before parameters were recorded used LEGACY_KDF. New data uses
+CURRENT_KDF (env KDF_PARAMS, e.g. as printed by `python -m tools.calibrate_kdf`).
+Data opened with other parameters is re-encrypted with the current ones, see
+user_keys.py.
+"""
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.backends import default_backend
+import os
+
+PBKDF2_SHA256 = "pbkdf2-sha256"
+SCRYPT = "scrypt"
+KEY_LENGTH = 32
+
+# Upper bounds, so a corrupted or hostile record cannot make us burn minutes of CPU or GBs of memory
+MAX_PBKDF2_ITERATIONS = 10_000_000
+MAX_SCRYPT_MEMORY = 1024 * 1024 * 1024
+
+
+class KDFParamsError(ValueError):
+    """A parameter string is malformed or out of bounds."""
+
+
+class KDFParams:
+    """A KDF choice: the algorithm and its cost settings. Treat instances as read-only."""
+
+    def __init__(self, algorithm, iterations=None, n=None, r=None, p=None):
+        if algorithm == PBKDF2_SHA256:
+            if not isinstance(iterations, int) or not 1000 <= iterations <= MAX_PBKDF2_ITERATIONS:
+                raise KDFParamsError(f"PBKDF2 iterations out of range: {iterations}")
+            n = r = p = None
+        elif algorithm == SCRYPT:
+            if not all(isinstance(v, int) and v > 0 for v in (n, r, p)):
+                raise KDFParamsError("scrypt needs positive n, r and p")
+            if n < 2 or n & (n - 1):
+                raise KDFParamsError(f"scrypt n must be a power of two: {n}")
+            if 128 * n * r * p > MAX_SCRYPT_MEMORY:
+                raise KDFParamsError("scrypt parameters need too much memory")
+            iterations = None
+        else:
+            raise KDFParamsError(f"unknown KDF algorithm {algorithm!r}")
+        self.algorithm = algorithm
+        self.iterations = iterations
+        self.n, self.r, self.p = n, r, p
+
+    @classmethod
+    def pbkdf2(cls, iterations):
+        return cls(PBKDF2_SHA256, iterations=iterations)
+
+    @classmethod
+    def scrypt(cls, n, r=8, p=1):
+        return cls(SCRYPT, n=n, r=r, p=p)
+
+    @classmethod
+    def parse(cls, text):
+        """Reads a string made by encode(). Raises KDFParamsError."""
+        algorithm, _, settings = (text or "").strip().partition(":")
+        try:
+            values = dict(item.split("=", 1) for item in settings.split(",") if item)
+            values = {key.strip(): int(value) for key, value in values.items()}
+        except ValueError:
+            raise KDFParamsError(f"malformed KDF parameters {text!r}")
+        if algorithm == PBKDF2_SHA256:
+            return cls.pbkdf2(values.get("i"))
+        if algorithm == SCRYPT:
+            return cls.scrypt(values.get("n"), values.get("r"), values.get("p"))
+        raise KDFParamsError(f"unknown KDF algorithm {algorithm!r}")
+
+    def encode(self):
+        if self.algorithm == PBKDF2_SHA256:
+            return f"{PBKDF2_SHA256}:i={self.iterations}"
+        return f"{SCRYPT}:n={self.n},r={self.r},p={self.p}"
+
+    def _key(self):
+        return (self.algorithm, self.iterations, self.n, self.r, self.p)
+
+    def __eq__(self, other):
+        return isinstance(other, KDFParams) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return f"KDFParams({self.encode()!r})"
+
+
+def derive(password: bytes, salt: bytes, encoded_params: str) -> bytes:
+    """Raw key derivation. Top-level (and takes the encoded params) so it can run in the KDF worker processes."""
+    params = KDFParams.parse(encoded_params)
+    if params.algorithm == PBKDF2_SHA256:
+        kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=KEY_LENGTH,
+            salt=salt,
+            iterations=params.iterations,
+            backend=default_backend()
+        )
+    else:
+        kdf = Scrypt(salt=salt, length=KEY_LENGTH, n=params.n, r=params.r, p=params.p, backend=default_backend())
+    return kdf.derive(password)
+
+
+# What every record without stored parameters was encrypted with
+LEGACY_KDF = KDFParams.pbkdf2(100000)
+# What new data is encrypted with
+CURRENT_KDF = KDFParams.parse(os.getenv("KDF_PARAMS") or LEGACY_KDF.encode())
@@ -0,0 +1,102 @@
+from collections import OrderedDict
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+# The cache is opt-in: derived keys stay in memory for up to the TTL.
+KEY_CACHE_ENABLED = os.getenv("KEY_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+KEY_CACHE_MAX_ENTRIES = int(os.getenv("KEY_CACHE_MAX_ENTRIES", "1024"))
+KEY_CACHE_TTL_SECONDS = int(os.getenv("KEY_CACHE_TTL_SECONDS", "300"))
+
+
+class DerivedKeyCache:
+    """
+    Bounded LRU + TTL cache of derived encryption keys.
+
+    Entries are looked up by an HMAC of (salt, password) under a random
+    per-process secret, so only the exact password that produced a key can
+    ever find it again and nothing stored here can be used to test guesses
+    offline. Keys are held in bytearrays and zeroed when evicted.
+    """
+
+    def __init__(self, max_entries=KEY_CACHE_MAX_ENTRIES, ttl_seconds=KEY_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._secret = os.urandom(32)
+        self._entries = OrderedDict()  # lookup -> (key bytearray, expires_at, owner)
+        self._lock = threading.Lock()
+
+    def _lookup_key(self, password: str, salt: bytes) -> bytes:
+        mac = hmac.new(self._secret, digestmod=hashlib.sha256)
+        mac.update(len(salt).to_bytes(4, 'big'))
+        mac.update(salt)
+        mac.update(password.encode())
+        return mac.digest()
+
+    def get(self, password: str, salt: bytes):
+        """Returns the cached key for (password, salt), or None."""
+        lookup = self._lookup_key(password, salt)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(lookup)
+            if entry is None:
+                self.misses += 1
+                return None
+            key, expires_at, _owner = entry
+            if now >= expires_at:
+                self._discard(lookup)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(lookup)
+            self.hits += 1
+            return bytes(key)
+
+    def put(self, password: str, salt: bytes, key: bytes, owner=None):
+        """Caches a key that has been proven correct. `owner` is used for invalidation."""
+        lookup = self._lookup_key(password, salt)
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            if lookup in self._entries:
+                self._discard(lookup)
+            self._entries[lookup] = (bytearray(key), expires_at, owner)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate_owner(self, owner):
+        """Drops every key cached for `owner` (e.g. a user_id after a password reset)."""
+        with self._lock:
+            stale = [lookup for lookup, entry in self._entries.items() if entry[2] == owner]
+            for lookup in stale:
+                self._discard(lookup)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            for lookup in list(self._entries):
+                self._discard(lookup)
+
+    def _discard(self, lookup):
+        """Removes an entry and zeroes its key material. Caller holds the lock."""
+        key, _expires_at, _owner = self._entries.pop(lookup)
+        key[:] = bytes(len(key))
+        self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": KEY_CACHE_ENABLED,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+key_cache = DerivedKeyCache()
@@ -1,112 +1,770 @@
-from database.supabase_client import supabase_admin
+from database.supabase_client import get_supabase_admin, get_async_supabase_admin
+from database.resilience import degraded_mode, retry_after_hint, FAIL_CLOSED
+from security_logic.audit_logger import audit_logger, AUDIT_WRITE_BEHIND
+from security_logic.profile_cache import profile_cache
+from security_logic.attack_detector import attack_detector
+from observability.metrics import LOCKOUTS_TRIGGERED
+from observability.log import get_logger
 from datetime import datetime, timedelta, timezone
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+import asyncio
+import os
+import queue
+import threading
+import time
+
+log = get_logger(__name__)
 
 MAX_FAILED_ATTEMPTS = 5
 LOCKOUT_DURATION_SECONDS = 30
 
+# Which lockout state backend to use: "rpc" (one database function call per
+# check/failure), "supabase" (query the tables on every check) or "memory"
+# (in-process sliding window, written through to Supabase).
+LOCKOUT_BACKEND = os.getenv("LOCKOUT_BACKEND", "rpc")
+# Upper bound on the number of users the in-memory backend tracks at once.
+LOCKOUT_MAX_TRACKED_USERS = int(os.getenv("LOCKOUT_MAX_TRACKED_USERS", "100000"))
+# Idle entries (no recent failures, not locked) are dropped after this long.
+LOCKOUT_ENTRY_TTL_SECONDS = int(os.getenv("LOCKOUT_ENTRY_TTL_SECONDS", "3600"))
+# Users per set-based request in the bulk operations (bounded by the URL length of `in.(...)` filters)
+LOCKOUT_BULK_BATCH_SIZE = int(os.getenv("LOCKOUT_BULK_BATCH_SIZE", "200"))
+
 def get_utc_now():
     """Returns the current time in UTC."""
     return datetime.now(timezone.utc)
 
-def check_lock_status(user_id):
-    """Checks if a user is currently locked out."""
-    try:
-        lock_res = supabase_admin.table("account_locks") \
-                         .select("unlock_at") \
-                         .eq("user_id", user_id) \
-                         .order("locked_at", desc=True) \
-                         .limit(1) \
-                         .execute()
-        
-        if lock_res.data:
-            unlock_at_str = lock_res.data[0]['unlock_at']
-            unlock_at = datetime.fromisoformat(unlock_at_str.replace('Z', '+00:00'))
+def _locked_message(remaining_total_seconds):
+    return f'Account locked. Try again in {remaining_total_seconds // 60} minutes {remaining_total_seconds % 60} seconds.'
+
+
+class LockoutUnavailable(Exception):
+    """Lockout state could not be read or written, and the caller's degraded mode is to fail closed."""
+
+    def __init__(self, caller, error):
+        super().__init__(f"{caller} unavailable: {error}")
+        self.caller = caller
+        self.retry_after = retry_after_hint(error)
+
+def apply_degraded_mode(caller, error):
+    """
+    Decides what a failed lockout call means (database/resilience.py degraded modes):
+    raises LockoutUnavailable when `caller` fails closed, returns when it fails open.
+    """
+    if degraded_mode(caller) == FAIL_CLOSED:
+        raise LockoutUnavailable(caller, error) from error
+    log.warning("degraded_fail_open", caller=caller, error=str(error))
+
+
+# ----------------------------------------------------------
+# Lockout state backends
+# ----------------------------------------------------------
+class LockoutBackend(ABC):
+    """
+    Interface for lockout state storage.
+    Both abstract methods return (is_locked, message, seconds) like the module-level helpers.
+    """
+
+    @abstractmethod
+    def check_lock_status(self, user_id):
+        """Returns whether the user is locked and the remaining lock seconds."""
+
+    @abstractmethod
+    def record_failure(self, user_id, email):
+        """Records a failed attempt and locks the account if the threshold is met."""
+
+    def reset_failures(self, user_id):
+        """Forgets the user's recent failed attempts (e.g. after a successful login)."""
+
+    def forget(self, user_id):
+        """Drops any lock state held in process, so the next check reads it from Supabase again."""
+
+    def resolve_login(self, email):
+        """Returns (user_id, is_locked, message, seconds) for a login attempt by email."""
+        user_id = lookup_user_id(email)
+        if not user_id:
+            return None, False, "Not locked.", 0
+        return (user_id,) + tuple(self.check_lock_status(user_id))
+
+    async def resolve_login_async(self, email):
+        """resolve_login() for coroutines. Backends without native async I/O run it on a thread."""
+        return await asyncio.to_thread(self.resolve_login, email)
+
+    async def record_failed_login_async(self, user_id, email, ip_address, reason):
+        return await asyncio.to_thread(self.record_failed_login, user_id, email, ip_address, reason)
+
+    def record_failed_login(self, user_id, email, ip_address, reason):
+        """Logs a failed login and, for known users, applies the lockout policy."""
+        log_login_attempt(user_id, email, ip_address, False, reason)
+        if not user_id: # Only lock if we know who the user is
+            return False, "Invalid email or password", 0
+        return self.record_failure(user_id, email)
+
+
+class SupabaseLockoutBackend(LockoutBackend):
+    """Original behaviour: every check and count is a query against Supabase."""
+
+    def check_lock_status(self, user_id):
+        try:
+            lock_res = get_supabase_admin().table("account_locks") \
+                             .select("unlock_at") \
+                             .eq("user_id", user_id) \
+                             .order("locked_at", desc=True) \
+                             .limit(1) \
+                             .execute()
+
+            if lock_res.data:
+                unlock_at_str = lock_res.data[0]['unlock_at']
+                unlock_at = datetime.fromisoformat(unlock_at_str.replace('Z', '+00:00'))
+                now_utc = get_utc_now()
+
+                if now_utc < unlock_at:
+                    remaining = unlock_at - now_utc
+                    remaining_total_seconds = int(remaining.total_seconds())
+                    log.info("account_locked", user_id=user_id, unlock_at=unlock_at.isoformat())
+                    # Return the remaining seconds for the timer
+                    return True, _locked_message(remaining_total_seconds), remaining_total_seconds
+                else:
+                     log.debug("lock_expired", user_id=user_id)
+                     return False, "Lock expired.", 0
+
+        except Exception as e:
+            log.warning("lock_check_error", user_id=user_id, error=str(e))
+            # Not knowing the lock state is not the same as "not locked"
+            apply_degraded_mode("lock_check", e)
+
+        return False, "Not locked.", 0
+
+    def record_failure(self, user_id, email):
+        try:
             now_utc = get_utc_now()
+            # Use seconds for the time window calculation
+            time_window_start = now_utc - timedelta(seconds=LOCKOUT_DURATION_SECONDS * 2)
 
-            if now_utc < unlock_at:
-                remaining = unlock_at - now_utc
-                remaining_total_seconds = int(remaining.total_seconds())
-                print(f"User {user_id} is locked. Unlock at: {unlock_at}, Now: {now_utc}")
-                # Return the remaining seconds for the timer
-                return True, f'Account locked. Try again in {remaining_total_seconds // 60} minutes {remaining_total_seconds % 60} seconds.', remaining_total_seconds
-            else:
-                 print(f"User {user_id} was locked, but lock expired.")
-                 return False, "Lock expired.", 0
+            failures = get_supabase_admin().table("login_attempts") \
+                                     .select("attempt_id", count='exact') \
+                                     .eq("user_id", user_id) \
+                                     .eq("success", False) \
+                                     .gte("timestamp", time_window_start.isoformat()) \
+                                     .execute()
 
-    except Exception as e:
-        print(f"Error checking lock status: {e}")
-        
-    return False, "Not locked.", 0
+            # Failures still waiting in the write-behind audit buffer count too
+            failure_count = failures.count + audit_logger.pending_failures(user_id, time_window_start.timestamp())
+            log.debug("recent_failures", user_id=user_id, failures=failure_count)
+
+            if failure_count >= MAX_FAILED_ATTEMPTS:
+                # --- ASCENDING LOCKOUT DURATION (in Seconds) ---
+                # 1. Count previous locks
+                previous_locks_res = get_supabase_admin().table("account_locks") \
+                                                   .select("lock_id", count='exact') \
+                                                   .eq("user_id", user_id) \
+                                                   .execute()
+                previous_lock_count = previous_locks_res.count
+
+                # 2. Calculate new duration in seconds (1st=600s, 2nd=1200s, 3rd=1800s)
+                new_duration_seconds = LOCKOUT_DURATION_SECONDS * (previous_lock_count + 1)
+                # --- END NEW LOGIC ---
+
+                # Check if already locked recently (to avoid spamming new entries)
+                recent_lock = get_supabase_admin().table("account_locks") \
+                                          .select("lock_id") \
+                                          .eq("user_id", user_id) \
+                                          .gte("locked_at", (now_utc - timedelta(minutes=1)).isoformat()) \
+                                          .limit(1) \
+                                          .execute()
+
+                if not recent_lock.data:
+                    log.info("account_lock_triggered", user_id=user_id, lock_seconds=new_duration_seconds)
+                    LOCKOUTS_TRIGGERED.inc(backend="supabase")
+                    # Use seconds for the unlock time calculation
+                    unlock_time = now_utc + timedelta(seconds=new_duration_seconds)
+                    _write_lock(user_id, now_utc, unlock_time, failure_count)
+
+                # Return the new duration in seconds
+                return True, f'Account locked for {new_duration_seconds // 60} minutes.', new_duration_seconds
+
+        except Exception as e:
+            log.warning("record_failure_error", user_id=user_id, error=str(e))
+            apply_degraded_mode("record_failure", e)
+
+        # Return 0 seconds if no lock was triggered
+        return False, "Invalid email or password", 0
+
+
+class RpcLockoutBackend(SupabaseLockoutBackend):
+    """
+    Uses the database functions from docs/database_schema.sql:
+      - login_security_check(email): user_id and lock state in one call
+      - record_login_failure(...): logs the attempt, counts the window and inserts
+        the escalating lock atomically (no duplicate locks under concurrency)
+    Falls back to the per-table queries if the functions are not installed.
+    """
+
+    def __init__(self):
+        self.available = True
+
+    def _rpc_failed(self, fn, e):
+        # PGRST202: the function does not exist (schema not migrated yet)
+        if getattr(e, "code", None) == "PGRST202":
+            log.warning("database_function_missing", function=fn,
+                        action="falling back to table queries; run docs/database_schema.sql")
+            self.available = False
+
+    def _rpc(self, fn, params):
+        try:
+            return get_supabase_admin().rpc(fn, params).execute().data
+        except Exception as e:
+            self._rpc_failed(fn, e)
+            raise
+
+    async def _rpc_async(self, fn, params):
+        try:
+            return (await get_async_supabase_admin().rpc(fn, params).execute()).data
+        except Exception as e:
+            self._rpc_failed(fn, e)
+            raise
+
+    def resolve_login(self, email):
+        if not self.available:
+            return super().resolve_login(email)
+        try:
+            rows = self._rpc("login_security_check", {"p_email": email})
+        except Exception as e:
+            log.warning("rpc_error", function="login_security_check", error=str(e))
+            if self.available:
+                apply_degraded_mode("lock_check", e)
+            return super().resolve_login(email)
+        return self._login_state(email, rows)
+
+    async def resolve_login_async(self, email):
+        if not self.available:
+            return await asyncio.to_thread(super().resolve_login, email)
+        try:
+            rows = await self._rpc_async("login_security_check", {"p_email": email})
+        except Exception as e:
+            log.warning("rpc_error", function="login_security_check", error=str(e))
+            if self.available:
+                apply_degraded_mode("lock_check", e)
+            return await asyncio.to_thread(super().resolve_login, email)
+        return self._login_state(email, rows)
+
+    def _login_state(self, email, rows):
+        if not rows:
+            profile_cache.remember_lookup(email, None)
+            return None, False, "Not locked.", 0
+        row = rows[0]
+        profile_cache.remember_lookup(email, row['user_id'])
+        if row['is_locked']:
+            remaining_total_seconds = row['remaining_seconds']
+            return row['user_id'], True, _locked_message(remaining_total_seconds), remaining_total_seconds
+        if row['unlock_at']:
+            return row['user_id'], False, "Lock expired.", 0
+        return row['user_id'], False, "Not locked.", 0
+
+    def _failure_params(self, user_id, email, ip_address, reason, log_attempt):
+        return {
+            "p_user_id": user_id,
+            "p_email": email,
+            "p_ip": ip_address,
+            "p_reason": reason,
+            "p_log_attempt": log_attempt,
+            "p_max_attempts": MAX_FAILED_ATTEMPTS,
+            "p_window_seconds": LOCKOUT_DURATION_SECONDS * 2,
+            "p_base_lock_seconds": LOCKOUT_DURATION_SECONDS,
+        }
+
+    def _record(self, user_id, email, ip_address, reason, log_attempt):
+        rows = self._rpc("record_login_failure", self._failure_params(user_id, email, ip_address, reason, log_attempt))
+        return self._failure_result(user_id, rows[0])
+
+    def _failure_result(self, user_id, row):
+        log.debug("recent_failures", user_id=user_id, failures=row['failed_count'])
+        if not row['locked']:
+            return False, "Invalid email or password", 0
+        new_duration_seconds = row['lock_seconds']
+        if row['lock_created']:
+            log.info("account_lock_triggered", user_id=user_id, lock_seconds=new_duration_seconds)
+            LOCKOUTS_TRIGGERED.inc(backend="rpc")
+            profile_cache.invalidate_user(user_id)
+        return True, f'Account locked for {new_duration_seconds // 60} minutes.', new_duration_seconds
+
+    def record_failure(self, user_id, email):
+        if not self.available:
+            return super().record_failure(user_id, email)
+        try:
+            return self._record(user_id, email, None, None, False)
+        except Exception as e:
+            log.warning("rpc_error", function="record_login_failure", user_id=user_id, error=str(e))
+            return super().record_failure(user_id, email)
+
+    def record_failed_login(self, user_id, email, ip_address, reason):
+        if not user_id or not self.available:
+            return super().record_failed_login(user_id, email, ip_address, reason)
+        try:
+            # The function writes the login_attempts row itself, in the same transaction
+            return self._record(user_id, email, ip_address, reason, True)
+        except Exception as e:
+            log.warning("rpc_error", function="record_login_failure", user_id=user_id, error=str(e))
+            if self.available:
+                apply_degraded_mode("record_failure", e)
+            return super().record_failed_login(user_id, email, ip_address, reason)
+
+    async def record_failed_login_async(self, user_id, email, ip_address, reason):
+        if not user_id or not self.available:
+            return await asyncio.to_thread(super().record_failed_login, user_id, email, ip_address, reason)
+        try:
+            rows = await self._rpc_async("record_login_failure",
+                                         self._failure_params(user_id, email, ip_address, reason, True))
+            return self._failure_result(user_id, rows[0])
+        except Exception as e:
+            log.warning("rpc_error", function="record_login_failure", user_id=user_id, error=str(e))
+            if self.available:
+                apply_degraded_mode("record_failure", e)
+            return await asyncio.to_thread(super().record_failed_login, user_id, email, ip_address, reason)
+
+
+class _UserLockState:
+    """Per-user sliding window of failures plus the current lock, in epoch seconds."""
+    __slots__ = ("failures", "lock_count", "locked_at", "unlock_at", "touched", "pending_writes")
+
+    def __init__(self, lock_count=0, locked_at=0.0, unlock_at=0.0):
+        self.failures = deque()
+        self.lock_count = lock_count
+        self.locked_at = locked_at
+        self.unlock_at = unlock_at
+        self.touched = time.time()
+        # Locks queued for the write-through but not yet in Supabase
+        self.pending_writes = 0
+
+
+class InMemoryLockoutBackend(LockoutBackend):
+    """
+    Keeps lockout state in process memory so checks and failure counting never
+    wait on the database. New locks are written through to `account_locks` and
+    `profiles` asynchronously.
+
+    State is bounded: entries are kept in LRU order, capped at `max_users`, and
+    idle entries are dropped after `entry_ttl` seconds. When a user is first
+    seen (or seen again after eviction) their lock history is loaded once from
+    Supabase so escalating durations survive restarts and evictions. An entry
+    whose lock is still queued for the write-through is never evicted: reloaded
+    from Supabase before the write lands, the account would appear unlocked.
+    """
+
+    def __init__(self, max_users=LOCKOUT_MAX_TRACKED_USERS, entry_ttl=LOCKOUT_ENTRY_TTL_SECONDS,
+                 hydrate=True):
+        self.max_users = max_users
+        self.entry_ttl = entry_ttl
+        self.hydrate = hydrate
+        self.window_seconds = LOCKOUT_DURATION_SECONDS * 2
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load_state(self, user_id):
+        """Seeds a new entry from the user's lock history in Supabase."""
+        if not self.hydrate:
+            return _UserLockState()
+        try:
+            res = get_supabase_admin().table("account_locks") \
+                                .select("locked_at, unlock_at", count='exact') \
+                                .eq("user_id", user_id) \
+                                .order("locked_at", desc=True) \
+                                .limit(1) \
+                                .execute()
+            if res.data:
+                latest = res.data[0]
+                locked_at = datetime.fromisoformat(latest['locked_at'].replace('Z', '+00:00'))
+                unlock_at = datetime.fromisoformat(latest['unlock_at'].replace('Z', '+00:00'))
+                return _UserLockState(res.count or 1, locked_at.timestamp(), unlock_at.timestamp())
+        except Exception as e:
+            log.warning("lock_history_error", user_id=user_id, error=str(e))
+            apply_degraded_mode("lock_check", e)
+        return _UserLockState()
+
+    def _get_state(self, user_id, now):
+        """Returns the entry for user_id, loading and inserting it if needed."""
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is not None:
+                self._states.move_to_end(user_id)
+                state.touched = now
+                return state
+
+        # Hydrate without holding the lock so a slow query never blocks other users.
+        loaded = self._load_state(user_id)
+
+        with self._lock:
+            state = self._states.setdefault(user_id, loaded)
+            state.touched = now
+            self._evict(now)
+            return state
+
+    def _is_idle(self, state, now):
+        return (now - state.touched > self.entry_ttl
+                and now >= state.unlock_at
+                and not state.failures
+                and not state.pending_writes)
+
+    def _evict(self, now):
+        """Drops idle entries from the LRU end, then enforces the size cap (skipping unwritten locks)."""
+        while self._states:
+            user_id, state = next(iter(self._states.items()))
+            self._prune(state, now)
+            if not self._is_idle(state, now):
+                break
+            self._states.popitem(last=False)
+        if len(self._states) <= self.max_users:
+            return
+        excess = len(self._states) - self.max_users
+        victims = []
+        for user_id, state in self._states.items():
+            if not state.pending_writes:
+                victims.append(user_id)
+                if len(victims) == excess:
+                    break
+        for user_id in victims:
+            del self._states[user_id]
+
+    def _prune(self, state, now):
+        cutoff = now - self.window_seconds
+        failures = state.failures
+        while failures and failures[0] < cutoff:
+            failures.popleft()
+
+    def check_lock_status(self, user_id):
+        now = time.time()
+        state = self._get_state(user_id, now)
+        unlock_at = state.unlock_at
+
+        if now < unlock_at:
+            remaining_total_seconds = int(unlock_at - now)
+            return True, _locked_message(remaining_total_seconds), remaining_total_seconds
+        if unlock_at:
+            return False, "Lock expired.", 0
+        return False, "Not locked.", 0
+
+    def record_failure(self, user_id, email):
+        now = time.time()
+        state = self._get_state(user_id, now)
+        with self._lock:
+            self._prune(state, now)
+            state.failures.append(now)
+            failure_count = len(state.failures)
+
+            if failure_count < MAX_FAILED_ATTEMPTS:
+                return False, "Invalid email or password", 0
+
+            new_duration_seconds = LOCKOUT_DURATION_SECONDS * (state.lock_count + 1)
+            # Same guard as the Supabase backend: one lock per minute at most.
+            if now - state.locked_at < 60:
+                return True, f'Account locked for {new_duration_seconds // 60} minutes.', new_duration_seconds
+
+            state.lock_count += 1
+            state.locked_at = now
+            state.unlock_at = now + new_duration_seconds
+            state.pending_writes += 1
+
+        log.info("account_lock_triggered", user_id=user_id, lock_seconds=new_duration_seconds)
+        LOCKOUTS_TRIGGERED.inc(backend="memory")
+        _write_through.submit(
+            self._write_lock,
+            state,
+            user_id,
+            datetime.fromtimestamp(now, timezone.utc),
+            datetime.fromtimestamp(now + new_duration_seconds, timezone.utc),
+            failure_count,
+        )
+        return True, f'Account locked for {new_duration_seconds // 60} minutes.', new_duration_seconds
+
+    def _write_lock(self, state, user_id, locked_at, unlock_at, failed_attempts_count):
+        """Runs on the write-through thread; the entry may be evicted again once the lock is stored."""
+        try:
+            _write_lock(user_id, locked_at, unlock_at, failed_attempts_count)
+        finally:
+            with self._lock:
+                state.pending_writes -= 1
+
+    def reset_failures(self, user_id):
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is not None:
+                state.failures.clear()
+
+    def forget(self, user_id):
+        with self._lock:
+            self._states.pop(user_id, None)
+
+
+def _write_lock(user_id, locked_at, unlock_at, failed_attempts_count):
+    """Persists a new lock to account_locks and flags the profile."""
+    get_supabase_admin().table("account_locks").insert({
+        "user_id": user_id,
+        "locked_at": locked_at.isoformat(),
+        "unlock_at": unlock_at.isoformat(),
+        "failed_attempts_count": failed_attempts_count
+    }).execute()
+
+    get_supabase_admin().table("profiles").update({"is_locked": True}).eq("user_id", user_id).execute()
+    profile_cache.invalidate_user(user_id)
+
+
+class _WriteThrough:
+    """Runs database writes on a background thread, in submission order."""
+
+    def __init__(self, maxsize=1000):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="lockout-write-through", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            fn, args = self._queue.get()
+            try:
+                fn(*args)
+            except Exception:
+                log.exception("lockout_write_through_error")
+            finally:
+                self._queue.task_done()
+
+    def submit(self, fn, *args):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((fn, args))
+        except queue.Full:
+            # Never drop a lock: fall back to writing it on the caller's thread.
+            fn(*args)
+
+    def drain(self):
+        if self._thread is not None:
+            self._queue.join()
+
+
+_write_through = _WriteThrough()
+
+
+def drain_lockout_writes():
+    """Waits until queued lock writes are done (on shutdown, see lifecycle.py)."""
+    _write_through.drain()
+
+
+_BACKENDS = {
+    "rpc": RpcLockoutBackend,
+    "supabase": SupabaseLockoutBackend,
+    "memory": InMemoryLockoutBackend,
+}
+
+_backend = None
+
+def get_lockout_backend():
+    """Returns the active lockout backend, creating it from LOCKOUT_BACKEND on first use."""
+    global _backend
+    if _backend is None:
+        try:
+            _backend = _BACKENDS[LOCKOUT_BACKEND]()
+        except KeyError:
+            raise ValueError(f"Unknown LOCKOUT_BACKEND '{LOCKOUT_BACKEND}'. Use one of: {', '.join(_BACKENDS)}")
+    return _backend
+
+def set_lockout_backend(backend):
+    """Replaces the active lockout backend (e.g. InMemoryLockoutBackend(max_users=...))."""
+    global _backend
+    _backend = backend
+
+
+def _query_user_id(email):
+    # Raises on database errors so the profile cache never stores a failed lookup as "unknown"
+    user_res = get_supabase_admin().from_("profiles").select("user_id").eq("email", email).execute()
+    if user_res.data and len(user_res.data) > 0:
+        return user_res.data[0]['user_id']
+    return None
+
+def lookup_user_id(email):
+    """Returns the user_id for an email from the profiles table (through the profile cache), or None."""
+    try:
+        return profile_cache.lookup_user_id(email, _query_user_id)
+    except Exception as lookup_err:
+        log.warning("user_lookup_error", email=email, error=str(lookup_err))
+        apply_degraded_mode("lock_check", lookup_err)
+    return None
+
+def resolve_login_state(email):
+    """
+    Resolves email -> user_id and the lock state. Returns (user_id, is_locked, message, seconds).
+    user_id is None when the profile cache rules the email out; the caller then
+    checks the lock of the account Supabase Auth signs in (check_lock_status), and
+    a failure is counted against the account looked up again (record_failed_login).
+    """
+    # Emails with no profile skip the profile query (Bloom filter / negative cache)
+    if profile_cache.definitely_unknown(email):
+        return None, False, "Not locked.", 0
+    return get_lockout_backend().resolve_login(email)
+
+def check_lock_status(user_id):
+    """Checks if a user is currently locked out."""
+    return get_lockout_backend().check_lock_status(user_id)
+
+def _attempt_row(user_id, email, ip_address, success, reason):
+    return {
+        "user_id": user_id,
+        "username_attempted": email,
+        "success": success,
+        "failure_reason": reason,
+        "ip_address": ip_address
+    }
 
 def log_login_attempt(user_id, email, ip_address, success, reason=""):
-    """Logs a login attempt to the database."""
+    """Logs a login attempt to the database (through the write-behind audit buffer when enabled)."""
+    row = _attempt_row(user_id, email, ip_address, success, reason)
+    if AUDIT_WRITE_BEHIND:
+        audit_logger.log(row)
+        return
     try:
-        supabase_admin.table("login_attempts").insert({
-            "user_id": user_id,
-            "username_attempted": email,
-            "success": success,
-            "failure_reason": reason,
-            "ip_address": ip_address
-        }).execute()
+        get_supabase_admin().table("login_attempts").insert(row).execute()
     except Exception as e:
-        print(f"Error logging login attempt: {e}")
+        log.warning("login_attempt_write_error", user_id=user_id, error=str(e))
 
 def trigger_lock_if_needed(user_id, email):
     """Counts failures and triggers a lock if the threshold is met."""
+    return get_lockout_backend().record_failure(user_id, email)
+
+def _account_for_failure(user_id, email):
+    """
+    The user_id a failed login counts against. An email the login could not
+    resolve is looked up again past the cache (its profile job may have run
+    since), unless the profile cache rules it out: repeated failures for
+    unknown addresses then cost no profile query. An account created by another
+    worker after this one's last Bloom rebuild is missed until the next rebuild
+    (PROFILE_BLOOM_REFRESH_SECONDS); the attack detector still counts it.
+    """
+    if user_id or not email or profile_cache.definitely_unknown(email):
+        return user_id
+    try:
+        user_id = _query_user_id(email)
+    except Exception as lookup_err:
+        log.warning("user_lookup_error", email=email, error=str(lookup_err))
+        apply_degraded_mode("record_failure", lookup_err)
+        return None
+    if user_id:
+        # Also drops this process's stale "no such profile" answer
+        profile_cache.remember_signup(user_id, email)
+    return user_id
+
+def record_failed_login(user_id, email, ip_address, reason="Invalid credentials"):
+    """Logs a failed login and triggers a lock if needed. Returns (is_locked, message, seconds)."""
+    attack_detector.observe(ip_address, email)
+    user_id = _account_for_failure(user_id, email)
+    return get_lockout_backend().record_failed_login(user_id, email, ip_address, reason)
+
+def clear_failed_attempts(user_id):
+    """Clears the user's failed login attempts and unlocks their profile."""
+    get_lockout_backend().reset_failures(user_id)
+    audit_logger.discard_failures(user_id)
+
+    get_supabase_admin().table("login_attempts") \
+                        .delete() \
+                        .eq("user_id", user_id) \
+                        .eq("success", False) \
+                        .execute()
+
+    get_supabase_admin().table("profiles").update({"is_locked": False}).eq("user_id", user_id).execute()
+    profile_cache.invalidate_user(user_id)
+
+
+# ----------------------------------------------------------
+# Bulk operations (admin API)
+# ----------------------------------------------------------
+def _batches(items, size=LOCKOUT_BULK_BATCH_SIZE):
+    items = list(dict.fromkeys(items))
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def lookup_user_ids(emails):
+    """Maps emails to user_ids with one profiles query per batch. Unknown emails are left out."""
+    found = {}
+    for batch in _batches(emails):
+        res = get_supabase_admin().table("profiles").select("user_id, email").in_("email", batch).execute()
+        found.update((row["email"], row["user_id"]) for row in res.data)
+    return found
+
+def _forget_failures(user_ids):
+    backend = get_lockout_backend()
+    for user_id in user_ids:
+        backend.reset_failures(user_id)
+        audit_logger.discard_failures(user_id)
+
+def clear_failed_attempts_bulk(user_ids):
+    """Deletes the failed attempts of many users, one request per batch. Locks stay in place."""
+    admin = get_supabase_admin()
+    for batch in _batches(user_ids):
+        _forget_failures(batch)
+        admin.table("login_attempts").delete(returning="minimal") \
+             .in_("user_id", batch).eq("success", False).execute()
+
+def unlock_users(user_ids):
+    """
+    clear_failed_attempts() for many users, and ends their active locks early
+    (unlock_at is set to now, so the lock history that escalates later lock
+    durations is kept). Three set-based requests per batch.
+    """
+    admin = get_supabase_admin()
+    now = get_utc_now().isoformat()
+    for batch in _batches(user_ids):
+        _forget_failures(batch)
+        admin.table("account_locks").update({"unlock_at": now}, returning="minimal") \
+             .in_("user_id", batch).gt("unlock_at", now).execute()
+        admin.table("login_attempts").delete(returning="minimal") \
+             .in_("user_id", batch).eq("success", False).execute()
+        admin.table("profiles").update({"is_locked": False}, returning="minimal") \
+             .in_("user_id", batch).execute()
+        # Only after the writes, so a check in between cannot reload the old lock
+        backend = get_lockout_backend()
+        for user_id in batch:
+            backend.forget(user_id)
+            profile_cache.invalidate_user(user_id)
+
+
+# ----------------------------------------------------------
+# Async variants (asyncio serving mode, see routes/async_handlers.py)
+# ----------------------------------------------------------
+async def resolve_login_state_async(email):
+    """resolve_login_state() for coroutines."""
+    if profile_cache.definitely_unknown(email):
+        return None, False, "Not locked.", 0
+    return await get_lockout_backend().resolve_login_async(email)
+
+async def log_login_attempt_async(user_id, email, ip_address, success, reason=""):
+    """log_login_attempt() for coroutines."""
+    row = _attempt_row(user_id, email, ip_address, success, reason)
+    if AUDIT_WRITE_BEHIND:
+        audit_logger.log(row)
+        return
     try:
-        now_utc = get_utc_now()
-        # Use seconds for the time window calculation
-        time_window_start = now_utc - timedelta(seconds=LOCKOUT_DURATION_SECONDS * 2)
-        
-        failures = supabase_admin.table("login_attempts") \
-                                 .select("attempt_id", count='exact') \
-                                 .eq("user_id", user_id) \
-                                 .eq("success", False) \
-                                 .gte("timestamp", time_window_start.isoformat()) \
-                                 .execute()
-        
-        print(f"User {user_id} has {failures.count} recent failed attempts.")
-
-        if failures.count >= MAX_FAILED_ATTEMPTS:
-            # --- ASCENDING LOCKOUT DURATION (in Seconds) ---
-            # 1. Count previous locks
-            previous_locks_res = supabase_admin.table("account_locks") \
-                                               .select("lock_id", count='exact') \
-                                               .eq("user_id", user_id) \
-                                               .execute()
-            previous_lock_count = previous_locks_res.count
-            print(f"User has {previous_lock_count} previous lock(s).")
-
-            # 2. Calculate new duration in seconds (1st=600s, 2nd=1200s, 3rd=1800s)
-            new_duration_seconds = LOCKOUT_DURATION_SECONDS * (previous_lock_count + 1)
-            # --- END NEW LOGIC ---
-
-            # Check if already locked recently (to avoid spamming new entries)
-            recent_lock = supabase_admin.table("account_locks") \
-                                      .select("lock_id") \
-                                      .eq("user_id", user_id) \
-                                      .gte("locked_at", (now_utc - timedelta(minutes=1)).isoformat()) \
-                                      .limit(1) \
-                                      .execute()
-            
-            if not recent_lock.data:
-                print(f"Threshold reached. Locking account for {new_duration_seconds} seconds.")
-                # Use seconds for the unlock time calculation
-                unlock_time = now_utc + timedelta(seconds=new_duration_seconds)
-                
-                supabase_admin.table("account_locks").insert({
-                    "user_id": user_id,
-                    "unlock_at": unlock_time.isoformat(),
-                    "failed_attempts_count": failures.count
-                }).execute()
-                
-                supabase_admin.table("profiles").update({"is_locked": True}).eq("user_id", user_id).execute()
-            
-            # Return the new duration in seconds
-            return True, f'Account locked for {new_duration_seconds // 60} minutes.', new_duration_seconds
-            
+        await get_async_supabase_admin().table("login_attempts").insert(row).execute()
     except Exception as e:
-        print(f"Error in trigger_lock_if_needed: {e}")
-        
-    # Return 0 seconds if no lock was triggered
-    return False, "Invalid email or password", 0
\ No newline at end of file
+        log.warning("login_attempt_write_error", user_id=user_id, error=str(e))
+
+async def record_failed_login_async(user_id, email, ip_address, reason="Invalid credentials"):
+    """record_failed_login() for coroutines."""
+    attack_detector.observe(ip_address, email)
+    if not user_id:
+        user_id = await asyncio.to_thread(_account_for_failure, user_id, email)
+    return await get_lockout_backend().record_failed_login_async(user_id, email, ip_address, reason)
+
+async def clear_failed_attempts_async(user_id):
+    """clear_failed_attempts() for coroutines; the two writes are independent and run concurrently."""
+    get_lockout_backend().reset_failures(user_id)
+    audit_logger.discard_failures(user_id)
+
+    admin = get_async_supabase_admin()
+    await asyncio.gather(
+        admin.table("login_attempts").delete().eq("user_id", user_id).eq("success", False).execute(),
+        admin.table("profiles").update({"is_locked": False}).eq("user_id", user_id).execute(),
+    )
+    profile_cache.invalidate_user(user_id)
@@ -0,0 +1,30 @@
+"""
+Login answers for routes/async_handlers.py (which both serving modes use),
+kept out of the routes package. They return plain (payload, status, headers)
+values.
+"""
+from security_logic.attack_detector import attack_detector, flag_log_fields
+from observability.log import get_logger
+
+log = get_logger(__name__)
+
+
+def screen_login(email, remote_addr):
+    """The 429 answer when the attack detector refuses this login (see attack_detector.py), else None."""
+    flag = attack_detector.screen(remote_addr, email)
+    if flag is None:
+        return None
+    retry_after = attack_detector.retry_after()
+    log.info("login_refused", email=email, ip=remote_addr, **flag_log_fields(flag))
+    return {
+        'error': 'suspicious_activity',
+        'message': f'Too many failed logins. Please try again in {retry_after} seconds.',
+        'retry_after_seconds': retry_after
+    }, 429, {'Retry-After': str(retry_after)}
+
+def login_unavailable():
+    """The 503 payload for a login that cannot safely be decided right now."""
+    return {
+        'error': 'service_unavailable',
+        'message': 'Login is temporarily unavailable. Please try again shortly.'
+    }
@@ -0,0 +1,306 @@
+from database.supabase_client import get_supabase_admin
+from observability.metrics import registry
+from observability.log import get_logger
+from collections import OrderedDict
+import hashlib
+import math
+import os
+import threading
+import time
+
+PROFILE_CACHE_ENABLED = os.getenv("PROFILE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "50000"))
+PROFILE_CACHE_TTL_SECONDS = int(os.getenv("PROFILE_CACHE_TTL_SECONDS", "300"))
+# Exact "no such profile" answers (same spelling) for emails the Bloom filter could not rule out
+PROFILE_NEGATIVE_TTL_SECONDS = int(os.getenv("PROFILE_NEGATIVE_TTL_SECONDS", "60"))
+# How often the Bloom filter of known emails is rebuilt from the profiles table.
+# Accounts created by another worker process are only known here after the next rebuild.
+PROFILE_BLOOM_REFRESH_SECONDS = int(os.getenv("PROFILE_BLOOM_REFRESH_SECONDS", "300"))
+PROFILE_BLOOM_FP_RATE = float(os.getenv("PROFILE_BLOOM_FP_RATE", "0.01"))
+PROFILE_BLOOM_PAGE_SIZE = 1000
+
+log = get_logger(__name__)
+
+PROFILE_CACHE_LOOKUPS = registry.counter(
+    "profile_cache_lookups_total", "Profile cache lookups by key type and result.", ("kind", "result"))
+
+
+def _normalize_email(email):
+    # Case-folding can only add Bloom "maybe" answers, never hide a stored address
+    return email.strip().lower()
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on one BLAKE2b digest)."""
+
+    def __init__(self, expected_items, fp_rate=PROFILE_BLOOM_FP_RATE):
+        expected_items = max(expected_items, 1)
+        self.size = max(int(-expected_items * math.log(fp_rate) / (math.log(2) ** 2)), 64)
+        self.hashes = max(int(round(self.size / expected_items * math.log(2))), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class _TTLCache:
+    """Bounded LRU mapping with a per-entry expiry. Not thread-safe; the owner locks."""
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+
+    def get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, value, now):
+        self._entries[key] = (value, now + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        return self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ProfileCache:
+    """
+    Caches profile lookups for the login and file-access paths.
+
+    - email -> user_id and user_id -> profile, bounded LRU with a TTL
+    - a Bloom filter of every email in `profiles`, rebuilt in bulk in the
+      background; an email it does not contain definitely has no profile,
+      so lookups for unknown addresses never reach the database
+    - a short-lived exact negative cache for the Bloom filter's false positives;
+      an email whose signup is still being processed is never cached as unknown
+
+    Signups and profile changes made through this process update or drop
+    their entries immediately (remember_signup / invalidate_user). Other
+    processes learn of a new account on their next Bloom rebuild. Until then
+    its failed logins there are not counted towards a lockout, only by the
+    attack detector; a successful login still checks its lock (async_handlers.login).
+    """
+
+    def __init__(self, max_entries=PROFILE_CACHE_MAX_ENTRIES, ttl_seconds=PROFILE_CACHE_TTL_SECONDS,
+                 negative_ttl_seconds=PROFILE_NEGATIVE_TTL_SECONDS,
+                 bloom_refresh_seconds=PROFILE_BLOOM_REFRESH_SECONDS):
+        self._by_email = _TTLCache(max_entries, ttl_seconds)
+        self._by_user = _TTLCache(max_entries, ttl_seconds)
+        self._negative = _TTLCache(max_entries, negative_ttl_seconds)
+        self.bloom_refresh_seconds = bloom_refresh_seconds
+        self._bloom = None
+        self._bloom_built_at = 0.0
+        self._bloom_pending = set()   # emails added while a rebuild is running
+        self._building = False
+        self._signup_pending = None
+        self._lock = threading.Lock()
+
+    def track_pending_signups(self, check):
+        """`check(email)` is True while a signup for that email has no profile row yet (jobs/signup_jobs.py)."""
+        self._signup_pending = check
+
+    def _may_cache_unknown(self, email):
+        # The profile job of a new account may simply not have run yet
+        if self._signup_pending is None:
+            return True
+        try:
+            return not self._signup_pending(email)
+        except Exception:
+            return False
+
+    # --- Bloom filter ---
+    def _maybe_rebuild(self, now):
+        if self._building or now - self._bloom_built_at < self.bloom_refresh_seconds:
+            return
+        with self._lock:
+            if self._building or now - self._bloom_built_at < self.bloom_refresh_seconds:
+                return
+            self._building = True
+            self._bloom_pending = set()
+        threading.Thread(target=self.rebuild_bloom, name="profile-bloom", daemon=True).start()
+
+    def rebuild_bloom(self):
+        """Reads every profile email in pages and swaps in a fresh filter."""
+        try:
+            emails = []
+            last_user_id = None
+            while True:
+                query = get_supabase_admin().table("profiles").select("user_id, email")
+                if last_user_id is not None:
+                    query = query.gt("user_id", last_user_id)
+                rows = query.order("user_id").limit(PROFILE_BLOOM_PAGE_SIZE).execute().data
+                emails.extend(_normalize_email(r["email"]) for r in rows if r.get("email"))
+                if len(rows) < PROFILE_BLOOM_PAGE_SIZE:
+                    break
+                last_user_id = rows[-1]["user_id"]
+
+            # Leave room to grow until the next rebuild
+            bloom = BloomFilter(max(len(emails) * 2, 1024))
+            for email in emails:
+                bloom.add(email)
+            with self._lock:
+                for email in self._bloom_pending:
+                    bloom.add(email)
+                self._bloom = bloom
+                self._bloom_built_at = time.time()
+            log.info("profile_bloom_rebuilt", emails=len(emails), size_bytes=len(bloom._bits))
+        except Exception as e:
+            # Keep the previous filter (or none) and try again after the refresh interval
+            log.warning("profile_bloom_error", error=str(e))
+            with self._lock:
+                self._bloom_built_at = time.time()
+        finally:
+            with self._lock:
+                self._building = False
+                self._bloom_pending = set()
+
+    def definitely_unknown(self, email):
+        """True only when no profile can have this email (Bloom filter miss or cached negative)."""
+        if not PROFILE_CACHE_ENABLED or not email:
+            return False
+        now = time.time()
+        self._maybe_rebuild(now)
+        key = _normalize_email(email)
+        with self._lock:
+            if self._bloom is not None and key not in self._bloom:
+                PROFILE_CACHE_LOOKUPS.inc(kind="email", result="bloom_negative")
+                return True
+            if self._negative.get(email, now) is not None:
+                PROFILE_CACHE_LOOKUPS.inc(kind="email", result="negative")
+                return True
+        return False
+
+    # --- email -> user_id ---
+    def lookup_user_id(self, email, load):
+        """
+        Returns the user_id for an email, calling `load(email)` (the database query)
+        only when neither the cache nor the Bloom filter can answer.
+        """
+        if not PROFILE_CACHE_ENABLED:
+            return load(email)
+        if self.definitely_unknown(email):
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._by_email.get(email, now)
+        if entry is not None:
+            PROFILE_CACHE_LOOKUPS.inc(kind="email", result="hit")
+            return entry[0]
+
+        PROFILE_CACHE_LOOKUPS.inc(kind="email", result="miss")
+        user_id = load(email)
+        if not user_id and not self._may_cache_unknown(email):
+            return None
+        with self._lock:
+            if user_id:
+                self._by_email.put(email, user_id, now)
+            else:
+                self._negative.put(email, True, now)
+        return user_id
+
+    def remember_lookup(self, email, user_id):
+        """Records an email -> user_id answer obtained elsewhere (e.g. from login_security_check)."""
+        if not PROFILE_CACHE_ENABLED or not email:
+            return
+        if not user_id and not self._may_cache_unknown(email):
+            return
+        now = time.time()
+        with self._lock:
+            if user_id:
+                self._by_email.put(email, user_id, now)
+            else:
+                self._negative.put(email, True, now)
+
+    # --- user_id -> profile ---
+    def get_profile(self, user_id, load):
+        """Returns the profile dict for user_id (or None), using `load(user_id)` on a miss."""
+        if not PROFILE_CACHE_ENABLED:
+            return load(user_id)
+        now = time.time()
+        with self._lock:
+            entry = self._by_user.get(user_id, now)
+        if entry is not None:
+            PROFILE_CACHE_LOOKUPS.inc(kind="user", result="hit")
+            return entry[0]
+
+        PROFILE_CACHE_LOOKUPS.inc(kind="user", result="miss")
+        profile = load(user_id)
+        if profile is not None:
+            with self._lock:
+                self._by_user.put(user_id, profile, now)
+        return profile
+
+    # --- invalidation ---
+    def remember_signup(self, user_id, email, profile=None):
+        """A profile was just created or updated: make it visible to lookups right away."""
+        if not PROFILE_CACHE_ENABLED or not email:
+            return
+        now = time.time()
+        key = _normalize_email(email)
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(key)
+            if self._building:
+                self._bloom_pending.add(key)
+            self._negative.pop(email)
+            self._by_email.put(email, user_id, now)
+            self._by_user.pop(user_id)
+            if profile is not None:
+                self._by_user.put(user_id, profile, now)
+
+    def invalidate_user(self, user_id):
+        """Drops the cached profile for user_id (after is_locked or other profile changes)."""
+        if not PROFILE_CACHE_ENABLED:
+            return
+        with self._lock:
+            self._by_user.pop(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._by_email.clear()
+            self._by_user.clear()
+            self._negative.clear()
+            self._bloom = None
+            self._bloom_built_at = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": PROFILE_CACHE_ENABLED,
+                "emails": len(self._by_email),
+                "profiles": len(self._by_user),
+                "negatives": len(self._negative),
+                "bloom_items": self._bloom.count if self._bloom is not None else None,
+                "bloom_bytes": len(self._bloom._bits) if self._bloom is not None else 0,
+                "bloom_age_seconds": round(time.time() - self._bloom_built_at, 1) if self._bloom is not None else None,
+            }
+
+
+profile_cache = ProfileCache()
@@ -0,0 +1,154 @@
+from observability.metrics import registry
+from collections import OrderedDict
+import ipaddress
+import math
+import os
+import threading
+import time
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+# Prefix lengths that make up a "subnet" for the shared budget
+RATE_LIMIT_IPV4_PREFIX = int(os.getenv("RATE_LIMIT_IPV4_PREFIX", "24"))
+RATE_LIMIT_IPV6_PREFIX = int(os.getenv("RATE_LIMIT_IPV6_PREFIX", "64"))
+
+# "<requests>/<seconds>": bucket size and the time it takes to refill completely.
+# Each endpoint has one budget per client IP and one shared by its whole subnet.
+DEFAULT_LIMITS = {
+    "/api/login": ("20/60", "100/60"),
+    "/api/signup": ("5/300", "20/300"),
+    "/api/forgot-password": ("5/300", "20/300"),
+}
+
+RATE_LIMITED = registry.counter(
+    "rate_limited_total", "Requests rejected by the IP/subnet rate limiter.", ("endpoint", "scope"))
+
+
+def parse_limit(spec):
+    """'20/60' -> (20.0 tokens, 20/60 tokens per second). Empty or '0' disables the limit."""
+    if not spec or spec.strip() == "0":
+        return None
+    count, _, seconds = spec.partition("/")
+    capacity = float(count)
+    return capacity, capacity / float(seconds or 1)
+
+
+def _env_name(path):
+    return "RATE_LIMIT_" + path.rsplit("/", 1)[-1].upper().replace("-", "_")
+
+
+def _load_limits():
+    """Per-endpoint limits, overridable with e.g. RATE_LIMIT_LOGIN=20/60 and RATE_LIMIT_LOGIN_SUBNET=100/60."""
+    limits = {}
+    for path, (ip_default, subnet_default) in DEFAULT_LIMITS.items():
+        name = _env_name(path)
+        limits[path] = (parse_limit(os.getenv(name, ip_default)),
+                        parse_limit(os.getenv(f"{name}_SUBNET", subnet_default)))
+    return limits
+
+
+def subnet_of(ip):
+    """The /24 (IPv4) or /64 (IPv6) network an address belongs to, or None if it is not an IP."""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    prefix = RATE_LIMIT_IPV4_PREFIX if address.version == 4 else RATE_LIMIT_IPV6_PREFIX
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets keyed by (endpoint, scope, client), held in one bounded LRU.
+
+    Buckets are refilled lazily when touched; nothing runs in the background.
+    A bucket that has been idle long enough to refill completely is
+    indistinguishable from a new one, so it is dropped from the cold end of
+    the LRU as new buckets come in. When the table is full of active buckets
+    the least recently used one is evicted, which can only make a client's
+    budget more generous, never stricter.
+    """
+
+    def __init__(self, limits=None, max_buckets=RATE_LIMIT_MAX_BUCKETS):
+        self.limits = _load_limits() if limits is None else limits
+        self.max_buckets = max_buckets
+        self.rejected = 0
+        self.evictions = 0
+        self._buckets = OrderedDict()  # key -> [tokens, updated_at, capacity, refill_per_second]
+        self._lock = threading.Lock()
+
+    def _refill(self, bucket, now):
+        tokens, updated_at, capacity, rate = bucket
+        bucket[0] = min(capacity, tokens + (now - updated_at) * rate)
+        bucket[1] = now
+
+    def _bucket(self, key, limit, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._expire(now)
+            capacity, rate = limit
+            bucket = self._buckets[key] = [capacity, now, capacity, rate]
+        else:
+            self._buckets.move_to_end(key)
+            self._refill(bucket, now)
+        return bucket
+
+    def _expire(self, now):
+        # Drop a few fully refilled buckets from the cold end, then enforce the hard cap
+        for _ in range(2):
+            if not self._buckets:
+                return
+            key, (tokens, updated_at, capacity, rate) = next(iter(self._buckets.items()))
+            # updated_at == now: touched by the current check
+            if updated_at >= now or tokens + (now - updated_at) * rate < capacity:
+                break
+            del self._buckets[key]
+        while len(self._buckets) >= self.max_buckets:
+            self._buckets.popitem(last=False)
+            self.evictions += 1
+
+    def check(self, endpoint, ip):
+        """
+        Takes one token from the client's IP and subnet buckets for `endpoint`.
+        Returns (allowed, retry_after_seconds, scope); nothing is taken when either is empty.
+        """
+        if not RATE_LIMIT_ENABLED or endpoint not in self.limits or not ip:
+            return True, 0, None
+        ip_limit, subnet_limit = self.limits[endpoint]
+        checks = []
+        if ip_limit:
+            checks.append(("ip", (endpoint, "ip", ip), ip_limit))
+        subnet = subnet_of(ip)
+        if subnet_limit and subnet:
+            checks.append(("subnet", (endpoint, "subnet", subnet), subnet_limit))
+
+        now = time.monotonic()
+        with self._lock:
+            buckets = [(scope, self._bucket(key, limit, now)) for scope, key, limit in checks]
+            for scope, bucket in buckets:
+                if bucket[0] < 1:
+                    self.rejected += 1
+                    RATE_LIMITED.inc(endpoint=endpoint, scope=scope)
+                    return False, max(1, math.ceil((1 - bucket[0]) / bucket[3])), scope
+            for _, bucket in buckets:
+                bucket[0] -= 1
+        return True, 0, None
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": RATE_LIMIT_ENABLED,
+                "buckets": len(self._buckets),
+                "max_buckets": self.max_buckets,
+                "rejected": self.rejected,
+                "evictions": self.evictions,
+            }
+
+
+rate_limiter = TokenBucketLimiter()
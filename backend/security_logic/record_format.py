@@ -0,0 +1,151 @@
+"""
+How encrypted user_data rows are laid out in the database.
+
+    fernet      legacy: base64(Fernet token) in data_content, base64(salt) in salt
+    packed-v1   data_blob bytea = "BSSP" | version u8 | salt length u8 | salt
+                | (version 2 only: KDF params length u8 | KDF params, see kdf_params.py)
+                | raw Fernet token
+    envelope-v1 data_blob bytea = "BSSE" | version u8 | raw Fernet token under the user's
+                data key (see user_keys.py); there is no per-row salt
+    chunked-v1  streamed files, ciphertext in user_data_chunks (see chunked_cipher.py)
+
+A Fernet token is itself base64 text, so the legacy layout stores every byte
+of ciphertext base64-encoded twice. packed-v1 keeps the token's raw bytes and
+re-encodes them only in memory, right before Fernet.decrypt().
+
+fernet rows and version 1 packed blobs were always encrypted with LEGACY_KDF;
+records using any other KDF parameters are written as version 2.
+"""
+from database.supabase_client import to_bytea, from_bytea
+from security_logic.kdf_params import KDFParams, KDFParamsError, LEGACY_KDF
+import base64
+import os
+import struct
+
+FERNET_FORMAT = "fernet"
+PACKED_FORMAT = "packed-v1"
+ENVELOPE_FORMAT = "envelope-v1"
+CHUNKED_FORMAT = "chunked-v1"
+# Formats keyed by a password + per-row salt
+SALTED_FORMATS = (FERNET_FORMAT, PACKED_FORMAT)
+# Formats that hold one Fernet token (read through user_keys.decrypt_for_user())
+TOKEN_FORMATS = SALTED_FORMATS + (ENVELOPE_FORMAT,)
+
+# Layout for newly written rows. Set to "fernet" until docs/migrations/003_packed_user_data.sql has run.
+USER_DATA_STORAGE_FORMAT = os.getenv("USER_DATA_STORAGE_FORMAT", PACKED_FORMAT)
+
+PACKED_MAGIC = b"BSSP"
+PACKED_VERSION = 1
+PACKED_KDF_VERSION = 2
+_PACKED_HEADER = struct.Struct(">4sBB")
+ENVELOPE_MAGIC = b"BSSE"
+ENVELOPE_VERSION = 1
+_ENVELOPE_HEADER = struct.Struct(">4sB")
+
+
+class RecordFormatError(ValueError):
+    """A stored row does not match the layout its storage_format claims."""
+
+
+def pack_record(token: bytes, salt: bytes, kdf: KDFParams = LEGACY_KDF) -> bytes:
+    """Packs a Fernet token (as returned by Fernet.encrypt), its salt and KDF parameters into one binary blob."""
+    if kdf == LEGACY_KDF:
+        header = _PACKED_HEADER.pack(PACKED_MAGIC, PACKED_VERSION, len(salt)) + salt
+    else:
+        params = kdf.encode().encode('ascii')
+        header = _PACKED_HEADER.pack(PACKED_MAGIC, PACKED_KDF_VERSION, len(salt)) + salt + bytes([len(params)]) + params
+    return header + base64.urlsafe_b64decode(token)
+
+def unpack_record_kdf(blob: bytes) -> tuple[bytes, bytes, KDFParams]:
+    """Returns (fernet_token, salt, kdf_params) from a packed blob."""
+    if len(blob) < _PACKED_HEADER.size:
+        raise RecordFormatError("packed record is too short")
+    magic, version, salt_len = _PACKED_HEADER.unpack_from(blob)
+    if magic != PACKED_MAGIC:
+        raise RecordFormatError("not a packed record")
+    if version not in (PACKED_VERSION, PACKED_KDF_VERSION):
+        raise RecordFormatError(f"unsupported packed record version {version}")
+    salt_end = _PACKED_HEADER.size + salt_len
+    salt = blob[_PACKED_HEADER.size:salt_end]
+    if version == PACKED_VERSION:
+        return base64.urlsafe_b64encode(blob[salt_end:]), salt, LEGACY_KDF
+    if len(blob) <= salt_end:
+        raise RecordFormatError("packed record is too short")
+    params_end = salt_end + 1 + blob[salt_end]
+    try:
+        kdf = KDFParams.parse(blob[salt_end + 1:params_end].decode('ascii'))
+    except (KDFParamsError, UnicodeDecodeError) as e:
+        raise RecordFormatError(f"packed record has invalid KDF parameters: {e}")
+    return base64.urlsafe_b64encode(blob[params_end:]), salt, kdf
+
+def unpack_record(blob: bytes) -> tuple[bytes, bytes]:
+    """Returns (fernet_token, salt) from a packed blob."""
+    return unpack_record_kdf(blob)[:2]
+
+
+def pack_envelope(token: bytes) -> bytes:
+    """Packs a Fernet token made with a user's data key."""
+    return _ENVELOPE_HEADER.pack(ENVELOPE_MAGIC, ENVELOPE_VERSION) + base64.urlsafe_b64decode(token)
+
+def unpack_envelope(blob: bytes) -> bytes:
+    """Returns the Fernet token from a packed envelope record."""
+    if len(blob) < _ENVELOPE_HEADER.size:
+        raise RecordFormatError("envelope record is too short")
+    magic, version = _ENVELOPE_HEADER.unpack_from(blob)
+    if magic != ENVELOPE_MAGIC:
+        raise RecordFormatError("not an envelope record")
+    if version != ENVELOPE_VERSION:
+        raise RecordFormatError(f"unsupported envelope record version {version}")
+    return base64.urlsafe_b64encode(blob[_ENVELOPE_HEADER.size:])
+
+
+def encode_envelope_columns(token: bytes) -> dict:
+    """user_data columns for a record encrypted with the user's data key."""
+    return {
+        "storage_format": ENVELOPE_FORMAT,
+        "data_blob": to_bytea(pack_envelope(token)),
+        "data_content": None,
+        "salt": None,
+    }
+
+def encode_columns(token: bytes, salt: bytes, storage_format: str = None, kdf: KDFParams = LEGACY_KDF) -> dict:
+    """user_data columns for a new encrypted record, in the configured layout."""
+    storage_format = storage_format or USER_DATA_STORAGE_FORMAT
+    if storage_format == PACKED_FORMAT:
+        return {
+            "storage_format": PACKED_FORMAT,
+            "data_blob": to_bytea(pack_record(token, salt, kdf)),
+            "data_content": None,
+            "salt": None,
+        }
+    if storage_format != FERNET_FORMAT:
+        raise RecordFormatError(f"unknown storage format {storage_format}")
+    if kdf != LEGACY_KDF:
+        raise RecordFormatError("fernet rows cannot record KDF parameters; use packed-v1")
+    # No data_blob column is named, so "fernet" also works before migration 003 has run
+    return {
+        "data_content": base64.b64encode(token).decode('utf-8'),
+        "salt": base64.b64encode(salt).decode('utf-8'),
+    }
+
+def decode_record(row: dict) -> tuple[bytes, bytes, KDFParams]:
+    """
+    Returns (fernet_token, salt, kdf_params) from a user_data row in any token layout.
+    salt and kdf_params are None for envelope rows.
+    """
+    storage_format = row.get("storage_format") or FERNET_FORMAT
+    if storage_format == ENVELOPE_FORMAT:
+        if not row.get("data_blob"):
+            raise RecordFormatError("envelope record has no data_blob")
+        return unpack_envelope(from_bytea(row["data_blob"])), None, None
+    if storage_format == PACKED_FORMAT:
+        if not row.get("data_blob"):
+            raise RecordFormatError("packed record has no data_blob")
+        return unpack_record_kdf(from_bytea(row["data_blob"]))
+    if storage_format == FERNET_FORMAT:
+        return base64.b64decode(row["data_content"]), base64.b64decode(row["salt"]), LEGACY_KDF
+    raise RecordFormatError(f"storage format {storage_format} does not hold a single token")
+
+def decode_columns(row: dict) -> tuple[bytes, bytes]:
+    """Returns (fernet_token, salt) from a user_data row in any token layout; salt is None for envelope rows."""
+    return decode_record(row)[:2]
@@ -0,0 +1,176 @@
+from database.supabase_client import get_supabase, SUPABASE_URL
+from database.profile_store import fetch_profile, set_tokens_valid_after
+from database.resilience import degraded_mode, FAIL_CLOSED
+from security_logic.profile_cache import profile_cache
+from observability.log import get_logger
+from datetime import datetime, timezone
+import jwt
+import os
+import threading
+import time
+
+# Legacy Supabase projects sign access tokens with this shared HS256 secret
+# (Project Settings -> API -> JWT Secret). Projects using asymmetric signing
+# keys are verified against the JWKS published by the auth server instead.
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+JWKS_CACHE_SECONDS = int(os.getenv("JWKS_CACHE_SECONDS", "600"))
+# How long a revocation is remembered in process; should be at least the access token lifetime.
+TOKEN_REVOCATION_TTL_SECONDS = int(os.getenv("TOKEN_REVOCATION_TTL_SECONDS", "3600"))
+# Ask the auth server when a token cannot be verified locally (no secret, unknown key, ...).
+TOKEN_REMOTE_FALLBACK = os.getenv("TOKEN_REMOTE_FALLBACK", "true").lower() in ("1", "true", "yes")
+
+_ASYMMETRIC_ALGORITHMS = ("RS256", "ES256")
+
+log = get_logger(__name__)
+
+
+class TokenError(Exception):
+    """The token is definitely not acceptable (bad signature, expired, wrong audience, revoked)."""
+
+
+class _Inconclusive(Exception):
+    """Local verification cannot decide; the auth server has to be asked."""
+
+
+class VerifiedToken:
+    def __init__(self, user_id, claims, verified_locally):
+        self.user_id = user_id
+        self.claims = claims
+        self.verified_locally = verified_locally
+
+
+class TokenVerifier:
+    """
+    Verifies Supabase access tokens without a round trip to the auth server.
+
+    HS256 tokens are checked against SUPABASE_JWT_SECRET, RS256/ES256 tokens
+    against the project's JWKS (cached for JWKS_CACHE_SECONDS). Expiry and
+    audience are always enforced. Only when local verification is
+    inconclusive does it fall back to auth.get_user().
+
+    Revocations (revoke_user_tokens) apply at once in the revoking process and
+    are stored in profiles.tokens_valid_after for the others, which read it
+    with the cached profile: there they apply within PROFILE_CACHE_TTL_SECONDS.
+    """
+
+    def __init__(self, secret=SUPABASE_JWT_SECRET, audience=SUPABASE_JWT_AUDIENCE,
+                 jwks_url=None, remote_fallback=TOKEN_REMOTE_FALLBACK):
+        self.secret = secret
+        self.audience = audience
+        self.remote_fallback = remote_fallback
+        self.jwks_url = jwks_url or (f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json" if SUPABASE_URL else None)
+        self._jwks_client = None
+        self._jwks_lock = threading.Lock()
+        self._revoked = {}  # user_id -> (revoked_at, forget_at)
+        self._lock = threading.Lock()
+        self.local_verifications = 0
+        self.remote_verifications = 0
+
+    def _signing_key(self, token, alg):
+        if alg == "HS256":
+            if not self.secret:
+                raise _Inconclusive("no JWT secret configured")
+            return self.secret
+        if alg in _ASYMMETRIC_ALGORITHMS:
+            if not self.jwks_url:
+                raise _Inconclusive("no JWKS URL configured")
+            if self._jwks_client is None:
+                with self._jwks_lock:
+                    if self._jwks_client is None:
+                        self._jwks_client = jwt.PyJWKClient(self.jwks_url, cache_jwk_set=True,
+                                                            lifespan=JWKS_CACHE_SECONDS)
+            try:
+                return self._jwks_client.get_signing_key_from_jwt(token).key
+            except jwt.PyJWKClientError as e:
+                # Unknown kid or the JWKS endpoint is unreachable
+                raise _Inconclusive(str(e))
+        raise _Inconclusive(f"unsupported algorithm {alg}")
+
+    def verify_locally(self, token):
+        """Returns the token's claims, or raises TokenError / _Inconclusive."""
+        try:
+            alg = jwt.get_unverified_header(token).get("alg")
+        except jwt.InvalidTokenError as e:
+            raise TokenError(f"malformed token: {e}")
+
+        key = self._signing_key(token, alg)
+        try:
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=[alg],
+                audience=self.audience,
+                options={"require": ["exp", "sub"]},
+            )
+        except jwt.InvalidTokenError as e:
+            raise TokenError(str(e))
+        self.local_verifications += 1
+        return claims
+
+    def _verify_remotely(self, token):
+        self.remote_verifications += 1
+        try:
+            user_res = get_supabase().auth.get_user(token)
+        except Exception as e:
+            if getattr(e, "status", None) in (401, 403):
+                raise TokenError(str(e))
+            raise
+        if not user_res or not user_res.user:
+            raise TokenError("auth server did not return a user")
+        return user_res.user.id
+
+    def verify(self, token):
+        """Returns a VerifiedToken or raises TokenError."""
+        try:
+            claims = self.verify_locally(token)
+            user_id = claims["sub"]
+            verified_locally = True
+        except _Inconclusive as e:
+            if not self.remote_fallback:
+                raise TokenError(f"cannot verify token locally: {e}")
+            user_id = self._verify_remotely(token)
+            # The auth server vouched for the token, so reading its claims is safe now
+            claims = jwt.decode(token, options={"verify_signature": False})
+            verified_locally = False
+
+        if self._is_revoked(user_id, claims.get("iat", 0)):
+            raise TokenError("token has been revoked")
+        return VerifiedToken(user_id, claims, verified_locally)
+
+    def revoke_user_tokens(self, user_id):
+        """Rejects the user's tokens issued before now (e.g. after a password reset), in every process."""
+        now = time.time()
+        with self._lock:
+            self._revoked[user_id] = (int(now), now + TOKEN_REVOCATION_TTL_SECONDS)
+            # Lazily drop revocations that have outlived every token they could match
+            for stale in [uid for uid, (_, forget_at) in self._revoked.items() if forget_at <= now]:
+                del self._revoked[stale]
+        try:
+            set_tokens_valid_after(user_id, datetime.fromtimestamp(int(now), timezone.utc))
+        except Exception as e:
+            # Still revoked here; other processes keep accepting the tokens until they expire
+            log.warning("token_revocation_not_shared", user_id=user_id, error=str(e))
+        profile_cache.invalidate_user(user_id)
+
+    def _is_revoked(self, user_id, issued_at):
+        with self._lock:
+            entry = self._revoked.get(user_id)
+        if entry is not None:
+            revoked_at, forget_at = entry
+            if time.time() < forget_at and issued_at < revoked_at:
+                return True
+        try:
+            profile = profile_cache.get_profile(user_id, fetch_profile)
+        except Exception as e:
+            if degraded_mode("token_revocation") == FAIL_CLOSED:
+                raise
+            log.warning("degraded_fail_open", caller="token_revocation", error=str(e))
+            return False
+        valid_after = (profile or {}).get("tokens_valid_after")
+        if not valid_after:
+            return False
+        return issued_at < datetime.fromisoformat(valid_after.replace('Z', '+00:00')).timestamp()
+
+
+token_verifier = TokenVerifier()
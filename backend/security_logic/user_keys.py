@@ -0,0 +1,332 @@
+"""
+Envelope encryption of user_data.
+
+Every user has one random data key that encrypts their records. It is stored
+only wrapped (AES-GCM) under a key derived from their password, in
+`user_keys`. Reading or writing any number of records costs one PBKDF2 run to
+unwrap it, and a password change re-wraps 32 bytes instead of rewriting data.
+
+Records from before this ('fernet' / 'packed-v1', one salt per row) stay
+readable. Whenever one is decrypted successfully it is re-encrypted under the
+data key in place, so they migrate lazily as users access them.
+
+The same goes for KDF parameters (kdf_params.py): a data key wrapped with
+anything but CURRENT_KDF is re-wrapped once the password has unlocked it, and
+with USER_DATA_ENVELOPE off, salted records are re-encrypted instead.
+
+A data key is only ever created from a password that has proven itself: it
+decrypted one of the user's records, or Supabase Auth accepted it at signup or
+login (the initial-data job, jobs/signup_jobs.py). Nothing here asks Auth
+about a password: that would let anyone holding an access token guess it past
+the login's lockout, rate limits and audit trail.
+"""
+from database.supabase_client import get_supabase_admin
+from database.user_key_store import load_user_key, load_user_key_async, insert_user_key, update_user_key
+from database.profile_store import fetch_profile
+from security_logic.data_encryptor import (
+    decrypt_data,
+    decrypt_many,
+    decrypt_with_data_key,
+    encrypt_many,
+    encrypt_with_data_key,
+    generate_data_key,
+    invalidate_cached_keys,
+    unwrap_data_key,
+    unwrap_data_key_async,
+    wrap_data_key,
+)
+from security_logic.record_format import (
+    decode_record,
+    encode_columns,
+    encode_envelope_columns,
+    FERNET_FORMAT,
+    SALTED_FORMATS,
+    USER_DATA_STORAGE_FORMAT,
+)
+from security_logic.kdf_params import CURRENT_KDF, LEGACY_KDF
+from security_logic.profile_cache import profile_cache
+from observability.metrics import registry
+from observability.log import get_logger
+from datetime import datetime, timezone
+import asyncio
+import os
+
+# New records use the user's data key. Needs docs/migrations/004_user_keys.sql.
+USER_DATA_ENVELOPE = os.getenv("USER_DATA_ENVELOPE", "true").lower() in ("1", "true", "yes")
+MIGRATION_PAGE_SIZE = 100
+# fernet rows have nowhere to record KDF parameters
+SALTED_WRITE_KDF = LEGACY_KDF if USER_DATA_STORAGE_FORMAT == FERNET_FORMAT else CURRENT_KDF
+
+log = get_logger(__name__)
+
+KDF_REHASHES = registry.counter(
+    "kdf_rehashes_total", "Data keys re-wrapped and records re-encrypted because their KDF parameters were outdated.",
+    ("kind",))
+
+
+class WrongPasswordError(Exception):
+    """The password does not unwrap the user's data key."""
+
+
+class DataKeyRewrapRequired(WrongPasswordError):
+    """
+    The data key is still wrapped under the password the user had before their last reset,
+    which was done without old_password (see /api/rewrap-data-key). Raised for any password
+    that does not unwrap the key, so it says nothing about the password itself.
+    """
+
+    def __init__(self):
+        super().__init__("Your data is still locked with your previous password. Send it together with "
+                         "your new one to /api/rewrap-data-key to unlock it.")
+
+
+class DataKeyNotReady(Exception):
+    """
+    The user has no data key yet and no records to check a password against. Their
+    initial-data job creates it, with a password Supabase Auth accepted at signup or login.
+    """
+
+    def __init__(self):
+        super().__init__("Your encrypted storage is not set up yet. Log in again to finish setting it up.")
+
+
+def _context(user_id):
+    return f"bss-user-key:{user_id}".encode()
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def _key_is_stale(user_id, stored):
+    """True if the data key was wrapped before the user's last password reset (migration 009)."""
+    changed_at = (profile_cache.get_profile(user_id, fetch_profile) or {}).get("password_changed_at")
+    if not changed_at or "wrapped_at" not in stored:
+        return False
+    return stored["wrapped_at"] is None or _parse_time(stored["wrapped_at"]) < _parse_time(changed_at)
+
+def _wrong_password(user_id, stored):
+    """The error for a password that does not unwrap the data key, telling a stale wrapping apart."""
+    try:
+        if _key_is_stale(user_id, stored):
+            return DataKeyRewrapRequired()
+    except Exception as e:
+        log.warning("key_staleness_check_error", user_id=user_id, error=str(e))
+    return WrongPasswordError()
+
+def unlock_data_key(user_id, password):
+    """
+    Returns the user's data key, or None if they do not have one yet. Raises WrongPasswordError,
+    or DataKeyRewrapRequired if the key is wrapped under the user's previous password.
+    """
+    stored = load_user_key(user_id)
+    if stored is None:
+        return None
+    data_key = unwrap_data_key(stored["wrapped_key"], password, stored["kdf_salt"], stored["kdf"],
+                               _context(user_id), cache_owner=user_id)
+    if data_key is None:
+        raise _wrong_password(user_id, stored)
+    if stored["kdf"] != CURRENT_KDF:
+        _rehash_data_key(user_id, password, data_key, stored)
+    return data_key
+
+async def unlock_data_key_async(user_id, password, stored=None):
+    """
+    unlock_data_key() for coroutines. `stored` may be the already loaded user_keys row
+    (load_user_key_async), so callers can fetch it alongside other queries.
+    """
+    if stored is None:
+        stored = await load_user_key_async(user_id)
+    if stored is None:
+        return None
+    data_key = await unwrap_data_key_async(stored["wrapped_key"], password, stored["kdf_salt"], stored["kdf"],
+                                           _context(user_id), cache_owner=user_id)
+    if data_key is None:
+        raise await asyncio.to_thread(_wrong_password, user_id, stored)
+    if stored["kdf"] != CURRENT_KDF:
+        await asyncio.to_thread(_rehash_data_key, user_id, password, data_key, stored)
+    return data_key
+
+def _rehash_data_key(user_id, password, data_key, stored):
+    """Re-wraps an unlocked data key with CURRENT_KDF. Best effort: the key is already unlocked."""
+    try:
+        wrapped, salt = wrap_data_key(data_key, password, _context(user_id), CURRENT_KDF)
+        if update_user_key(user_id, wrapped, salt, CURRENT_KDF, stored):
+            KDF_REHASHES.inc(kind="data-key")
+            log.info("data_key_rehashed", user_id=user_id, kdf_from=stored['kdf'].encode(), kdf_to=CURRENT_KDF.encode())
+    except Exception as e:
+        log.warning("data_key_rehash_error", user_id=user_id, error=str(e))
+
+def _create_data_key(user_id, password):
+    """Creates and stores the user's data key. The password must already be known to be right."""
+    data_key = generate_data_key()
+    wrapped, salt = wrap_data_key(data_key, password, _context(user_id), CURRENT_KDF)
+    insert_user_key(user_id, wrapped, salt, CURRENT_KDF)
+    stored = load_user_key(user_id)
+    if stored is not None and stored["wrapped_key"] == wrapped:
+        log.info("data_key_created", user_id=user_id)
+        return data_key
+    # Another request created one first: use that one
+    return unlock_data_key(user_id, password)
+
+def _password_matches_salted_records(user_id, password):
+    """Whether the password decrypts one of the user's per-row-salt records; None if they have none."""
+    rows = get_supabase_admin().table("user_data") \
+                .select("data_content, salt, data_blob, storage_format") \
+                .eq("user_id", user_id) \
+                .in_("storage_format", list(SALTED_FORMATS)) \
+                .limit(1) \
+                .execute().data
+    if not rows:
+        return None
+    token, salt, kdf = decode_record(rows[0])
+    return decrypt_data(token, password, salt, cache_owner=user_id, kdf=kdf) is not None
+
+def data_key_for_write(user_id, password, password_verified=False):
+    """
+    The data key to encrypt new data with, created on first use.
+    Raises WrongPasswordError if the password does not match the user's existing key or,
+    for a user without one, their existing records. For a user with neither, only a
+    password the caller has verified (password_verified) can create the key;
+    otherwise DataKeyNotReady is raised.
+    """
+    data_key = unlock_data_key(user_id, password)
+    if data_key is not None:
+        return data_key
+    matches = _password_matches_salted_records(user_id, password)
+    if matches is None:
+        if not password_verified:
+            raise DataKeyNotReady()
+        matches = True
+    if not matches:
+        raise WrongPasswordError()
+    return _create_data_key(user_id, password)
+
+
+def encrypt_for_user(user_id, password, items, password_verified=False):
+    """Encrypts strings for new user_data rows. Returns one column dict per item."""
+    if not USER_DATA_ENVELOPE:
+        tokens, salt = encrypt_many(items, password, SALTED_WRITE_KDF)
+        return [encode_columns(token, salt, kdf=SALTED_WRITE_KDF) for token in tokens]
+    data_key = data_key_for_write(user_id, password, password_verified)
+    return [encode_envelope_columns(token) for token in encrypt_with_data_key(items, data_key)]
+
+def decrypt_for_user(user_id, password, rows):
+    """
+    Decrypts user_data rows in any token layout. Returns strings in row order,
+    None where the password is wrong. Rows need data_id, storage_format and
+    updated_at for the lazy migration (or KDF upgrade) of salted records.
+    Raises DataKeyRewrapRequired rather than failing every envelope row.
+    """
+    decoded = [decode_record(row) for row in rows]
+    results = [None] * len(rows)
+    envelope = [i for i, (_, salt, _) in enumerate(decoded) if salt is None]
+    salted = [i for i, (_, salt, _) in enumerate(decoded) if salt is not None]
+
+    data_key = None
+    if envelope:
+        try:
+            data_key = unlock_data_key(user_id, password)
+        except DataKeyRewrapRequired:
+            raise
+        except WrongPasswordError:
+            data_key = None
+        if data_key is not None:
+            plaintexts = decrypt_with_data_key([decoded[i][0] for i in envelope], data_key)
+            for i, text in zip(envelope, plaintexts):
+                results[i] = text
+
+    if salted:
+        plaintexts = decrypt_many([decoded[i] for i in salted], password, cache_owner=user_id)
+        for i, text in zip(salted, plaintexts):
+            results[i] = text
+        if USER_DATA_ENVELOPE:
+            _migrate_salted(user_id, password, [(rows[i], results[i]) for i in salted if results[i] is not None],
+                            data_key)
+        else:
+            _rehash_salted(user_id, password, [(rows[i], results[i]) for i in salted
+                                               if results[i] is not None and decoded[i][2] != SALTED_WRITE_KDF])
+    return results
+
+def _replace_row(row, columns):
+    """
+    Rewrites a record's ciphertext, only if nobody rewrote the row since it was read
+    (every write to a record sets its updated_at).
+    """
+    query = get_supabase_admin().table("user_data") \
+                .update({**columns, "updated_at": datetime.now(timezone.utc).isoformat()}) \
+                .eq("data_id", row["data_id"]) \
+                .eq("storage_format", row["storage_format"])
+    if row.get("updated_at") is None:
+        query = query.is_("updated_at", "null")
+    else:
+        query = query.eq("updated_at", row["updated_at"])
+    return bool(query.execute().data)
+
+def _rehash_salted(user_id, password, decrypted):
+    """Re-encrypts already decrypted salted records with SALTED_WRITE_KDF (one derivation). Best effort."""
+    if not decrypted:
+        return
+    try:
+        tokens, salt = encrypt_many([text for _, text in decrypted], password, SALTED_WRITE_KDF)
+        for (row, _), token in zip(decrypted, tokens):
+            if _replace_row(row, encode_columns(token, salt, kdf=SALTED_WRITE_KDF)):
+                KDF_REHASHES.inc(kind="record")
+        log.info("records_rehashed", user_id=user_id, count=len(decrypted), kdf=SALTED_WRITE_KDF.encode())
+    except Exception as e:
+        log.warning("records_rehash_error", user_id=user_id, error=str(e))
+
+def _migrate_salted(user_id, password, decrypted, data_key=None):
+    """Re-encrypts already decrypted salted records under the data key. Best effort: the read has succeeded."""
+    if not decrypted:
+        return
+    try:
+        if data_key is None:
+            # The password has just decrypted these records, so it is safe to create the key with it
+            data_key = unlock_data_key(user_id, password) or _create_data_key(user_id, password)
+        tokens = encrypt_with_data_key([text for _, text in decrypted], data_key)
+        for (row, _), token in zip(decrypted, tokens):
+            _replace_row(row, encode_envelope_columns(token))
+        log.info("records_migrated", user_id=user_id, count=len(decrypted), to="envelope")
+    except WrongPasswordError:
+        log.info("records_not_migrated", user_id=user_id, reason="data key is wrapped under a different password")
+    except Exception as e:
+        log.warning("records_migration_error", user_id=user_id, error=str(e))
+
+
+def rewrap_data_key(user_id, old_password, new_password):
+    """
+    Re-wraps the user's data key under new_password after a password change, and moves any
+    remaining salted records (still encrypted with old_password) under the data key.
+    Returns False if the user has no data key. Raises WrongPasswordError if old_password is wrong.
+    """
+    stored = load_user_key(user_id)
+    if stored is None:
+        return False
+    data_key = unwrap_data_key(stored["wrapped_key"], old_password, stored["kdf_salt"], stored["kdf"],
+                               _context(user_id))
+    if data_key is None:
+        raise WrongPasswordError()
+
+    # Records the old password can still open would be lost once it is gone
+    last_id = None
+    while True:
+        query = get_supabase_admin().table("user_data") \
+                    .select("data_id, data_content, salt, data_blob, storage_format, updated_at") \
+                    .eq("user_id", user_id) \
+                    .in_("storage_format", list(SALTED_FORMATS))
+        if last_id is not None:
+            query = query.gt("data_id", last_id)
+        rows = query.order("data_id").limit(MIGRATION_PAGE_SIZE).execute().data
+        if not rows:
+            break
+        plaintexts = decrypt_many([decode_record(row) for row in rows], old_password, cache_owner=user_id)
+        _migrate_salted(user_id, old_password, [(row, text) for row, text in zip(rows, plaintexts) if text is not None],
+                        data_key)
+        last_id = rows[-1]["data_id"]
+
+    wrapped, salt = wrap_data_key(data_key, new_password, _context(user_id), CURRENT_KDF)
+    if not update_user_key(user_id, wrapped, salt, CURRENT_KDF, stored, new_password=True):
+        raise RuntimeError("data key was re-wrapped concurrently")
+    invalidate_cached_keys(user_id)
+    log.info("data_key_rewrapped", user_id=user_id)
+    return True
@@ -0,0 +1,20 @@
+"""
+Production entry point: serves simple_server:app with pre-forked gunicorn workers.
+
+Usage (from the backend/ directory):
+    python serve.py [extra gunicorn options, e.g. --workers 8]
+
+Settings come from the environment (see gunicorn.conf.py and the README).
+For local development `python simple_server.py` still starts the Flask debug server.
+"""
+from gunicorn.app.wsgiapp import run
+import os
+import sys
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")
+
+
+if __name__ == '__main__':
+    print("🚀 Starting Basic Security System server...")
+    sys.argv = [sys.argv[0], "--config", CONFIG_PATH, *sys.argv[1:], "simple_server:app"]
+    run()
@@ -1,7 +1,16 @@
-from flask import Flask, render_template, send_from_directory, redirect
+from flask import Flask, render_template, send_from_directory, redirect, request, g
 from flask_cors import CORS
 from routes.auth_routes import auth_api
 from routes.data_routes import data_api
+from routes.record_routes import record_api
+from routes.metrics_routes import metrics_api, instrument_app
+from routes.static_routes import static_api, serve_page
+from routes.admin_routes import admin_api
+from jobs.job_queue import job_queue
+import lifecycle  # ordered shutdown of queues and pools at exit
+from database.resilience import start_budget, end_budget
+from observability.log import new_request_id, bind_request_id, unbind_request_id
+import os
 
 # Initialize Flask app
 app = Flask(
@@ -16,46 +25,90 @@ CORS(app)  # Enable CORS for frontend
 app.register_blueprint(auth_api)
 # app.register_blueprint(data_api)
 app.register_blueprint(data_api)
+app.register_blueprint(record_api)
+app.register_blueprint(metrics_api)
+app.register_blueprint(static_api)
+app.register_blueprint(admin_api)
+instrument_app(app)
+
+@app.before_request
+def start_background_work():
+    """
+    Picks up background jobs left over from a previous run. Started on the first
+    request instead of at import so a preloading server (serve.py) never forks
+    while worker threads are running.
+    """
+    job_queue.start()
+
+@app.before_request
+def bind_request_id_to_logs():
+    """Tags every log line of this request with its X-Request-ID (the caller's, or a new one)."""
+    g.request_id = new_request_id(request.headers.get('X-Request-ID'))
+    g.request_id_token = bind_request_id(g.request_id)
+
+@app.after_request
+def echo_request_id(response):
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+@app.before_request
+def start_request_budget():
+    """All Supabase calls made for this request share one deadline (database/resilience.py)."""
+    view = app.view_functions.get(request.endpoint)
+    if not getattr(view, 'no_request_budget', False):
+        g.budget_token = start_budget()
+
+@app.teardown_request
+def end_request_budget(error=None):
+    token = g.pop('budget_token', None)
+    if token is not None:
+        end_budget(token)
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        unbind_request_id(token)
 
 # --- Routes to Serve HTML Pages ---
 @app.route('/')
 def serve_root():
     """Serves the login page as the root."""
-    return render_template('login.html')
+    return serve_page('login.html')
 
 @app.route('/signup')
 def serve_signup():
     """Serves the signup page."""
-    return render_template('signup-direct.html')
+    return serve_page('signup-direct.html')
 
 @app.route('/forgot-password')
 def serve_forgot_password():
     """Serves the forgot password page."""
-    return render_template('forgot-password.html')
+    return serve_page('forgot-password.html')
 
 @app.route('/reset-password')
 def serve_reset_password():
     """Serves the reset password page."""
-    return render_template('reset-password.html')
+    return serve_page('reset-password.html')
 
 @app.route('/homepage')
 def serve_homepage():
     """Serves the main homepage."""
-    return render_template('homepage.html')
+    return serve_page('homepage.html')
 
 @app.route('/account-info')
 def serve_account_info():
     """Serves the account info page."""
-    return render_template('index.html')
+    return serve_page('index.html')
 
 @app.route('/api/confirm-email') 
 def handle_email_confirm():
     """Serves the confirmation success page."""
-    return render_template('confirm-email.html')
+    return serve_page('confirm-email.html')
 
-# --- Main execution ---
+# --- Main execution (development server; use serve.py in production) ---
 if __name__ == '__main__':
-    print("🚀 Starting Basic Security System server...")
+    print("🚀 Starting Basic Security System development server...")
     print("📡 Server will run on http://localhost:5000")
     print("🔗 Root '/' serves the login page.")
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    print("⚠️ Single process: run `python serve.py` for production.")
+    job_queue.start()
+    app.run(debug=os.getenv("FLASK_DEBUG", "true").lower() in ("1", "true", "yes"), host='0.0.0.0', port=5000)
@@ -0,0 +1,12 @@
+"""
+Shared test setup. The modules import each other as top-level packages
+(`from security_logic...`), the way the servers run them from backend/.
+"""
+import os
+import sys
+
+# Derive keys inline instead of on a process pool, and keep the log free of the email-key warning
+os.environ.setdefault("KDF_EXECUTOR_WORKERS", "0")
+os.environ.setdefault("LOG_EMAILS", "omit")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
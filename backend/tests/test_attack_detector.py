@@ -0,0 +1,172 @@
+import pytest
+
+from security_logic import attack_detector as attack_detector_module
+from security_logic.attack_detector import AttackDetector, CountMinSketch, Flag, _positions
+
+# Slices start at multiples of their length; T0 is the start of one
+T0 = 1_700_000_040.0
+
+
+@pytest.fixture(autouse=True)
+def no_replay(monkeypatch):
+    # check() would otherwise start reading login_attempts from Supabase
+    monkeypatch.setattr(attack_detector_module, "ATTACK_DETECTOR_REPLAY", False)
+
+
+def _detector(ip=5, subnet=0, username=0, window=600, slices=10):
+    return AttackDetector(window_seconds=window, slices=slices, width=256, depth=4, top_k=5,
+                          thresholds={"ip": ip, "subnet": subnet, "username": username})
+
+
+# --- CountMinSketch ---
+def test_sketch_counts_exactly_without_collisions():
+    sketch = CountMinSketch(1024, 4)
+    a, b = _positions("a", 1024, 4), _positions("b", 1024, 4)
+    for _ in range(7):
+        sketch.add(a)
+    sketch.add(b, count=3)
+    assert sketch.estimate(a) == 7
+    assert sketch.estimate(b) == 3
+    assert sketch.estimate(_positions("c", 1024, 4)) == 0
+
+
+def test_sketch_never_undercounts():
+    sketch = CountMinSketch(8, 2)
+    counts = {f"key{i}": i % 5 + 1 for i in range(100)}
+    for key, count in counts.items():
+        for _ in range(count):
+            sketch.add(_positions(key, 8, 2))
+    assert all(sketch.estimate(_positions(key, 8, 2)) >= count for key, count in counts.items())
+
+
+def test_sketch_clear():
+    sketch = CountMinSketch(64, 3)
+    positions = _positions("a", 64, 3)
+    sketch.add(positions)
+    sketch.clear()
+    assert sketch.estimate(positions) == 0
+
+
+# --- AttackDetector ---
+def test_flag_is_raised_once_at_the_threshold():
+    detector = _detector(ip=5)
+    raised = [detector.observe("198.51.100.1", None, when=T0 + i) for i in range(8)]
+    assert [len(flags) for flags in raised] == [0, 0, 0, 0, 1, 0, 0, 0]
+    assert raised[4] == [Flag("ip", "198.51.100.1", 5, 5)]
+
+
+def test_check_below_and_at_the_threshold():
+    detector = _detector(ip=3)
+    for i in range(2):
+        detector.observe("198.51.100.1", None, when=T0 + i)
+    assert detector.check("198.51.100.1", None, now=T0 + 2) is None
+    detector.observe("198.51.100.1", None, when=T0 + 2)
+    assert detector.check("198.51.100.1", None, now=T0 + 2) == Flag("ip", "198.51.100.1", 3, 3)
+    assert detector.check("198.51.100.2", None, now=T0 + 2) is None
+
+
+def test_counts_expire_a_slice_at_a_time():
+    detector = _detector(ip=3, window=600, slices=10)
+    for i in range(3):
+        detector.observe("198.51.100.1", None, when=T0 + i)
+    assert detector.check("198.51.100.1", None, now=T0 + 500)
+    # Once the slice the failures landed in leaves the window, they no longer count
+    assert detector.check("198.51.100.1", None, now=T0 + 660) is None
+
+
+def test_reflag_waits_for_a_full_window():
+    detector = _detector(ip=2, window=600, slices=10)
+    assert not detector.observe("198.51.100.1", None, when=T0 + 58)
+    assert detector.observe("198.51.100.1", None, when=T0 + 59)
+    detector.observe("198.51.100.1", None, when=T0 + 590)
+    # The first slice has expired, so the count climbs through the threshold again:
+    # still the same attack, less than a window after it was flagged
+    assert not detector.observe("198.51.100.1", None, when=T0 + 600)
+    assert detector.check("198.51.100.1", None, now=T0 + 600).count == 2
+    # A burst after everything has expired is a new one
+    assert not detector.observe("198.51.100.1", None, when=T0 + 1200)
+    assert detector.observe("198.51.100.1", None, when=T0 + 1201)
+
+
+def test_spray_over_a_subnet_is_flagged():
+    detector = _detector(ip=5, subnet=10)
+    flags = []
+    for i in range(10):
+        flags += detector.observe(f"198.51.100.{i}", f"victim{i}@example.com", when=T0 + i)
+    assert flags == [Flag("subnet", "198.51.100.0/24", 10, 10)]
+    assert detector.check("198.51.100.200", "someone@example.com", now=T0 + 10).dimension == "subnet"
+
+
+def test_username_is_normalized():
+    detector = _detector(ip=0, username=3)
+    for i, email in enumerate(["Victim@Example.com", " victim@example.com", "VICTIM@EXAMPLE.COM"]):
+        detector.observe(f"192.0.2.{i}", email, when=T0 + i)
+    assert detector.check(None, "victim@example.com", now=T0 + 3) == Flag("username", "victim@example.com", 3, 3)
+
+
+def test_zero_threshold_never_flags():
+    detector = _detector(ip=0, subnet=0, username=0)
+    for i in range(50):
+        assert not detector.observe("198.51.100.1", "a@example.com", when=T0 + i)
+    assert detector.check("198.51.100.1", "a@example.com", now=T0 + 50) is None
+
+
+def test_old_observations_are_ignored():
+    detector = _detector(ip=2, window=600, slices=10)
+    detector.observe("198.51.100.1", None, when=T0 + 600)
+    # A replayed row from a slice that has already been reused
+    detector.observe("198.51.100.1", None, when=T0)
+    assert detector.check("198.51.100.1", None, now=T0 + 600) is None
+
+
+def test_top_and_flagged():
+    detector = _detector(ip=4)
+    for i in range(6):
+        detector.observe("198.51.100.1", None, when=T0 + i)
+    for i in range(2):
+        detector.observe("192.0.2.1", None, when=T0 + i)
+    assert detector.top(now=T0 + 10)["ip"] == [("198.51.100.1", 6), ("192.0.2.1", 2)]
+    assert detector.flagged(now=T0 + 10) == [Flag("ip", "198.51.100.1", 6, 4)]
+    assert detector.top(now=T0 + 1200)["ip"] == []
+
+
+def test_replay_counts_failures_only():
+    detector = _detector(ip=2)
+    rows = [
+        {"success": False, "ip_address": "198.51.100.1", "username_attempted": "a@example.com",
+         "timestamp": "2023-11-14T22:13:20Z"},
+        {"success": True, "ip_address": "198.51.100.1", "username_attempted": "a@example.com",
+         "timestamp": "2023-11-14T22:13:21Z"},
+        {"success": False, "ip_address": "198.51.100.1", "username_attempted": "b@example.com",
+         "timestamp": "2023-11-14T22:13:22+00:00"},
+    ]
+    raised = detector.replay(rows)
+    assert detector.replayed == 2
+    assert [flag.dimension for flag in raised] == ["ip"]
+
+
+def test_screen_respects_the_action(monkeypatch):
+    detector = _detector(ip=1)
+    detector.observe("198.51.100.1", None)
+    assert detector.screen("198.51.100.1", None).dimension == "ip"
+    monkeypatch.setattr(attack_detector_module, "ATTACK_DETECTOR_ACTION", "log")
+    assert detector.screen("198.51.100.1", None) is None
+
+
+# --- Logging ---
+def test_username_keys_are_logged_like_emails(monkeypatch):
+    from observability import log as log_module
+    monkeypatch.setattr(log_module, "LOG_EMAILS", "omit")
+    records = []
+    monkeypatch.setattr(attack_detector_module.log.logger, "log",
+                        lambda *args, **kwargs: records.append(kwargs["extra"]))
+    detector = _detector(ip=2, username=2)
+    for _ in range(2):
+        detector.observe("10.0.0.1", "Victim@Example.com", when=T0)
+
+    rendered = {}
+    for extra in records:
+        record = log_module.logging.makeLogRecord({"msg": "attack_suspected", **extra})
+        entry = log_module._record_dict(record)
+        rendered[entry["dimension"]] = entry["key"]
+    assert rendered == {"ip": "10.0.0.1", "username": None}
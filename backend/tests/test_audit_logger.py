@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+
+import pytest
+
+from security_logic.audit_logger import AuditLogger
+
+
+class FakeTable:
+    def __init__(self):
+        self.rows = []
+        self.down = False
+
+    def insert(self, rows):
+        if self.down:
+            raise ConnectionError("supabase down")
+        self.rows.extend(rows)
+
+
+@pytest.fixture
+def table():
+    return FakeTable()
+
+
+@pytest.fixture
+def audit(table, tmp_path):
+    audit = AuditLogger(insert_rows=table.insert, delete_failures=lambda user_id: None,
+                        batch_size=10, flush_interval=0.01, max_retries=0,
+                        spill_path=str(tmp_path / "spill.jsonl"))
+    yield audit
+    audit.drain(timeout=1)
+
+
+def _row(n):
+    return {"email": f"user{n}@example.com", "success": True}
+
+
+def test_spilled_rows_are_replayed_once_writes_succeed(audit, table):
+    table.down = True
+    audit._buffer.extend([_row(1), _row(2)])
+    audit.flush()
+    assert table.rows == [] and audit.spilled == 2
+
+    table.down = False
+    audit._buffer.append(_row(3))
+    audit.flush()
+    assert [r["email"] for r in table.rows] == ["user3@example.com", "user1@example.com", "user2@example.com"]
+    assert not os.path.exists(audit.spill_path)
+    assert not os.path.exists(audit.spill_path + ".replay")
+
+
+def test_unreadable_spill_lines_are_skipped(audit, table):
+    with open(audit.spill_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(_row(1)) + "\n" + '{"email": "trunc' + "\n" + json.dumps(_row(2)) + "\n")
+    audit._buffer.append(_row(3))
+    audit.flush()
+    assert [r["email"] for r in table.rows] == ["user3@example.com", "user1@example.com", "user2@example.com"]
+    assert not os.path.exists(audit.spill_path + ".replay")
+
+
+def test_replay_file_removed_by_someone_else_is_not_an_error(audit, table, monkeypatch):
+    with open(audit.spill_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(_row(1)) + "\n")
+    real_insert = table.insert
+
+    def insert_then_lose_file(rows):
+        real_insert(rows)
+        if os.path.exists(audit.spill_path + ".replay"):
+            os.remove(audit.spill_path + ".replay")
+    audit.insert_rows = insert_then_lose_file
+    audit._buffer.append(_row(2))
+    audit.flush()
+    assert len(table.rows) == 2
+
+
+def test_only_one_replay_runs_at_a_time(audit, table):
+    with open(audit.spill_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(_row(1)) + "\n")
+    started, release = threading.Event(), threading.Event()
+
+    def slow_insert(rows):
+        started.set()
+        release.wait(5)
+        table.insert(rows)
+    audit.insert_rows = slow_insert
+    replaying = threading.Thread(target=audit._replay_spill)
+    replaying.start()
+    assert started.wait(5)
+    audit._replay_spill()  # returns at once instead of replaying the same file again
+    release.set()
+    replaying.join(5)
+    assert len(table.rows) == 1
+
+
+def test_flusher_survives_a_failing_flush_and_is_restarted(audit, table, monkeypatch):
+    calls = []
+
+    def broken_flush():
+        calls.append(1)
+        raise OSError("spill file unreadable")
+    monkeypatch.setattr(audit, "flush", broken_flush)
+    audit.log(_row(1))
+    thread = audit._thread
+    thread.join(0.2)
+    assert thread.is_alive() and len(calls) >= 2
+    monkeypatch.undo()
+
+    # A flusher that died anyway (e.g. after a fork) is replaced by the next log()
+    audit._thread = threading.Thread(target=lambda: None)
+    audit._thread.start()
+    audit._thread.join()
+    audit.log(_row(2))
+    assert audit._thread.is_alive()
@@ -0,0 +1,165 @@
+import os
+import struct
+
+import pytest
+
+from security_logic import chunked_cipher
+from security_logic.chunked_cipher import (
+    HEADER_SIZE, KDF_DATA_KEY, KDF_PBKDF2_SHA256, KDF_SCRYPT, StreamFormatError,
+    decrypt_stream, encrypt_stream, is_chunked_format, read_header,
+)
+from security_logic.kdf_params import KDFParams
+
+DATA_KEY = bytes(range(32))
+CHUNK = 16
+
+
+def _encrypt(plaintext, chunk_size=CHUNK, **kwargs):
+    kwargs.setdefault("data_key", DATA_KEY)
+    return b"".join(encrypt_stream([plaintext], chunk_size=chunk_size, **kwargs))
+
+
+def _decrypt(stream, **kwargs):
+    kwargs.setdefault("data_key", DATA_KEY)
+    return b"".join(decrypt_stream([stream], **kwargs))
+
+
+def _frames(stream):
+    """(offset, length) of every frame after the header."""
+    frames, offset = [], HEADER_SIZE
+    while offset < len(stream):
+        (length,) = struct.unpack_from(">I", stream, offset)
+        frames.append((offset, 4 + length))
+        offset += 4 + length
+    return frames
+
+
+@pytest.mark.parametrize("size", [0, 1, CHUNK - 1, CHUNK, CHUNK + 1, 5 * CHUNK])
+def test_round_trip_with_data_key(size):
+    plaintext = os.urandom(size)
+    stream = _encrypt(plaintext)
+    assert is_chunked_format(stream)
+    assert _decrypt(stream) == plaintext
+
+
+def test_round_trip_from_uneven_input_chunks():
+    pieces = [b"a" * 5, b"", b"b" * 40, b"c"]
+    stream = b"".join(encrypt_stream(pieces, chunk_size=CHUNK, data_key=DATA_KEY))
+    # The ciphertext may arrive in any slicing too
+    sliced = [stream[i:i + 7] for i in range(0, len(stream), 7)]
+    assert b"".join(decrypt_stream(sliced, data_key=DATA_KEY)) == b"".join(pieces)
+
+
+def test_every_frame_is_at_most_one_chunk():
+    stream = _encrypt(os.urandom(3 * CHUNK + 3))
+    lengths = [length - 4 for _, length in _frames(stream)]
+    assert len(lengths) == 4
+    assert all(length <= CHUNK + chunked_cipher.TAG_SIZE for length in lengths)
+
+
+def test_round_trip_with_password():
+    kdf = KDFParams.pbkdf2(1000)
+    stream = _encrypt(b"secret file", kdf=kdf, password="correct horse", data_key=None)
+    assert read_header(stream)["kdf_id"] == KDF_PBKDF2_SHA256
+    assert read_header(stream)["kdf"] == kdf
+    assert _decrypt(stream, password="correct horse", data_key=None) == b"secret file"
+    with pytest.raises(StreamFormatError):
+        _decrypt(stream, password="wrong horse", data_key=None)
+
+
+def test_scrypt_parameters_survive_the_header():
+    kdf = KDFParams.scrypt(1 << 10, 8, 1)
+    stream = _encrypt(b"x" * 40, kdf=kdf, password="pw", data_key=None)
+    header = read_header(stream)
+    assert header["kdf_id"] == KDF_SCRYPT
+    assert header["kdf"] == kdf
+    assert _decrypt(stream, password="pw", data_key=None) == b"x" * 40
+
+
+def test_header_fields():
+    salt = b"s" * 16
+    header = read_header(_encrypt(b"abc", salt=salt, chunk_size=1024))
+    assert header["kdf_id"] == KDF_DATA_KEY
+    assert header["kdf"] is None
+    assert header["chunk_size"] == 1024
+    assert header["salt"] == salt
+
+
+def test_wrong_data_key_is_rejected():
+    stream = _encrypt(b"payload")
+    with pytest.raises(StreamFormatError):
+        _decrypt(stream, data_key=bytes(32))
+
+
+def test_missing_key_material_is_rejected():
+    with pytest.raises(StreamFormatError, match="data key"):
+        _decrypt(_encrypt(b"payload"), data_key=None, password="pw")
+    stream = _encrypt(b"payload", kdf=KDFParams.pbkdf2(1000), password="pw", data_key=None)
+    with pytest.raises(StreamFormatError, match="password"):
+        _decrypt(stream, data_key=DATA_KEY)
+
+
+@pytest.mark.parametrize("cut", [1, 4, 17])
+def test_truncated_final_frame_is_rejected(cut):
+    stream = _encrypt(os.urandom(3 * CHUNK))
+    with pytest.raises(StreamFormatError):
+        _decrypt(stream[:-cut])
+
+
+def test_dropped_final_frame_is_rejected():
+    stream = _encrypt(os.urandom(3 * CHUNK + 1))
+    last_offset, _ = _frames(stream)[-1]
+    with pytest.raises(StreamFormatError, match="truncated"):
+        _decrypt(stream[:last_offset])
+
+
+def test_reordered_frames_are_rejected():
+    stream = _encrypt(os.urandom(3 * CHUNK + 1))
+    (a, a_len), (b, b_len) = _frames(stream)[:2]
+    swapped = stream[:a] + stream[b:b + b_len] + stream[a:a + a_len] + stream[b + b_len:]
+    with pytest.raises(StreamFormatError, match="authentication failed"):
+        _decrypt(swapped)
+
+
+def test_flipped_ciphertext_bit_is_rejected():
+    stream = bytearray(_encrypt(os.urandom(2 * CHUNK)))
+    stream[HEADER_SIZE + 4] ^= 0x01
+    with pytest.raises(StreamFormatError, match="authentication failed"):
+        _decrypt(bytes(stream))
+
+
+def test_header_is_authenticated():
+    stream = bytearray(_encrypt(b"payload", chunk_size=1024))
+    # chunk_size is not used to find frames, so only the AEAD can notice the change
+    struct.pack_into(">I", stream, 10, 2048)
+    with pytest.raises(StreamFormatError, match="authentication failed"):
+        _decrypt(bytes(stream))
+
+
+def test_data_after_the_final_frame_is_rejected():
+    with pytest.raises(StreamFormatError, match="after the final frame"):
+        _decrypt(_encrypt(b"payload") + b"\x00")
+
+
+def test_oversized_frame_length_is_rejected():
+    stream = bytearray(_encrypt(b"payload"))
+    struct.pack_into(">I", stream, HEADER_SIZE, CHUNK + chunked_cipher.TAG_SIZE + 1)
+    with pytest.raises(StreamFormatError, match="invalid frame length"):
+        _decrypt(bytes(stream))
+
+
+@pytest.mark.parametrize("data, message", [
+    (b"BSSC", "shorter than its header"),
+    (b"XXXX" + bytes(HEADER_SIZE), "not a chunked stream"),
+])
+def test_bad_headers_are_rejected(data, message):
+    with pytest.raises(StreamFormatError, match=message):
+        read_header(data)
+
+
+def test_unknown_version_and_kdf_are_rejected():
+    stream = _encrypt(b"payload")
+    with pytest.raises(StreamFormatError, match="version"):
+        read_header(stream[:4] + b"\x09" + stream[5:])
+    with pytest.raises(StreamFormatError, match="KDF"):
+        read_header(stream[:5] + b"\x09" + stream[6:])
@@ -0,0 +1,56 @@
+import pytest
+
+from jobs.job_queue import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(path=str(tmp_path / "jobs.sqlite3"), workers=0, max_attempts=2)
+    queue.seen = []
+    queue.register("needs-secret", lambda payload, secrets: queue.seen.append(secrets["password"]))
+    return queue
+
+
+def _lose_secrets(queue):
+    """What a restart of the process that enqueued the jobs leaves behind."""
+    queue._secrets.clear()
+    queue.instance_id = "dead-process"
+
+
+def test_resume_hands_a_job_new_secrets(queue):
+    queue.enqueue("needs-secret", "job-1", {}, secrets={"password": "old"})
+    _lose_secrets(queue)
+    queue.instance_id = "restarted"
+    assert not queue.run_pending()  # still owned by the dead process
+
+    assert queue.resume("job-1", {"password": "new"})
+    assert queue.holds_secrets("job-1")
+    assert queue.run_pending()
+    assert queue.seen == ["new"]
+    assert queue.status("job-1") == "done"
+
+
+def test_resume_restarts_a_failed_job(queue):
+    queue.enqueue("needs-secret", "job-1", {}, secrets={"password": "pw"})
+    _lose_secrets(queue)
+    for _ in range(2):
+        with pytest.raises(KeyError):
+            queue.run_now("job-1")
+    assert queue.status("job-1") == "failed"
+
+    assert queue.resume("job-1", {"password": "pw"})
+    assert queue.run_now("job-1") == "done"
+
+
+def test_resume_leaves_finished_jobs_alone(queue):
+    queue.enqueue("needs-secret", "job-1", {}, secrets={"password": "pw"})
+    assert queue.run_now("job-1") == "done"
+    assert not queue.resume("job-1", {"password": "other"})
+    assert not queue.holds_secrets("job-1")
+    assert not queue.resume("missing", {"password": "pw"})
+
+
+def test_wait_returns_without_a_running_job(queue):
+    assert queue.wait("missing", timeout=5) is None
+    queue.enqueue("needs-secret", "job-1", {})
+    assert queue.wait("job-1", timeout=5) == "pending"
@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+from security_logic import lockout_manager
+from security_logic.profile_cache import BloomFilter, ProfileCache
+
+
+class RecordingBackend(lockout_manager.LockoutBackend):
+    def __init__(self):
+        self.failures = []
+
+    def check_lock_status(self, user_id):
+        return False, "Not locked.", 0
+
+    def record_failure(self, user_id, email):
+        return False, "Invalid email or password", 0
+
+    def record_failed_login(self, user_id, email, ip_address, reason):
+        self.failures.append(user_id)
+        return False, "Invalid email or password", 0
+
+
+class NoDetector:
+    def observe(self, ip, email):
+        pass
+
+
+@pytest.fixture
+def profiles(monkeypatch):
+    """Known emails -> user_id, counting every profile query."""
+    known = {"alice@example.com": "user-alice"}
+    queries = []
+
+    def query_user_id(email):
+        queries.append(email)
+        return known.get(email)
+
+    cache = ProfileCache()
+    bloom = BloomFilter(1024)
+    bloom.add("alice@example.com")
+    cache._bloom, cache._bloom_built_at = bloom, time.time()
+    backend = RecordingBackend()
+    monkeypatch.setattr(lockout_manager, "profile_cache", cache)
+    monkeypatch.setattr(lockout_manager, "_query_user_id", query_user_id)
+    monkeypatch.setattr(lockout_manager, "attack_detector", NoDetector())
+    lockout_manager.set_lockout_backend(backend)
+    yield known, queries, cache, backend
+    lockout_manager.set_lockout_backend(None)
+
+
+def _failed_login(email):
+    user_id, _, _, _ = lockout_manager.resolve_login_state(email)
+    return lockout_manager.record_failed_login(user_id, email, "10.0.0.1")
+
+
+def test_unknown_email_failures_make_no_profile_queries(profiles):
+    _, queries, _, backend = profiles
+    for _ in range(20):
+        _failed_login("nobody@example.com")
+    assert queries == []
+    assert backend.failures == [None] * 20
+
+
+def test_bloom_false_positive_is_queried_once(profiles):
+    _, queries, cache, _ = profiles
+    cache._bloom.add("ghost@example.com")
+    for _ in range(5):
+        _failed_login("ghost@example.com")
+    assert queries == ["ghost@example.com"]
+
+
+def test_known_account_failures_are_counted(profiles):
+    _, queries, _, backend = profiles
+    for _ in range(3):
+        _failed_login("alice@example.com")
+    assert backend.failures == ["user-alice"] * 3
+    assert queries == ["alice@example.com"]
+
+
+def test_signup_still_queued_is_looked_up_again(profiles):
+    known, queries, cache, backend = profiles
+    cache._bloom.add("new@example.com")
+    cache.track_pending_signups(lambda email: email == "new@example.com")
+    user_id, _, _, _ = lockout_manager.resolve_login_state("new@example.com")
+    assert user_id is None
+    known["new@example.com"] = "user-new"  # its profile job ran in the meantime
+    lockout_manager.record_failed_login(user_id, "new@example.com", "10.0.0.1")
+    assert backend.failures == ["user-new"]
+    assert queries == ["new@example.com"] * 2
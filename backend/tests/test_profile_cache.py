@@ -0,0 +1,228 @@
+import pytest
+
+from security_logic import profile_cache as profile_cache_module
+from security_logic.profile_cache import BloomFilter, ProfileCache, _TTLCache
+
+# Never starts a background Bloom rebuild on its own
+NO_REFRESH = 10 ** 12
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class FakeProfiles:
+    """Answers the paged `profiles` query that rebuild_bloom() makes."""
+
+    def __init__(self, emails):
+        self.rows = [{"user_id": f"{i:08d}", "email": email} for i, email in enumerate(emails)]
+        self.queries = 0
+
+    def table(self, name):
+        assert name == "profiles"
+        self.queries += 1
+        self._after = None
+        return self
+
+    def select(self, columns):
+        return self
+
+    def gt(self, column, value):
+        self._after = value
+        return self
+
+    def order(self, column):
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def execute(self):
+        rows = [r for r in self.rows if self._after is None or r["user_id"] > self._after]
+        self.data = rows[:self._limit]
+        return self
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(profile_cache_module, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def cache(clock):
+    return ProfileCache(max_entries=100, ttl_seconds=300, negative_ttl_seconds=60, bloom_refresh_seconds=NO_REFRESH)
+
+
+def _build_bloom(monkeypatch, cache, emails, page_size=1000):
+    profiles = FakeProfiles(emails)
+    monkeypatch.setattr(profile_cache_module, "get_supabase_admin", lambda: profiles)
+    monkeypatch.setattr(profile_cache_module, "PROFILE_BLOOM_PAGE_SIZE", page_size)
+    cache.rebuild_bloom()
+    return profiles
+
+
+# --- BloomFilter ---
+def test_bloom_has_no_false_negatives():
+    bloom = BloomFilter(1000, fp_rate=0.01)
+    items = [f"user{i}@example.com" for i in range(1000)]
+    for item in items:
+        bloom.add(item)
+    assert bloom.count == 1000
+    assert all(item in bloom for item in items)
+
+
+def test_bloom_false_positive_rate_is_near_target():
+    bloom = BloomFilter(1000, fp_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"user{i}@example.com")
+    false_positives = sum(f"other{i}@example.org" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_empty_bloom_contains_nothing():
+    bloom = BloomFilter(0)
+    assert bloom.size >= 64 and bloom.hashes >= 1
+    assert "anyone@example.com" not in bloom
+
+
+# --- _TTLCache ---
+def test_ttl_cache_expires_entries():
+    ttl = _TTLCache(max_entries=10, ttl_seconds=5)
+    ttl.put("a", 1, now=100)
+    assert ttl.get("a", now=104.9) == (1, 105)
+    assert ttl.get("a", now=105) is None
+    assert len(ttl) == 0
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    ttl = _TTLCache(max_entries=2, ttl_seconds=60)
+    ttl.put("a", 1, now=0)
+    ttl.put("b", 2, now=0)
+    ttl.get("a", now=1)
+    ttl.put("c", 3, now=2)
+    assert ttl.get("b", now=3) is None
+    assert ttl.get("a", now=3)[0] == 1
+    assert ttl.get("c", now=3)[0] == 3
+
+
+def test_ttl_cache_put_refreshes_expiry_and_pop_removes():
+    ttl = _TTLCache(max_entries=10, ttl_seconds=5)
+    ttl.put("a", 1, now=0)
+    ttl.put("a", 2, now=4)
+    assert ttl.get("a", now=8) == (2, 9)
+    assert ttl.pop("a") == (2, 9)
+    assert ttl.pop("a") is None
+
+
+# --- ProfileCache ---
+def test_lookup_caches_hits_until_ttl(cache, clock):
+    calls = []
+    load = lambda email: calls.append(email) or "user-1"
+    assert cache.lookup_user_id("a@example.com", load) == "user-1"
+    assert cache.lookup_user_id("a@example.com", load) == "user-1"
+    assert len(calls) == 1
+    clock.now += 301
+    assert cache.lookup_user_id("a@example.com", load) == "user-1"
+    assert len(calls) == 2
+
+
+def test_unknown_email_is_cached_negative_for_its_own_ttl(cache, clock):
+    calls = []
+    load = lambda email: calls.append(email) or None
+    assert cache.lookup_user_id("ghost@example.com", load) is None
+    assert cache.definitely_unknown("ghost@example.com")
+    assert cache.lookup_user_id("ghost@example.com", load) is None
+    assert len(calls) == 1
+    clock.now += 61
+    assert not cache.definitely_unknown("ghost@example.com")
+
+
+def test_pending_signup_is_never_cached_unknown(cache):
+    cache.track_pending_signups(lambda email: email == "new@example.com")
+    calls = []
+    load = lambda email: calls.append(email) or None
+    cache.lookup_user_id("new@example.com", load)
+    cache.lookup_user_id("new@example.com", load)
+    assert len(calls) == 2
+    assert not cache.definitely_unknown("new@example.com")
+
+
+def test_failing_pending_check_counts_as_pending(cache):
+    def broken(email):
+        raise RuntimeError("queue unavailable")
+    cache.track_pending_signups(broken)
+    cache.remember_lookup("new@example.com", None)
+    assert not cache.definitely_unknown("new@example.com")
+
+
+def test_bloom_miss_skips_the_database(monkeypatch, cache):
+    _build_bloom(monkeypatch, cache, ["Known@Example.com"])
+    load = lambda email: pytest.fail("the Bloom filter should have answered")
+    assert cache.definitely_unknown("stranger@example.com")
+    assert cache.lookup_user_id("stranger@example.com", load) is None
+    # Emails are normalized, so a different spelling of a known address is still a "maybe"
+    assert not cache.definitely_unknown(" known@EXAMPLE.com ")
+
+
+def test_bloom_rebuild_reads_every_page(monkeypatch, cache):
+    emails = [f"user{i}@example.com" for i in range(25)]
+    profiles = _build_bloom(monkeypatch, cache, emails, page_size=10)
+    assert profiles.queries == 3
+    assert cache.stats()["bloom_items"] == 25
+    assert not any(cache.definitely_unknown(email) for email in emails)
+
+
+def test_failed_rebuild_keeps_the_previous_filter(monkeypatch, cache):
+    _build_bloom(monkeypatch, cache, ["known@example.com"])
+    def unavailable():
+        raise RuntimeError("database down")
+    monkeypatch.setattr(profile_cache_module, "get_supabase_admin", unavailable)
+    cache.rebuild_bloom()
+    assert cache.definitely_unknown("stranger@example.com")
+    assert not cache.definitely_unknown("known@example.com")
+
+
+def test_signup_is_visible_immediately(monkeypatch, cache):
+    _build_bloom(monkeypatch, cache, [])
+    cache.remember_lookup("new@example.com", None)
+    assert cache.definitely_unknown("new@example.com")
+    cache.remember_signup("user-2", "new@example.com", {"user_id": "user-2"})
+    assert not cache.definitely_unknown("new@example.com")
+    assert cache.lookup_user_id("new@example.com", lambda email: pytest.fail("cached")) == "user-2"
+    assert cache.get_profile("user-2", lambda user_id: pytest.fail("cached")) == {"user_id": "user-2"}
+
+
+def test_signup_during_rebuild_survives_the_swap(monkeypatch, cache):
+    profiles = FakeProfiles([])
+    def signup_mid_rebuild():
+        cache.remember_signup("user-3", "late@example.com")
+        return profiles
+    monkeypatch.setattr(profile_cache_module, "get_supabase_admin", signup_mid_rebuild)
+    cache._building = True
+    cache.rebuild_bloom()
+    assert not cache.definitely_unknown("late@example.com")
+
+
+def test_profile_invalidation(cache):
+    calls = []
+    load = lambda user_id: calls.append(user_id) or {"user_id": user_id, "is_locked": len(calls) > 1}
+    assert cache.get_profile("user-1", load)["is_locked"] is False
+    assert cache.get_profile("user-1", load)["is_locked"] is False
+    cache.invalidate_user("user-1")
+    assert cache.get_profile("user-1", load)["is_locked"] is True
+    assert len(calls) == 2
+
+
+def test_missing_profile_is_not_cached(cache):
+    calls = []
+    load = lambda user_id: calls.append(user_id) or None
+    cache.get_profile("user-9", load)
+    cache.get_profile("user-9", load)
+    assert len(calls) == 2
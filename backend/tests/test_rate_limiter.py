@@ -0,0 +1,116 @@
+import pytest
+
+from security_logic import rate_limiter as rate_limiter_module
+from security_logic.rate_limiter import TokenBucketLimiter, parse_limit, subnet_of
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter_module, "time", clock)
+    return clock
+
+
+def _limiter(ip="3/30", subnet="5/30", max_buckets=1000):
+    return TokenBucketLimiter({"/api/login": (parse_limit(ip), parse_limit(subnet))}, max_buckets=max_buckets)
+
+
+@pytest.mark.parametrize("spec, expected", [
+    ("20/60", (20.0, 20 / 60)),
+    ("5", (5.0, 5.0)),
+    ("0", None),
+    ("", None),
+])
+def test_parse_limit(spec, expected):
+    assert parse_limit(spec) == expected
+
+
+@pytest.mark.parametrize("ip, expected", [
+    ("203.0.113.77", "203.0.113.0/24"),
+    ("::ffff:203.0.113.77", "203.0.113.0/24"),
+    ("2001:db8:1:2:3:4:5:6", "2001:db8:1:2::/64"),
+    ("not-an-ip", None),
+])
+def test_subnet_of(ip, expected):
+    assert subnet_of(ip) == expected
+
+
+def test_bucket_empties_then_rejects(clock):
+    limiter = _limiter()
+    assert [limiter.check("/api/login", "198.51.100.1")[0] for _ in range(4)] == [True, True, True, False]
+    allowed, retry_after, scope = limiter.check("/api/login", "198.51.100.1")
+    assert (allowed, scope) == (False, "ip")
+    # One token comes back every 10 seconds
+    assert retry_after == 10
+    assert limiter.stats()["rejected"] == 2
+
+
+def test_bucket_refills_over_time(clock):
+    limiter = _limiter()
+    for _ in range(3):
+        limiter.check("/api/login", "198.51.100.1")
+    clock.now += 9.9
+    assert not limiter.check("/api/login", "198.51.100.1")[0]
+    clock.now += 0.1
+    assert limiter.check("/api/login", "198.51.100.1")[0]
+    assert not limiter.check("/api/login", "198.51.100.1")[0]
+    # Refilling stops at capacity
+    clock.now += 3600
+    assert [limiter.check("/api/login", "198.51.100.1")[0] for _ in range(4)] == [True, True, True, False]
+
+
+def test_subnet_budget_is_shared(clock):
+    limiter = _limiter(ip="3/30", subnet="5/30")
+    results = [limiter.check("/api/login", f"198.51.100.{i}") for i in range(6)]
+    assert [allowed for allowed, _, _ in results] == [True] * 5 + [False]
+    assert results[-1][2] == "subnet"
+    # Another subnet has its own budget
+    assert limiter.check("/api/login", "192.0.2.1")[0]
+
+
+def test_rejection_takes_no_tokens(clock):
+    limiter = _limiter(ip="3/30", subnet="4/30")
+    for _ in range(3):
+        limiter.check("/api/login", "198.51.100.1")
+    # The IP is empty: its rejected attempts must not drain the subnet's last token
+    for _ in range(5):
+        assert not limiter.check("/api/login", "198.51.100.1")[0]
+    assert limiter.check("/api/login", "198.51.100.2")[0]
+
+
+def test_unlimited_endpoints_and_missing_ip_pass(clock):
+    limiter = _limiter(ip="1/30", subnet="0")
+    assert limiter.check("/api/other", "198.51.100.1") == (True, 0, None)
+    assert limiter.check("/api/login", None) == (True, 0, None)
+    limiter.check("/api/login", "198.51.100.1")
+    assert limiter.check("/api/login", "198.51.100.1")[2] == "ip"
+
+
+def test_idle_full_buckets_are_dropped_first(clock):
+    limiter = _limiter(ip="3/30", subnet="0", max_buckets=1000)
+    limiter.check("/api/login", "198.51.100.1")
+    limiter.check("/api/login", "198.51.100.2")
+    clock.now += 30
+    limiter.check("/api/login", "198.51.100.3")
+    assert limiter.stats()["buckets"] == 1
+    assert limiter.stats()["evictions"] == 0
+
+
+def test_full_table_evicts_least_recently_used(clock):
+    limiter = _limiter(ip="3/30", subnet="0", max_buckets=2)
+    for _ in range(3):
+        limiter.check("/api/login", "198.51.100.1")
+    limiter.check("/api/login", "198.51.100.2")
+    limiter.check("/api/login", "198.51.100.3")
+    stats = limiter.stats()
+    assert stats["buckets"] == 2 and stats["evictions"] == 1
+    # Losing a bucket can only make the limit more generous
+    assert limiter.check("/api/login", "198.51.100.1")[0]
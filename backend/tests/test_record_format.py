@@ -0,0 +1,138 @@
+import base64
+import os
+
+import pytest
+from cryptography.fernet import Fernet, InvalidToken
+
+from database.supabase_client import from_bytea
+from security_logic.kdf_params import LEGACY_KDF, KDFParams
+from security_logic.record_format import (
+    ENVELOPE_FORMAT, FERNET_FORMAT, PACKED_FORMAT, PACKED_KDF_VERSION, PACKED_VERSION,
+    RecordFormatError, decode_columns, decode_record, encode_columns, encode_envelope_columns,
+    pack_envelope, pack_record, unpack_envelope, unpack_record, unpack_record_kdf,
+)
+
+SALT = os.urandom(16)
+
+
+@pytest.fixture
+def token():
+    return Fernet(Fernet.generate_key()).encrypt(b"record contents")
+
+
+def test_packed_round_trip_with_legacy_kdf(token):
+    blob = pack_record(token, SALT)
+    assert blob[4] == PACKED_VERSION
+    assert unpack_record_kdf(blob) == (token, SALT, LEGACY_KDF)
+    assert unpack_record(blob) == (token, SALT)
+
+
+def test_packed_round_trip_with_other_kdf(token):
+    kdf = KDFParams.scrypt(1 << 14, 8, 1)
+    blob = pack_record(token, SALT, kdf)
+    assert blob[4] == PACKED_KDF_VERSION
+    assert unpack_record_kdf(blob) == (token, SALT, kdf)
+
+
+def test_packed_blob_holds_raw_token_bytes(token):
+    # The point of the layout: the token is stored once, not base64 on top of base64
+    assert len(pack_record(token, SALT)) == 6 + len(SALT) + len(base64.urlsafe_b64decode(token))
+
+
+def test_envelope_round_trip(token):
+    assert unpack_envelope(pack_envelope(token)) == token
+
+
+@pytest.mark.parametrize("storage_format", [PACKED_FORMAT, FERNET_FORMAT])
+def test_columns_round_trip(token, storage_format):
+    columns = encode_columns(token, SALT, storage_format)
+    assert decode_record(columns) == (token, SALT, LEGACY_KDF)
+    assert decode_columns(columns) == (token, SALT)
+
+
+def test_fernet_columns_leave_data_blob_unnamed(token):
+    columns = encode_columns(token, SALT, FERNET_FORMAT)
+    assert "data_blob" not in columns and "storage_format" not in columns
+
+
+def test_row_without_storage_format_is_fernet(token):
+    row = {"data_content": base64.b64encode(token).decode(), "salt": base64.b64encode(SALT).decode(),
+           "storage_format": None}
+    assert decode_columns(row) == (token, SALT)
+
+
+def test_envelope_columns_round_trip(token):
+    columns = encode_envelope_columns(token)
+    assert columns["storage_format"] == ENVELOPE_FORMAT
+    assert columns["data_blob"].startswith("\\x")
+    assert decode_record(columns) == (token, None, None)
+
+
+def test_fernet_columns_cannot_carry_kdf_params(token):
+    with pytest.raises(RecordFormatError):
+        encode_columns(token, SALT, FERNET_FORMAT, KDFParams.pbkdf2(600000))
+
+
+def test_unknown_storage_format_is_rejected(token):
+    with pytest.raises(RecordFormatError):
+        encode_columns(token, SALT, "zip-v9")
+    with pytest.raises(RecordFormatError):
+        decode_record({"storage_format": "chunked-v1"})
+
+
+@pytest.mark.parametrize("blob, message", [
+    (b"BSS", "too short"),
+    (b"XXXX\x01\x00", "not a packed record"),
+    (b"BSSP\x07\x00", "unsupported packed record version"),
+    (b"BSSP\x02\x00", "too short"),
+])
+def test_bad_packed_blobs_are_rejected(blob, message):
+    with pytest.raises(RecordFormatError, match=message):
+        unpack_record_kdf(blob)
+
+
+def test_garbled_kdf_params_are_rejected(token):
+    blob = bytearray(pack_record(token, SALT, KDFParams.scrypt(1 << 14, 8, 1)))
+    params_start = 6 + len(SALT) + 1
+    blob[params_start:params_start + 3] = b"???"
+    with pytest.raises(RecordFormatError, match="invalid KDF parameters"):
+        unpack_record_kdf(bytes(blob))
+
+
+@pytest.mark.parametrize("blob, message", [
+    (b"BSS", "too short"),
+    (b"BSSP\x01", "not an envelope record"),
+    (b"BSSE\x02", "unsupported envelope record version"),
+])
+def test_bad_envelopes_are_rejected(blob, message):
+    with pytest.raises(RecordFormatError, match=message):
+        unpack_envelope(blob)
+
+
+@pytest.mark.parametrize("storage_format", [PACKED_FORMAT, ENVELOPE_FORMAT])
+def test_rows_without_a_blob_are_rejected(storage_format):
+    with pytest.raises(RecordFormatError, match="no data_blob"):
+        decode_record({"storage_format": storage_format, "data_blob": None})
+
+
+def test_tampered_token_fails_to_decrypt():
+    fernet = Fernet(Fernet.generate_key())
+    blob = bytearray(pack_record(fernet.encrypt(b"record contents"), SALT))
+    blob[-1] ^= 0x01
+    token, _ = unpack_record(bytes(blob))
+    with pytest.raises(InvalidToken):
+        fernet.decrypt(token)
+
+
+def test_truncated_token_fails_to_decrypt():
+    fernet = Fernet(Fernet.generate_key())
+    columns = encode_columns(fernet.encrypt(b"record contents"), SALT, PACKED_FORMAT)
+    columns["data_blob"] = columns["data_blob"][:-8]
+    token, _ = decode_columns(columns)
+    with pytest.raises(InvalidToken):
+        fernet.decrypt(token)
+
+
+def test_bytea_hex_round_trip(token):
+    columns = encode_columns(token, SALT, PACKED_FORMAT)
+    assert from_bytea(columns["data_blob"]) == pack_record(token, SALT)
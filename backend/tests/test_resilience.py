@@ -0,0 +1,143 @@
+import httpx
+import pytest
+
+from database import resilience
+from database.resilience import (
+    CircuitBreaker, CircuitBreakers, CircuitOpenError, DeadlineExceeded, UpstreamUnavailable,
+    budget, remaining_budget, retry_after_hint,
+)
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(resilience, "time", clock)
+    return clock
+
+
+def _open(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+# --- CircuitBreaker ---
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failures=3, open_seconds=10, probes=1)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failures=3, open_seconds=10, probes=1)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_breaker_refuses_calls_with_retry_after(clock):
+    breaker = CircuitBreaker(failures=2, open_seconds=10, probes=1)
+    _open(breaker)
+    clock.now += 3
+    with pytest.raises(CircuitOpenError) as refused:
+        breaker.before_call()
+    assert refused.value.retry_after == 7
+    # Callers handle it like any other connection failure
+    assert isinstance(refused.value, httpx.TransportError)
+
+
+def test_half_open_lets_probes_through(clock):
+    breaker = CircuitBreaker(failures=2, open_seconds=10, probes=2)
+    _open(breaker)
+    clock.now += 10
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError) as refused:
+        breaker.before_call()
+    assert refused.value.retry_after == 1
+
+
+def test_successful_probe_closes(clock):
+    breaker = CircuitBreaker(failures=2, open_seconds=10, probes=1)
+    _open(breaker)
+    clock.now += 10
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    for _ in range(5):
+        breaker.before_call()
+    # A single failure does not re-open a closed breaker
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_probe_reopens_for_another_period(clock):
+    breaker = CircuitBreaker(failures=2, open_seconds=10, probes=1)
+    _open(breaker)
+    clock.now += 10
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 9
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    clock.now += 1
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_zero_threshold_disables_the_breaker(clock):
+    breaker = CircuitBreaker(failures=0, open_seconds=10, probes=1)
+    for _ in range(100):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_one_breaker_per_target():
+    registry = CircuitBreakers()
+    assert registry.get("rest", "profiles") is registry.get("rest", "profiles")
+    assert registry.get("rest", "profiles") is not registry.get("rpc", "profiles")
+    assert registry.states() == {("rest", "profiles"): "closed", ("rpc", "profiles"): "closed"}
+
+
+# --- Budgets and hints ---
+def test_budget_counts_down_and_resets(clock):
+    assert remaining_budget() is None
+    with budget(5):
+        clock.now += 2
+        assert remaining_budget() == 3
+        with budget(0):
+            assert remaining_budget() is None
+        assert remaining_budget() == 3
+    assert remaining_budget() is None
+
+
+def test_retry_after_hint_follows_wrapped_errors():
+    try:
+        try:
+            raise CircuitOpenError("circuit open", retry_after=7)
+        except CircuitOpenError as e:
+            raise RuntimeError("client library wrapper") from e
+    except RuntimeError as wrapped:
+        assert retry_after_hint(wrapped) == 7
+    assert retry_after_hint(DeadlineExceeded("spent", retry_after=2)) == 2
+    assert retry_after_hint(ValueError("other"), default=5) == 5
+    assert issubclass(DeadlineExceeded, UpstreamUnavailable)
@@ -0,0 +1,55 @@
+import pytest
+
+from security_logic import user_keys
+from security_logic.user_keys import DataKeyNotReady, DataKeyRewrapRequired, WrongPasswordError
+
+RESET_AT = "2026-03-01T12:00:00+00:00"
+
+
+@pytest.fixture
+def profile(monkeypatch):
+    profile = {"user_id": "u1"}
+    monkeypatch.setattr(user_keys.profile_cache, "get_profile", lambda user_id, fetch: profile)
+    return profile
+
+
+def _stored(wrapped_at):
+    return {"wrapped_key": b"k", "kdf_salt": b"s", "kdf": user_keys.CURRENT_KDF, "wrapped_at": wrapped_at}
+
+
+def test_key_wrapped_before_the_reset_is_stale(profile):
+    profile["password_changed_at"] = RESET_AT
+    assert isinstance(user_keys._wrong_password("u1", _stored("2026-02-01T00:00:00Z")), DataKeyRewrapRequired)
+    assert isinstance(user_keys._wrong_password("u1", _stored(None)), DataKeyRewrapRequired)
+
+
+def test_key_wrapped_after_the_reset_is_a_wrong_password(profile):
+    profile["password_changed_at"] = RESET_AT
+    assert isinstance(user_keys._wrong_password("u1", _stored("2026-03-01T12:00:05Z")), WrongPasswordError)
+
+
+def test_no_reset_or_no_migration_means_wrong_password(profile):
+    assert isinstance(user_keys._wrong_password("u1", _stored("2026-02-01T00:00:00Z")), WrongPasswordError)
+    profile["password_changed_at"] = RESET_AT
+    stored = _stored(None)
+    del stored["wrapped_at"]
+    assert isinstance(user_keys._wrong_password("u1", stored), WrongPasswordError)
+
+
+def test_failed_staleness_check_answers_wrong_password(monkeypatch):
+    def unavailable(user_id, fetch):
+        raise ConnectionError("profiles unreachable")
+    monkeypatch.setattr(user_keys.profile_cache, "get_profile", unavailable)
+    assert isinstance(user_keys._wrong_password("u1", _stored(None)), WrongPasswordError)
+
+
+def test_unverified_password_cannot_create_the_first_key(monkeypatch):
+    monkeypatch.setattr(user_keys, "unlock_data_key", lambda user_id, password: None)
+    monkeypatch.setattr(user_keys, "_password_matches_salted_records", lambda user_id, password: None)
+    created = []
+    monkeypatch.setattr(user_keys, "_create_data_key", lambda user_id, password: created.append(password) or b"key")
+    with pytest.raises(DataKeyNotReady):
+        user_keys.data_key_for_write("u1", "guess")
+    assert created == []
+    assert user_keys.data_key_for_write("u1", "signup-password", password_verified=True) == b"key"
+    assert created == ["signup-password"]
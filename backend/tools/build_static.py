@@ -0,0 +1,136 @@
+"""
+Builds the frontend for production: pre-rendered pages, fingerprinted assets,
+and gzip/brotli variants of everything compressible.
+
+Usage (from the backend/ directory, after any change under frontend/static):
+    python -m tools.build_static [--out ../frontend/dist]
+
+Output:
+    assets/<path>.<hash>.<ext>   every file under frontend/static except the
+                                 templates, named after its content
+    pages/<template>.html        each template rendered once, pointing at the
+                                 fingerprinted assets
+    manifest.json                original asset path -> fingerprinted path,
+                                 plus per-file ETag and available encodings
+
+routes/static_routes.py serves this output; without it the app renders the
+templates as before. Brotli variants need the optional `brotli` package.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+from urllib.parse import quote, unquote
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIR = os.path.join(BACKEND_DIR, '..', 'frontend', 'static')
+TEMPLATE_DIR = os.path.join(STATIC_DIR, 'templates')
+DEFAULT_OUT = os.path.join(BACKEND_DIR, '..', 'frontend', 'dist')
+
+COMPRESSIBLE = ('.html', '.css', '.js', '.svg', '.json', '.txt', '.map')
+# Below this, a compressed variant saves too little to be worth a second file
+MIN_COMPRESS_SIZE = 256
+# Matches /static/<path> references in HTML and CSS (url_for() output is percent-encoded)
+_STATIC_REF = re.compile(r"/static/([^\s\"'()<>?#]+)")
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _fingerprinted_name(path, data):
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{_digest(data)[:12]}{ext}"
+
+
+def _rewrite_refs(text, manifest):
+    """Points /static/... references that have a fingerprinted version at /assets/..."""
+    def replace(match):
+        target = manifest.get(unquote(match.group(1)))
+        return f"/assets/{quote(target)}" if target else match.group(0)
+    return _STATIC_REF.sub(replace, text)
+
+
+def _write(out_dir, rel_path, data, files, brotli):
+    path = os.path.join(out_dir, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    encodings = []
+    if rel_path.endswith(COMPRESSIBLE) and len(data) >= MIN_COMPRESS_SIZE:
+        variants = [("gzip", ".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.insert(0, ("br", ".br", brotli.compress(data, quality=11)))
+        for encoding, suffix, compressed in variants:
+            if len(compressed) < len(data):
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+                encodings.append(encoding)
+    files[rel_path] = {"etag": _digest(data)[:32], "size": len(data), "encodings": encodings}
+
+
+def _asset_paths():
+    for root, dirs, names in os.walk(STATIC_DIR):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != TEMPLATE_DIR)
+        for name in sorted(names):
+            full = os.path.join(root, name)
+            yield os.path.relpath(full, STATIC_DIR).replace(os.sep, '/'), full
+
+
+def build(out_dir):
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        print("brotli is not installed: writing gzip variants only (pip install brotli for .br files).")
+
+    if os.path.isdir(out_dir) and os.listdir(out_dir):
+        # Only ever wipe a previous build
+        if not os.path.exists(os.path.join(out_dir, 'manifest.json')):
+            raise SystemExit(f"❌ {out_dir} is not empty and is not a previous build; refusing to overwrite it.")
+        shutil.rmtree(out_dir)
+    manifest, files = {}, {}
+
+    # Stylesheets can reference other assets, so fingerprint everything else first
+    assets = sorted(_asset_paths(), key=lambda item: item[0].endswith('.css'))
+    for rel_path, full in assets:
+        with open(full, 'rb') as f:
+            data = f.read()
+        if rel_path.endswith('.css'):
+            data = _rewrite_refs(data.decode('utf-8'), manifest).encode('utf-8')
+        hashed = _fingerprinted_name(rel_path, data)
+        manifest[rel_path] = hashed
+        _write(out_dir, f"assets/{hashed}", data, files, brotli)
+
+    # Templates have no per-request variables, so each one renders to a single static page
+    from simple_server import app
+    from flask import render_template
+    pages = {}
+    with app.test_request_context('/'):
+        for name in sorted(os.listdir(TEMPLATE_DIR)):
+            if not name.endswith('.html'):
+                continue
+            html = _rewrite_refs(render_template(name), manifest)
+            pages[name] = f"pages/{name}"
+            _write(out_dir, pages[name], html.encode('utf-8'), files, brotli)
+
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump({"assets": manifest, "pages": pages, "files": files}, f, indent=2, sort_keys=True)
+
+    raw = sum(entry["size"] for entry in files.values())
+    print(f"✅ Built {len(pages)} pages and {len(manifest)} assets ({raw} bytes) into {os.path.abspath(out_dir)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render pages and fingerprint/precompress static assets.")
+    parser.add_argument("--out", default=DEFAULT_OUT, help="Output directory (default: frontend/dist)")
+    args = parser.parse_args()
+    build(args.out)
+
+
+if __name__ == '__main__':
+    main()
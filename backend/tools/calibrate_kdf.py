@@ -0,0 +1,90 @@
+"""
+Benchmarks key derivation on this host and suggests KDF_PARAMS for a target latency.
+
+Usage (from the backend/ directory, on the machine that will serve requests):
+    python -m tools.calibrate_kdf [--target-ms 250] [--algorithm pbkdf2-sha256|scrypt] [--max-memory-mb 64]
+
+Put the printed KDF_PARAMS line in backend/database/.env. New data is then
+encrypted with it, and existing data is upgraded as users open it. Each
+derivation occupies one KDF worker for the measured time, so the target also
+caps logins/decryptions per second at about KDF_EXECUTOR_WORKERS * 1000 / ms.
+"""
+import argparse
+import os
+import statistics
+import time
+from security_logic.kdf_params import KDFParams, derive, CURRENT_KDF, LEGACY_KDF, PBKDF2_SHA256, SCRYPT
+
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+
+def _measure(kdf, rounds):
+    """Median seconds for one derivation with `kdf`."""
+    salt = os.urandom(16)
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        derive(b"calibration password", salt, kdf.encode())
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def _calibrate_pbkdf2(target, rounds):
+    probe = KDFParams.pbkdf2(50_000)
+    seconds = _measure(probe, rounds)
+    # PBKDF2 cost is linear in the iteration count
+    iterations = max(10_000, round(probe.iterations * target / seconds / 10_000) * 10_000)
+    return KDFParams.pbkdf2(iterations)
+
+
+def _calibrate_scrypt(target, rounds, max_memory):
+    best = None
+    n = 2 ** 12
+    while 128 * n * SCRYPT_R * SCRYPT_P <= max_memory:
+        kdf = KDFParams.scrypt(n, SCRYPT_R, SCRYPT_P)
+        seconds = _measure(kdf, rounds)
+        print(f"  scrypt n=2^{n.bit_length() - 1}: {seconds * 1000:.0f} ms, "
+              f"{128 * n * SCRYPT_R * SCRYPT_P // (1024 * 1024)} MiB")
+        if seconds > target:
+            # Over target: keep the previous step, unless even the smallest one is too slow
+            best = best or kdf
+            break
+        best = kdf
+        n *= 2
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pick KDF parameters that take about --target-ms on this host.")
+    parser.add_argument("--target-ms", type=float, default=250.0,
+                        help="Time one derivation should take (default: 250)")
+    parser.add_argument("--algorithm", choices=(PBKDF2_SHA256, SCRYPT), default=PBKDF2_SHA256,
+                        help="KDF to calibrate (default: pbkdf2-sha256; scrypt is memory-hard)")
+    parser.add_argument("--max-memory-mb", type=int, default=64,
+                        help="Memory one scrypt derivation may use (default: 64)")
+    parser.add_argument("--rounds", type=int, default=3, help="Timed runs per measurement (default: 3)")
+    args = parser.parse_args()
+
+    target = args.target_ms / 1000
+    if args.algorithm == SCRYPT:
+        kdf = _calibrate_scrypt(target, args.rounds, args.max_memory_mb * 1024 * 1024)
+        if kdf is None:
+            print("❌ --max-memory-mb is too small for scrypt.")
+            return
+    else:
+        kdf = _calibrate_pbkdf2(target, args.rounds)
+
+    seconds = _measure(kdf, args.rounds)
+    workers = int(os.getenv("KDF_EXECUTOR_WORKERS", str(os.cpu_count() or 1)))
+    print(f"Current:   {CURRENT_KDF.encode()} ({_measure(CURRENT_KDF, args.rounds) * 1000:.0f} ms)")
+    print(f"Suggested: {kdf.encode()} ({seconds * 1000:.0f} ms, about "
+          f"{max(workers, 1) / seconds:.0f} derivations/s with {max(workers, 1)} KDF worker(s))")
+    if kdf.algorithm == PBKDF2_SHA256 and kdf.iterations < LEGACY_KDF.iterations:
+        print(f"⚠️ This is weaker than the default ({LEGACY_KDF.encode()}); consider a higher --target-ms.")
+    print()
+    print(f"KDF_PARAMS={kdf.encode()}")
+
+
+if __name__ == '__main__':
+    main()
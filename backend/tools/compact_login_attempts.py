@@ -0,0 +1,31 @@
+"""
+Rolls login_attempts older than the retention period up into login_attempt_daily
+and drops expired partitions, via the compact_login_attempts() database function.
+
+Usage (from the backend/ directory):
+    python -m tools.compact_login_attempts [--retention-days 30]
+
+Schedule it nightly (cron, CI, ...) if pg_cron is not enabled on the project.
+"""
+import argparse
+from database.supabase_client import get_supabase_admin
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact old login_attempts into daily summaries.")
+    parser.add_argument("--retention-days", type=int, default=30,
+                        help="Keep raw attempts for this many days (default: 30)")
+    args = parser.parse_args()
+
+    res = get_supabase_admin().rpc(
+        "compact_login_attempts",
+        {"p_retention": f"{args.retention_days} days"}
+    ).execute()
+    summary = res.data[0] if res.data else {}
+    print(f"Compaction done: {summary.get('summary_rows', 0)} summary rows, "
+          f"{summary.get('partitions_dropped', 0)} partitions dropped, "
+          f"{summary.get('rows_deleted', 0)} rows deleted.")
+
+
+if __name__ == '__main__':
+    main()
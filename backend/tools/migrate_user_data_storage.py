@@ -0,0 +1,103 @@
+"""
+Rewrites legacy 'fernet' user_data rows (double-base64 text) into the binary
+'packed-v1' layout, in batches, while the app keeps serving requests.
+
+Usage (from the backend/ directory, after docs/migrations/003_packed_user_data.sql):
+    python -m tools.migrate_user_data_storage [--batch-size 200] [--pause 0.5] [--limit N] [--dry-run]
+
+Each row is only updated while it is still 'fernet', so rows rewritten or
+replaced concurrently are left alone. The tool can be stopped and rerun at
+any time; it picks up the rows that are still left.
+"""
+import argparse
+import time
+from datetime import datetime, timezone
+from database.supabase_client import get_supabase_admin, from_bytea
+from security_logic.record_format import (
+    encode_columns,
+    decode_columns,
+    unpack_record,
+    FERNET_FORMAT,
+    PACKED_FORMAT,
+)
+
+
+def _fetch_batch(after_id, batch_size):
+    return get_supabase_admin().table("user_data") \
+                .select("data_id, data_content, salt, storage_format") \
+                .eq("storage_format", FERNET_FORMAT) \
+                .gt("data_id", after_id) \
+                .order("data_id") \
+                .limit(batch_size) \
+                .execute().data
+
+
+def _convert(row):
+    """Returns the packed-v1 columns for a legacy row, checking that they decode back to the same token."""
+    token, salt = decode_columns(row)
+    columns = encode_columns(token, salt, storage_format=PACKED_FORMAT)
+    if unpack_record(from_bytea(columns["data_blob"])) != (token, salt):
+        raise ValueError("packed record does not round-trip")
+    return columns
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate user_data rows to the packed binary layout.")
+    parser.add_argument("--batch-size", type=int, default=200, help="Rows read per request (default: 200)")
+    parser.add_argument("--pause", type=float, default=0.5,
+                        help="Seconds to sleep between batches to limit load (default: 0.5)")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many rows")
+    parser.add_argument("--dry-run", action="store_true", help="Convert and verify rows without writing them")
+    args = parser.parse_args()
+
+    admin = get_supabase_admin()
+    last_id = 0
+    migrated = skipped = failed = 0
+    saved_bytes = 0
+
+    while args.limit is None or migrated + skipped + failed < args.limit:
+        batch_size = args.batch_size if args.limit is None else min(args.batch_size, args.limit - migrated - skipped - failed)
+        rows = _fetch_batch(last_id, batch_size)
+        if not rows:
+            break
+
+        for row in rows:
+            last_id = row["data_id"]
+            try:
+                columns = _convert(row)
+            except Exception as e:
+                print(f"❌ data_id {row['data_id']}: cannot convert ({e}), left as is")
+                failed += 1
+                continue
+
+            before = len(row["data_content"] or "") + len(row["salt"] or "")
+            after = len(from_bytea(columns["data_blob"]))
+            if args.dry_run:
+                migrated += 1
+                saved_bytes += before - after
+                continue
+
+            # Only touch the row if nobody changed its layout since we read it
+            res = admin.table("user_data") \
+                       .update({**columns, "updated_at": datetime.now(timezone.utc).isoformat()}) \
+                       .eq("data_id", row["data_id"]) \
+                       .eq("storage_format", FERNET_FORMAT) \
+                       .execute()
+            if res.data:
+                migrated += 1
+                saved_bytes += before - after
+            else:
+                skipped += 1
+
+        print(f"... up to data_id {last_id}: {migrated} migrated, {skipped} skipped, {failed} failed")
+        if len(rows) < batch_size:
+            break
+        time.sleep(args.pause)
+
+    action = "Would migrate" if args.dry_run else "Migrated"
+    print(f"{action} {migrated} rows ({skipped} changed concurrently, {failed} failed), "
+          f"about {saved_bytes} bytes smaller.")
+
+
+if __name__ == '__main__':
+    main()
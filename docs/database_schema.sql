@@ -5,19 +5,25 @@ CREATE TABLE public.profiles (
   email text,
   first_name text,
   last_name text,
-  is_locked boolean DEFAULT false
+  is_locked boolean DEFAULT false,
+  tokens_valid_after timestamptz, -- access tokens issued before this are rejected (set on password reset)
+  password_changed_at timestamptz -- last password reset; data keys wrapped before it are stale
 );
 
--- 2. Create Login Attempts Table
+-- 2. Create Login Attempts Table (partitioned by month, see sections 9-11)
 CREATE TABLE public.login_attempts (
-  attempt_id bigserial PRIMARY KEY,
+  attempt_id bigserial,
   user_id uuid REFERENCES auth.users(id) ON DELETE CASCADE,
   username_attempted text,
   success boolean NOT NULL,
   failure_reason text,
   ip_address inet,
-  timestamp timestamptz DEFAULT now()
-);
+  timestamp timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (attempt_id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Catches rows outside every monthly partition so inserts never fail
+CREATE TABLE public.login_attempts_default PARTITION OF public.login_attempts DEFAULT;
 
 -- 3. Create Account Locks Table
 CREATE TABLE public.account_locks (
@@ -33,11 +39,34 @@ CREATE TABLE public.user_data (
   data_id bigserial PRIMARY KEY,
   user_id uuid NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
   data_type text,
-  data_content text, -- Stores the base64-encoded encrypted string
+  data_content text, -- Stores the base64-encoded encrypted string ('fernet' rows only)
   encrypted boolean DEFAULT true,
   created_at timestamptz DEFAULT now(),
   updated_at timestamptz DEFAULT now(),
-  salt text NOT NULL -- Stores the base64-encoded salt
+  salt text, -- Stores the base64-encoded salt ('fernet' rows; 'packed-v1' keeps it inside data_blob)
+  storage_format text NOT NULL DEFAULT 'fernet', -- 'fernet' (data_content), 'packed-v1' / 'envelope-v1' (data_blob) or 'chunked-v1' (user_data_chunks)
+  data_blob bytea, -- 'packed-v1': header, salt and raw ciphertext; 'envelope-v1': header and ciphertext under the user's data key
+  content_size bigint -- Plaintext size in bytes for streamed uploads
+);
+
+-- Ciphertext of 'chunked-v1' rows, stored as ordered segments of the encrypted stream
+CREATE TABLE public.user_data_chunks (
+  data_id bigint NOT NULL REFERENCES public.user_data(data_id) ON DELETE CASCADE,
+  seq int4 NOT NULL,
+  chunk bytea NOT NULL,
+  PRIMARY KEY (data_id, seq)
+);
+
+-- Per-user data key for 'envelope-v1' rows, wrapped (AES-GCM) under a key derived from the user's password
+CREATE TABLE public.user_keys (
+  user_id uuid PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
+  wrapped_key bytea NOT NULL, -- 12-byte nonce followed by the encrypted 32-byte data key
+  kdf_salt bytea NOT NULL,
+  kdf_iterations int4, -- PBKDF2 iterations; NULL when kdf_params names another KDF
+  kdf_params text, -- e.g. 'scrypt:n=32768,r=8,p=1' (see backend/security_logic/kdf_params.py)
+  wrapped_at timestamptz DEFAULT now(), -- when wrapped under the current password (not changed by KDF upgrades)
+  created_at timestamptz DEFAULT now(),
+  updated_at timestamptz DEFAULT now()
 );
 
 -- 5. Create Trigger Function for New User Profiles
@@ -53,4 +82,243 @@ $$ LANGUAGE plpgsql SECURITY DEFINER;
 -- 6. Create Trigger
 CREATE TRIGGER on_auth_user_created
   AFTER INSERT ON auth.users
-  FOR EACH ROW EXECUTE PROCEDURE public.handle_new_user();
\ No newline at end of file
+  FOR EACH ROW EXECUTE PROCEDURE public.handle_new_user();
+
+-- 7. Login Security Check (one round trip: email -> user_id + current lock state)
+CREATE OR REPLACE FUNCTION public.login_security_check(p_email text)
+RETURNS TABLE (
+  user_id uuid,
+  is_locked boolean,
+  unlock_at timestamptz,
+  remaining_seconds int4
+)
+LANGUAGE sql STABLE SECURITY DEFINER
+SET search_path = public
+AS $$
+  SELECT p.user_id,
+         COALESCE(l.unlock_at > now(), false),
+         l.unlock_at,
+         GREATEST(COALESCE(floor(extract(epoch FROM l.unlock_at - now()))::int4, 0), 0)
+  FROM public.profiles p
+  LEFT JOIN LATERAL (
+    SELECT a.unlock_at
+    FROM public.account_locks a
+    WHERE a.user_id = p.user_id
+    ORDER BY a.locked_at DESC
+    LIMIT 1
+  ) l ON true
+  WHERE p.email = p_email
+  LIMIT 1;
+$$;
+
+-- 8. Record Login Failure (log attempt, count the window and insert the escalating lock atomically)
+CREATE OR REPLACE FUNCTION public.record_login_failure(
+  p_user_id uuid,
+  p_email text,
+  p_ip inet,
+  p_reason text,
+  p_log_attempt boolean,
+  p_max_attempts int4,
+  p_window_seconds int4,
+  p_base_lock_seconds int4
+)
+RETURNS TABLE (
+  locked boolean,
+  lock_seconds int4,
+  failed_count int4,
+  lock_created boolean
+)
+LANGUAGE plpgsql VOLATILE SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_now timestamptz;
+  v_failures int4;
+  v_previous_locks int4;
+  v_recent_lock boolean;
+BEGIN
+  -- Serialize concurrent failures for the same user so only one lock is ever inserted
+  PERFORM pg_advisory_xact_lock(hashtextextended(p_user_id::text, 0));
+  v_now := clock_timestamp();
+
+  IF p_log_attempt THEN
+    INSERT INTO public.login_attempts (user_id, username_attempted, success, failure_reason, ip_address, "timestamp")
+    VALUES (p_user_id, p_email, false, p_reason, p_ip, v_now);
+  END IF;
+
+  SELECT count(*) INTO v_failures
+  FROM public.login_attempts
+  WHERE user_id = p_user_id
+    AND success = false
+    AND "timestamp" >= v_now - make_interval(secs => p_window_seconds);
+
+  IF v_failures < p_max_attempts THEN
+    RETURN QUERY SELECT false, 0, v_failures, false;
+    RETURN;
+  END IF;
+
+  -- Ascending lockout duration: base * (previous locks + 1)
+  SELECT count(*) INTO v_previous_locks FROM public.account_locks WHERE user_id = p_user_id;
+
+  -- At most one new lock per minute
+  SELECT EXISTS (
+    SELECT 1 FROM public.account_locks
+    WHERE user_id = p_user_id AND locked_at >= v_now - interval '1 minute'
+  ) INTO v_recent_lock;
+
+  IF NOT v_recent_lock THEN
+    INSERT INTO public.account_locks (user_id, locked_at, unlock_at, failed_attempts_count)
+    VALUES (p_user_id, v_now, v_now + make_interval(secs => p_base_lock_seconds * (v_previous_locks + 1)), v_failures);
+
+    UPDATE public.profiles SET is_locked = true WHERE user_id = p_user_id;
+  END IF;
+
+  RETURN QUERY SELECT true, p_base_lock_seconds * (v_previous_locks + 1), v_failures, NOT v_recent_lock;
+END;
+$$;
+
+-- Only the backend (service role) may call the lockout functions
+REVOKE EXECUTE ON FUNCTION public.login_security_check(text) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.record_login_failure(uuid, text, inet, text, boolean, int4, int4, int4) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.login_security_check(text) TO service_role;
+GRANT EXECUTE ON FUNCTION public.record_login_failure(uuid, text, inet, text, boolean, int4, int4, int4) TO service_role;
+
+
+-- 9. Indexes for the hot lockout queries
+-- Failure count in the lockout window: user_id = ? AND success = false AND timestamp >= ?
+CREATE INDEX login_attempts_user_failures_idx
+  ON public.login_attempts (user_id, "timestamp" DESC)
+  WHERE success = false;
+-- Latest lock, recent-lock check and previous-lock count: user_id = ? ORDER BY locked_at DESC
+CREATE INDEX account_locks_user_locked_at_idx
+  ON public.account_locks (user_id, locked_at DESC);
+-- Login email -> user_id lookup
+CREATE INDEX profiles_email_idx
+  ON public.profiles (email);
+-- Admin audit export (backend/routes/admin_routes.py): filter, then page in attempt_id order
+CREATE INDEX login_attempts_user_export_idx
+  ON public.login_attempts (user_id, attempt_id);
+CREATE INDEX login_attempts_email_export_idx
+  ON public.login_attempts (username_attempted, attempt_id);
+CREATE INDEX login_attempts_ip_export_idx
+  ON public.login_attempts (ip_address, attempt_id);
+-- Attack detector replay (backend/security_logic/attack_detector.py): recent failures by time
+CREATE INDEX login_attempts_failures_time_idx
+  ON public.login_attempts ("timestamp")
+  WHERE success = false;
+
+-- 10. Monthly Partitions for login_attempts
+-- Creates the partitions for the current month and p_months_ahead months after it.
+CREATE OR REPLACE FUNCTION public.ensure_login_attempt_partitions(p_months_ahead int4 DEFAULT 2)
+RETURNS void
+LANGUAGE plpgsql SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_month date;
+  v_name text;
+BEGIN
+  FOR i IN 0..p_months_ahead LOOP
+    v_month := (date_trunc('month', now()) + make_interval(months => i))::date;
+    v_name := format('login_attempts_y%sm%s', to_char(v_month, 'YYYY'), to_char(v_month, 'MM'));
+    IF to_regclass(format('public.%I', v_name)) IS NULL THEN
+      EXECUTE format(
+        'CREATE TABLE public.%I PARTITION OF public.login_attempts FOR VALUES FROM (%L) TO (%L)',
+        v_name, v_month, (v_month + interval '1 month')::date
+      );
+    END IF;
+  END LOOP;
+END;
+$$;
+
+SELECT public.ensure_login_attempt_partitions();
+
+-- 11. Daily Summaries and Retention Compaction
+-- Raw attempts older than the retention period are rolled up here, one row per user per day
+-- (user_id NULL = attempts against unknown emails).
+CREATE TABLE public.login_attempt_daily (
+  day date NOT NULL,
+  user_id uuid REFERENCES auth.users(id) ON DELETE CASCADE,
+  successes int4 NOT NULL DEFAULT 0,
+  failures int4 NOT NULL DEFAULT 0,
+  distinct_ips int4 NOT NULL DEFAULT 0,
+  first_attempt timestamptz,
+  last_attempt timestamptz,
+  UNIQUE NULLS NOT DISTINCT (day, user_id)
+);
+
+CREATE OR REPLACE FUNCTION public.compact_login_attempts(p_retention interval DEFAULT interval '30 days')
+RETURNS TABLE (
+  summary_rows int4,
+  partitions_dropped int4,
+  rows_deleted int4
+)
+LANGUAGE plpgsql SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_cutoff timestamptz := date_trunc('day', now() - p_retention);
+  v_partition record;
+  v_summary int4 := 0;
+  v_dropped int4 := 0;
+  v_deleted int4 := 0;
+BEGIN
+  -- Only one compaction at a time
+  PERFORM pg_advisory_xact_lock(hashtext('compact_login_attempts'));
+
+  -- 1. Roll everything older than the cutoff up into per-user/per-day rows.
+  --    Re-runs are safe because the raw rows are removed below in the same transaction.
+  INSERT INTO public.login_attempt_daily AS d
+         (day, user_id, successes, failures, distinct_ips, first_attempt, last_attempt)
+  SELECT "timestamp"::date,
+         user_id,
+         count(*) FILTER (WHERE success),
+         count(*) FILTER (WHERE NOT success),
+         count(DISTINCT ip_address),
+         min("timestamp"),
+         max("timestamp")
+  FROM public.login_attempts
+  WHERE "timestamp" < v_cutoff
+  GROUP BY 1, 2
+  ON CONFLICT (day, user_id) DO UPDATE
+    SET successes     = d.successes + EXCLUDED.successes,
+        failures      = d.failures + EXCLUDED.failures,
+        distinct_ips  = GREATEST(d.distinct_ips, EXCLUDED.distinct_ips),
+        first_attempt = LEAST(d.first_attempt, EXCLUDED.first_attempt),
+        last_attempt  = GREATEST(d.last_attempt, EXCLUDED.last_attempt);
+  GET DIAGNOSTICS v_summary = ROW_COUNT;
+
+  -- 2. Drop monthly partitions that lie entirely before the cutoff (cheap: no row-by-row delete)
+  FOR v_partition IN
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'public.login_attempts'::regclass
+      AND c.relname ~ '^login_attempts_y[0-9]{4}m[0-9]{2}$'
+  LOOP
+    IF (to_date(substring(v_partition.relname FROM 'y([0-9]{4}m[0-9]{2})$'), 'YYYY"m"MM')
+        + interval '1 month') <= v_cutoff THEN
+      EXECUTE format('ALTER TABLE public.login_attempts DETACH PARTITION public.%I', v_partition.relname);
+      EXECUTE format('DROP TABLE public.%I', v_partition.relname);
+      v_dropped := v_dropped + 1;
+    END IF;
+  END LOOP;
+
+  -- 3. Delete the rolled-up rows left in the partition that straddles the cutoff (and the default one)
+  DELETE FROM public.login_attempts WHERE "timestamp" < v_cutoff;
+  GET DIAGNOSTICS v_deleted = ROW_COUNT;
+
+  -- 4. Keep partitions ready for the coming months
+  PERFORM public.ensure_login_attempt_partitions();
+
+  RETURN QUERY SELECT v_summary, v_dropped, v_deleted;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.ensure_login_attempt_partitions(int4) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.compact_login_attempts(interval) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.compact_login_attempts(interval) TO service_role;
+
+-- Run the compaction nightly with pg_cron (Database -> Extensions -> pg_cron), or call
+-- backend/tools/compact_login_attempts.py from any scheduler:
+-- SELECT cron.schedule('compact-login-attempts', '15 3 * * *', $$SELECT public.compact_login_attempts()$$);
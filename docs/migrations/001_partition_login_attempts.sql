@@ -0,0 +1,74 @@
+-- Migrates an existing database to the partitioned login_attempts table and the
+-- lockout indexes from docs/database_schema.sql (sections 2 and 9).
+-- Afterwards, run sections 10 and 11 of docs/database_schema.sql to create the
+-- partition maintenance and compaction functions and the daily summary table.
+--
+-- The copy runs in one transaction; on a large table schedule it for a quiet period.
+
+BEGIN;
+
+-- 1. Keep the old table around until the copy is verified
+ALTER TABLE public.login_attempts RENAME TO login_attempts_old;
+ALTER SEQUENCE public.login_attempts_attempt_id_seq RENAME TO login_attempts_old_attempt_id_seq;
+
+-- 2. Partitioned replacement
+CREATE TABLE public.login_attempts (
+  attempt_id bigserial,
+  user_id uuid REFERENCES auth.users(id) ON DELETE CASCADE,
+  username_attempted text,
+  success boolean NOT NULL,
+  failure_reason text,
+  ip_address inet,
+  timestamp timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (attempt_id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE public.login_attempts_default PARTITION OF public.login_attempts DEFAULT;
+
+-- 3. One partition per month that has data, plus the coming months
+DO $$
+DECLARE
+  v_month date;
+  v_name text;
+BEGIN
+  FOR v_month IN
+    SELECT DISTINCT date_trunc('month', COALESCE("timestamp", now()))::date
+    FROM public.login_attempts_old
+    UNION
+    SELECT (date_trunc('month', now()) + make_interval(months => m))::date
+    FROM generate_series(0, 2) AS m
+  LOOP
+    v_name := format('login_attempts_y%sm%s', to_char(v_month, 'YYYY'), to_char(v_month, 'MM'));
+    EXECUTE format(
+      'CREATE TABLE public.%I PARTITION OF public.login_attempts FOR VALUES FROM (%L) TO (%L)',
+      v_name, v_month, (v_month + interval '1 month')::date
+    );
+  END LOOP;
+END;
+$$;
+
+-- 4. Copy the rows and carry the id sequence forward
+INSERT INTO public.login_attempts (attempt_id, user_id, username_attempted, success, failure_reason, ip_address, "timestamp")
+SELECT attempt_id, user_id, username_attempted, success, failure_reason, ip_address, COALESCE("timestamp", now())
+FROM public.login_attempts_old;
+
+SELECT setval(
+  pg_get_serial_sequence('public.login_attempts', 'attempt_id'),
+  GREATEST((SELECT max(attempt_id) FROM public.login_attempts), 1)
+);
+
+-- 5. Indexes (section 9)
+CREATE INDEX login_attempts_user_failures_idx
+  ON public.login_attempts (user_id, "timestamp" DESC)
+  WHERE success = false;
+CREATE INDEX IF NOT EXISTS account_locks_user_locked_at_idx
+  ON public.account_locks (user_id, locked_at DESC);
+CREATE INDEX IF NOT EXISTS profiles_email_idx
+  ON public.profiles (email);
+
+COMMIT;
+
+-- 6. After checking the counts match, drop the old table:
+-- SELECT (SELECT count(*) FROM public.login_attempts_old) AS old_rows,
+--        (SELECT count(*) FROM public.login_attempts) AS new_rows;
+-- DROP TABLE public.login_attempts_old;
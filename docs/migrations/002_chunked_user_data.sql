@@ -0,0 +1,13 @@
+-- Adds the chunked (streamed) storage format for user_data.
+-- Existing rows keep storage_format = 'fernet' and stay readable through /api/access-file.
+
+ALTER TABLE public.user_data
+  ADD COLUMN IF NOT EXISTS storage_format text NOT NULL DEFAULT 'fernet',
+  ADD COLUMN IF NOT EXISTS content_size bigint;
+
+CREATE TABLE IF NOT EXISTS public.user_data_chunks (
+  data_id bigint NOT NULL REFERENCES public.user_data(data_id) ON DELETE CASCADE,
+  seq int4 NOT NULL,
+  chunk bytea NOT NULL,
+  PRIMARY KEY (data_id, seq)
+);
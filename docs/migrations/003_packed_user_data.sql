@@ -0,0 +1,12 @@
+-- Adds the binary 'packed-v1' layout for user_data (see backend/security_logic/record_format.py).
+-- Run after 002_chunked_user_data.sql. Existing rows stay 'fernet' and remain readable;
+-- rewrite them online with:  python -m tools.migrate_user_data_storage   (from backend/)
+
+ALTER TABLE public.user_data
+  ADD COLUMN IF NOT EXISTS data_blob bytea,
+  ALTER COLUMN salt DROP NOT NULL;
+
+-- Lets the migration tool page through the rows that still need rewriting
+CREATE INDEX IF NOT EXISTS user_data_fernet_rows_idx
+  ON public.user_data (data_id)
+  WHERE storage_format = 'fernet';
@@ -0,0 +1,13 @@
+-- Adds per-user data keys for 'envelope-v1' user_data rows (see backend/security_logic/user_keys.py).
+-- Run after 003_packed_user_data.sql. Existing 'fernet' / 'packed-v1' rows stay readable and are
+-- re-encrypted under the user's data key the next time the user opens them.
+-- Until this has run, start the backend with USER_DATA_ENVELOPE=false.
+
+CREATE TABLE IF NOT EXISTS public.user_keys (
+  user_id uuid PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
+  wrapped_key bytea NOT NULL, -- 12-byte nonce followed by the encrypted 32-byte data key
+  kdf_salt bytea NOT NULL,
+  kdf_iterations int4 NOT NULL,
+  created_at timestamptz DEFAULT now(),
+  updated_at timestamptz DEFAULT now()
+);
@@ -0,0 +1,7 @@
+-- Lets wrapped data keys record KDFs other than PBKDF2 (see backend/security_logic/kdf_params.py).
+-- Run after 004_user_keys.sql and before setting KDF_PARAMS to a scrypt value.
+-- user_data needs no change: records keep their KDF parameters inside data_blob.
+
+ALTER TABLE public.user_keys
+  ADD COLUMN IF NOT EXISTS kdf_params text,
+  ALTER COLUMN kdf_iterations DROP NOT NULL;
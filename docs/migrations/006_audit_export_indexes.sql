@@ -0,0 +1,15 @@
+-- Indexes for the admin audit export (GET /api/admin/export/login-attempts, see
+-- backend/routes/admin_routes.py and section 9 of docs/database_schema.sql).
+-- Pages are read in attempt_id order after a filter on the user, the email
+-- attempted or the IP address; without these, each page of a filtered export
+-- scans the whole table.
+--
+-- login_attempts is partitioned, so the indexes cannot be built CONCURRENTLY and
+-- writes to it wait while they are created; on a large table run this in a quiet period.
+
+CREATE INDEX IF NOT EXISTS login_attempts_user_export_idx
+  ON public.login_attempts (user_id, attempt_id);
+CREATE INDEX IF NOT EXISTS login_attempts_email_export_idx
+  ON public.login_attempts (username_attempted, attempt_id);
+CREATE INDEX IF NOT EXISTS login_attempts_ip_export_idx
+  ON public.login_attempts (ip_address, attempt_id);
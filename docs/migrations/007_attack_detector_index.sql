@@ -0,0 +1,11 @@
+-- Index for the attack detector's replay of recent failed logins (each worker
+-- reads the last ATTACK_WINDOW_SECONDS of failures when it starts, see
+-- backend/security_logic/attack_detector.py and tools/replay_attack_detector.py).
+-- Without it, every worker start scans the current month's partition.
+--
+-- login_attempts is partitioned, so the index cannot be built CONCURRENTLY and
+-- writes to it wait while it is created; on a large table run this in a quiet period.
+
+CREATE INDEX IF NOT EXISTS login_attempts_failures_time_idx
+  ON public.login_attempts ("timestamp")
+  WHERE success = false;
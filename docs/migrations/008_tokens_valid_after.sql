@@ -0,0 +1,7 @@
+-- Shared token revocation (see backend/security_logic/token_verifier.py).
+-- A password reset sets tokens_valid_after; access tokens issued before it are
+-- rejected by every server process, not only the one that handled the reset.
+-- Until this has run, revocations only apply in the process that made them.
+
+ALTER TABLE public.profiles
+  ADD COLUMN IF NOT EXISTS tokens_valid_after timestamptz;
@@ -0,0 +1,14 @@
+-- Tells a data key still wrapped under a user's previous password apart from a
+-- wrong password (see backend/security_logic/user_keys.py) without asking
+-- Supabase Auth: a key wrapped before the last password reset is stale.
+-- Until this has run, every password that does not unwrap the key is answered
+-- as a wrong one.
+
+ALTER TABLE public.user_keys
+  ADD COLUMN IF NOT EXISTS wrapped_at timestamptz DEFAULT now();
+
+-- Keys that existed before this column were wrapped no later than their last update
+UPDATE public.user_keys SET wrapped_at = COALESCE(updated_at, created_at, now()) WHERE wrapped_at IS NULL;
+
+ALTER TABLE public.profiles
+  ADD COLUMN IF NOT EXISTS password_changed_at timestamptz;